@@ -0,0 +1,445 @@
+"""
+batched move generation for many games at once with numpy (self-play data generation steps thousands of games
+together). N positions are kept as arrays and every step works on all of them in a few vectorized operations
+instead of N trips through GameState.
+
+a move is one of the NUM_MOVE_SLOTS geometric (start square, end square) pairs a piece could ever make: every
+queen line and every knight jump. a position's moves are a boolean row over the slots, so the moves of the whole
+batch are an (N, NUM_MOVE_SLOTS) mask. the rules are the ones GameState plays (no castling, pawns always promote
+to a queen, en passant) and --check compares every position with GameState.
+
+usage:
+    python ChessBatch.py --bench                       (positions/s for growing batch sizes, and GameState's)
+    python ChessBatch.py --check --batch 64 --plies 80 (compare with GameState on random games)
+"""
+import argparse
+import time
+
+import numpy as np
+
+import ChessEngine
+
+EMPTY = 0
+PIECE_CODES = {piece: i + 1 for i, piece in enumerate(ChessEngine.PIECES)}  # 'wp' = 1 ... 'wK' = 6, 'bp' = 7 ... 'bK' = 12
+CODE_TO_PIECE = ["--"] + list(ChessEngine.PIECES)
+WHITE_PAWN, WHITE_QUEEN, WHITE_KING = PIECE_CODES['wp'], PIECE_CODES['wQ'], PIECE_CODES['wK']
+BLACK_PAWN, BLACK_QUEEN, BLACK_KING = PIECE_CODES['bp'], PIECE_CODES['bQ'], PIECE_CODES['bK']
+COLOR_OF_CODE = np.array([0] + [1] * 6 + [2] * 6, dtype=np.int8)  # 0 empty, 1 white, 2 black
+NO_SQUARE = 64  # no en passant square (SQUARE_BB[NO_SQUARE] is an empty bitboard)
+
+# what a piece needs to make a move along a slot
+KIND_NONE = 0
+KIND_NORMAL = 1  # the end square is empty or an enemy piece
+KIND_PAWN_PUSH = 2  # the end square must be empty
+KIND_PAWN_CAPTURE = 3  # the end square must be an enemy piece or the en passant square
+
+# ChessEngine's bitboard tables as uint64 arrays (bit sq = square sq, a8 = bit 0), with an empty entry for NO_SQUARE
+SQUARE_BB = np.array(ChessEngine.SQUARE_BITS + [0], dtype=np.uint64)
+KNIGHT_BB = np.array(ChessEngine.KNIGHT_ATTACKS, dtype=np.uint64)
+KING_BB = np.array(ChessEngine.KING_ATTACKS, dtype=np.uint64)
+# the squares a pawn of the other color has to stand on to attack a king on sq
+PAWN_ATTACKERS_BB = {'w': np.array(ChessEngine.PAWN_ATTACKS['w'], dtype=np.uint64),
+                     'b': np.array(ChessEngine.PAWN_ATTACKS['b'], dtype=np.uint64)}
+NOT_FILE_A_BB = np.uint64(ChessEngine.NOT_FILE_A)
+NOT_FILE_H_BB = np.uint64(ChessEngine.NOT_FILE_H)
+
+
+"""
+builds the slot tables: start and end square of every slot, the squares between them as a bitboard, and for every
+piece code and square the slots that piece can use from there with the kind of move it makes along them
+"""
+def buildSlotTables():
+    starts, ends, betweens = [], [], []
+    for start in range(64):
+        r, c = divmod(start, 8)
+        for dr, dc in ChessEngine.ROOK_DIRECTIONS + ChessEngine.BISHOP_DIRECTIONS:
+            between = 0
+            endRow, endCol = r + dr, c + dc
+            while 0 <= endRow < 8 and 0 <= endCol < 8:
+                starts.append(start)
+                ends.append(endRow * 8 + endCol)
+                betweens.append(between)
+                between |= 1 << (endRow * 8 + endCol)
+                endRow, endCol = endRow + dr, endCol + dc
+        for dr, dc in ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)):
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                starts.append(start)
+                ends.append((r + dr) * 8 + c + dc)
+                betweens.append(0)
+    moveKinds = {}  # (piece code, slot): kind
+    for slot in range(len(starts)):
+        startRow, startCol = divmod(starts[slot], 8)
+        dr, dc = ends[slot] // 8 - startRow, ends[slot] % 8 - startCol
+        straight, diagonal = dr == 0 or dc == 0, abs(dr) == abs(dc)
+        reaches = {'R': straight, 'N': (abs(dr), abs(dc)) in ((1, 2), (2, 1)), 'B': diagonal, 'Q': straight or diagonal,
+                   'K': max(abs(dr), abs(dc)) == 1}
+        for color, forward, pawnRow in (('w', -1, 6), ('b', 1, 1)):
+            for letter, ok in reaches.items():
+                if ok:
+                    moveKinds[PIECE_CODES[color + letter], slot] = KIND_NORMAL
+            if dc == 0 and (dr == forward or (dr == 2 * forward and startRow == pawnRow)):
+                moveKinds[PIECE_CODES[color + 'p'], slot] = KIND_PAWN_PUSH
+            elif dr == forward and abs(dc) == 1:
+                moveKinds[PIECE_CODES[color + 'p'], slot] = KIND_PAWN_CAPTURE
+    # the slots of every (piece code, square) one after the other, found by key = code * 64 + square
+    pieceSquareSlots = [[] for key in range(13 * 64)]
+    for (code, slot), kind in moveKinds.items():
+        pieceSquareSlots[code * 64 + starts[slot]].append((slot, kind))
+    counts = np.array([len(keySlots) for keySlots in pieceSquareSlots], dtype=np.intp)
+    return (np.array(starts, dtype=np.intp), np.array(ends, dtype=np.intp), np.array(betweens, dtype=np.uint64),
+            np.array([slot for keySlots in pieceSquareSlots for slot, kind in keySlots], dtype=np.intp),
+            np.array([kind for keySlots in pieceSquareSlots for slot, kind in keySlots], dtype=np.int8),
+            np.cumsum(counts) - counts, counts)
+
+
+SLOT_START, SLOT_END, SLOT_BETWEEN, PIECE_SLOTS, PIECE_SLOT_KINDS, PIECE_SLOTS_FIRST, PIECE_SLOTS_COUNT = buildSlotTables()
+NUM_MOVE_SLOTS = len(SLOT_START)
+SLOT_NOTATION = [ChessEngine.Move.fromSquares(int(SLOT_START[slot]), int(SLOT_END[slot]), "--", "--").getChessNotation()
+                 for slot in range(NUM_MOVE_SLOTS)]
+SLOT_BY_NOTATION = {notation: slot for slot, notation in enumerate(SLOT_NOTATION)}
+
+
+"""
+one uint64 bitboard per piece code and board: (N, 13), column 0 (empty squares) included so codes index it directly
+"""
+def pieceBitboards(boards):
+    onehot = boards[:, None, :] == np.arange(13, dtype=np.int8)[:, None]  # (N, 13 codes, 64 squares)
+    return np.packbits(onehot, axis=2, bitorder='little').view('<u8')[:, :, 0]  # 8 bytes per code, square 0 = lowest bit
+
+
+"""
+squares a slider on the squares of bits attacks in one direction with occupancy occupied (kogge-stone fill, every
+array element is its own board)
+"""
+def slidingFill(bits, occupied, direction):
+    shift = direction[0] * 8 + direction[1]
+    wrap = NOT_FILE_A_BB if direction[1] == 1 else NOT_FILE_H_BB if direction[1] == -1 else np.uint64(ChessEngine.ALL_SQUARES)
+    if shift > 0:
+        step = lambda b, n: b << np.uint64(shift * n)
+    else:
+        step = lambda b, n: b >> np.uint64(-shift * n)
+    empty = ~occupied & wrap  # squares the fill may pass through, wrapped files taken out
+    bits = bits | (empty & step(bits, 1))
+    empty &= step(empty, 1)
+    bits |= empty & step(bits, 2)
+    empty &= step(empty, 2)
+    bits |= empty & step(bits, 4)
+    return step(bits, 1) & wrap
+
+
+def rookAttacks(bits, occupied):
+    attacks = np.zeros_like(bits)
+    for direction in ChessEngine.ROOK_DIRECTIONS:
+        attacks |= slidingFill(bits, occupied, direction)
+    return attacks
+
+
+def bishopAttacks(bits, occupied):
+    attacks = np.zeros_like(bits)
+    for direction in ChessEngine.BISHOP_DIRECTIONS:
+        attacks |= slidingFill(bits, occupied, direction)
+    return attacks
+
+
+"""
+whether each king (kingBits, on kingSquares) is attacked. enemy has the enemy p R N B Q K bitboards in columns 0-5,
+white is True where the king is white
+"""
+def kingAttacked(kingBits, kingSquares, occupied, enemy, white):
+    pawnAttackers = np.where(white, PAWN_ATTACKERS_BB['w'][kingSquares], PAWN_ATTACKERS_BB['b'][kingSquares])
+    attacked = (pawnAttackers & enemy[:, 0]) | (KNIGHT_BB[kingSquares] & enemy[:, 2]) | (KING_BB[kingSquares] & enemy[:, 5])
+    attacked |= rookAttacks(kingBits, occupied) & (enemy[:, 1] | enemy[:, 4])
+    attacked |= bishopAttacks(kingBits, occupied) & (enemy[:, 3] | enemy[:, 4])
+    return attacked != 0
+
+
+"""
+own pieces pinned to their king: the first own piece in a direction from the king with an enemy slider of that
+direction right behind it
+"""
+def pinnedPieces(kingBits, occupied, own, enemy):
+    pinned = np.zeros_like(kingBits)
+    for directions, sliders in ((ChessEngine.ROOK_DIRECTIONS, enemy[:, 1] | enemy[:, 4]),
+                                (ChessEngine.BISHOP_DIRECTIONS, enemy[:, 3] | enemy[:, 4])):
+        for direction in directions:
+            blocker = slidingFill(kingBits, occupied, direction) & own
+            behind = slidingFill(kingBits, occupied ^ blocker, direction) & sliders
+            pinned |= np.where(behind != 0, blocker, np.uint64(0))
+    return pinned
+
+
+"""
+plays one move on each row of boards (changes the array in place). slots has one slot per row, the moves must be
+pseudo legal. returns the new en passant squares (NO_SQUARE for none) and whether each move was a pawn move or a capture
+"""
+def playSlots(boards, enpassant, slots):
+    rows = np.arange(len(boards))
+    start, end = SLOT_START[slots], SLOT_END[slots]
+    piece = boards[rows, start]
+    isPawn = (piece == WHITE_PAWN) | (piece == BLACK_PAWN)
+    isCapture = boards[rows, end] != EMPTY
+    # en passant: a pawn moving diagonally onto the en passant square takes the pawn beside its start square
+    isEnpassant = isPawn & (end == enpassant) & (start % 8 != end % 8)
+    boards[rows[isEnpassant], start[isEnpassant] // 8 * 8 + end[isEnpassant] % 8] = EMPTY
+    # pawns reaching the last row become queens
+    promotes = isPawn & ((end < 8) | (end >= 56))
+    piece = np.where(promotes, np.where(piece == WHITE_PAWN, WHITE_QUEEN, BLACK_QUEEN), piece)
+    boards[rows, start] = EMPTY
+    boards[rows, end] = piece
+    newEnpassant = np.where(isPawn & (np.abs(end - start) == 16), (start + end) // 2, NO_SQUARE)
+    return newEnpassant, isPawn | isCapture | isEnpassant
+
+
+class BatchState():
+    """
+    fens: the starting positions, one per board
+    """
+    def __init__(self, fens):
+        count = len(fens)
+        self.boards = np.zeros((count, 64), dtype=np.int8)  # piece code per square
+        self.whiteToMove = np.ones(count, dtype=bool)
+        self.enpassant = np.full(count, NO_SQUARE, dtype=np.intp)
+        self.halfmoveClock = np.zeros(count, dtype=np.int32)
+        self.fullmoveNumber = np.ones(count, dtype=np.int32)
+        for i, fen in enumerate(fens):
+            self.setPosition(i, fen)
+
+    @classmethod
+    def fromStart(cls, count):
+        return cls([ChessEngine.START_FEN] * count)
+
+    def __len__(self):
+        return len(self.boards)
+
+    """
+    puts a position in board i (the fen is read and checked by GameState)
+    """
+    def setPosition(self, i, fen):
+        gs = ChessEngine.GameState(fen)
+        self.boards[i] = [PIECE_CODES.get(piece, EMPTY) for piece in gs.squares]
+        self.whiteToMove[i] = gs.whiteToMove
+        self.enpassant[i] = NO_SQUARE if gs.enpassantPossible == () else gs.enpassantPossible[0] * 8 + gs.enpassantPossible[1]
+        self.halfmoveClock[i] = gs.halfmoveClock
+        self.fullmoveNumber[i] = gs.fullmoveNumber
+
+    def getFen(self, i):
+        rows = []
+        for r in range(8):
+            row = ""
+            empty = 0
+            for code in self.boards[i, r * 8:r * 8 + 8]:
+                if code == EMPTY:
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                piece = CODE_TO_PIECE[code]
+                letter = ChessEngine.PIECE_TO_FEN[piece[1]]
+                row += letter if piece[0] == 'w' else letter.lower()
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        enpassant = '-'
+        if self.enpassant[i] != NO_SQUARE:
+            enpassant = ChessEngine.Move.colsToFiles[self.enpassant[i] % 8] + ChessEngine.Move.rowsToRanks[self.enpassant[i] // 8]
+        return "/".join(rows) + (" w " if self.whiteToMove[i] else " b ") + "- " + enpassant + \
+            " " + str(self.halfmoveClock[i]) + " " + str(self.fullmoveNumber[i])
+
+    def toGameState(self, i):
+        return ChessEngine.GameState(self.getFen(i))
+
+    """
+    the pseudo legal moves of every board (the moves of GameState.getAllPossibleMoves: the king may be left in check)
+    as two arrays (board index, slot), sorted by board. also returns the piece bitboards they were made from
+    """
+    def pseudoLegalMoves(self):
+        boards = self.boards
+        bitboards = pieceBitboards(boards)
+        white = np.bitwise_or.reduce(bitboards[:, 1:7], axis=1)
+        black = np.bitwise_or.reduce(bitboards[:, 7:13], axis=1)
+        occupied = white | black
+        own = np.where(self.whiteToMove, white, black)
+        enemy = occupied ^ own
+        # every piece of the side to move with the slots that piece can use from its square
+        pieceRows, pieceSquares = np.nonzero(COLOR_OF_CODE[boards] == np.where(self.whiteToMove, 1, 2)[:, None])
+        keys = boards[pieceRows, pieceSquares].astype(np.intp) * 64 + pieceSquares
+        counts = PIECE_SLOTS_COUNT[keys]
+        firsts = np.cumsum(counts) - counts
+        rows = np.repeat(pieceRows, counts)
+        flat = np.repeat(PIECE_SLOTS_FIRST[keys] - firsts, counts) + np.arange(counts.sum())
+        slots, kind = PIECE_SLOTS[flat], PIECE_SLOT_KINDS[flat]
+        endBits = SQUARE_BB[SLOT_END[slots]]
+        ok = (SLOT_BETWEEN[slots] & occupied[rows]) == 0  # nothing in the way
+        ok &= np.where(kind == KIND_NORMAL, (endBits & own[rows]) == 0,
+                       np.where(kind == KIND_PAWN_PUSH, (endBits & occupied[rows]) == 0,
+                                ((endBits & enemy[rows]) != 0) | (SLOT_END[slots] == self.enpassant[rows])))
+        return rows[ok], slots[ok], bitboards
+
+    """
+    the legal moves of every board as two arrays (board index, slot), sorted by board.
+    a move of a piece that isn't pinned, when the king isn't in check, is always legal. the rest (king moves, pinned
+    pieces, en passant and every move out of check) are played on the bitboards of their board (occupancy, the
+    captured piece, the king square) and dropped if the mover's king is attacked afterwards
+    """
+    def legalMoves(self):
+        rows, slots, bitboards = self.pseudoLegalMoves()
+        white = self.whiteToMove
+        ownBoards = np.where(white[:, None], bitboards[:, 1:7], bitboards[:, 7:13])  # codes p R N B Q K in columns 0-5
+        enemyBoards = np.where(white[:, None], bitboards[:, 7:13], bitboards[:, 1:7])
+        own = np.bitwise_or.reduce(ownBoards, axis=1)
+        occupied = own | np.bitwise_or.reduce(enemyBoards, axis=1)
+        kingBits = ownBoards[:, 5]
+        kingSquares = np.argmax(self.boards == np.where(white, WHITE_KING, BLACK_KING)[:, None], axis=1)
+        inCheck = kingAttacked(kingBits, kingSquares, occupied, enemyBoards, white)
+        pinned = pinnedPieces(kingBits, occupied, own, enemyBoards)
+        start, end = SLOT_START[slots], SLOT_END[slots]
+        piece = self.boards[rows, start]
+        startBits, endBits = SQUARE_BB[start], SQUARE_BB[end]
+        isKing = (piece == WHITE_KING) | (piece == BLACK_KING)
+        isEnpassant = ((piece == WHITE_PAWN) | (piece == BLACK_PAWN)) & (end == self.enpassant[rows]) & (start % 8 != end % 8)
+        legal = ~(inCheck[rows] | isKing | isEnpassant | ((startBits & pinned[rows]) != 0))
+        # the moves that need the full test, played on the bitboards
+        test = np.nonzero(~legal)[0]
+        testRows, startBits, endBits, isEnpassant = rows[test], startBits[test], endBits[test], isEnpassant[test]
+        epBits = SQUARE_BB[np.where(isEnpassant, start[test] // 8 * 8 + end[test] % 8, NO_SQUARE)]  # the pawn en passant takes
+        occupiedAfter = (occupied[testRows] & ~startBits | endBits) & ~epBits
+        enemyAfter = enemyBoards[testRows] & ~(endBits | epBits)[:, None]
+        kingAfter = np.where(isKing[test], endBits, kingBits[testRows])
+        squareAfter = np.where(isKing[test], end[test], kingSquares[testRows])
+        legal[test] = ~kingAttacked(kingAfter, squareAfter, occupiedAfter, enemyAfter, white[testRows])
+        return rows[legal], slots[legal]
+
+    def movesToMask(self, rows, slots):
+        mask = np.zeros((len(self.boards), NUM_MOVE_SLOTS), dtype=bool)
+        mask[rows, slots] = True
+        return mask
+
+    """
+    (N, NUM_MOVE_SLOTS) mask of the pseudo legal moves
+    """
+    def pseudoLegalMask(self):
+        rows, slots, bitboards = self.pseudoLegalMoves()
+        return self.movesToMask(rows, slots)
+
+    """
+    (N, NUM_MOVE_SLOTS) mask of the legal moves
+    """
+    def legalMask(self):
+        return self.movesToMask(*self.legalMoves())
+
+    """
+    plays slots[i] on board i, boards with a negative slot are left alone
+    """
+    def applyMoves(self, slots):
+        slots = np.asarray(slots, dtype=np.intp)
+        rows = np.nonzero(slots >= 0)[0]
+        boards = self.boards[rows]
+        newEnpassant, resetsClock = playSlots(boards, self.enpassant[rows], slots[rows])
+        self.boards[rows] = boards
+        self.enpassant[rows] = newEnpassant
+        self.halfmoveClock[rows] = np.where(resetsClock, 0, self.halfmoveClock[rows] + 1)
+        self.fullmoveNumber[rows] += ~self.whiteToMove[rows]  # a full move ends after black
+        self.whiteToMove[rows] = ~self.whiteToMove[rows]
+
+    """
+    a random legal move (slot) per board, -1 where the board has none (checkmate or stalemate).
+    moves is (board index, slot) from legalMoves, made here when it isn't given
+    """
+    def randomMoves(self, rng, moves=None):
+        rows, slots = self.legalMoves() if moves is None else moves
+        if len(slots) == 0:
+            return np.full(len(self.boards), -1, dtype=np.intp)
+        counts = np.bincount(rows, minlength=len(self.boards))
+        firsts = np.cumsum(counts) - counts  # where each board's moves start in slots
+        picks = np.minimum(firsts + (rng.random(len(counts)) * counts).astype(np.intp), len(slots) - 1)
+        return np.where(counts > 0, slots[picks], -1)
+
+    def moveNotations(self, mask, i):
+        return sorted(SLOT_NOTATION[slot] for slot in np.nonzero(mask[i])[0])
+
+
+"""
+plays random games on a batch and compares every position with GameState: the pseudo legal and legal moves, and the
+fen after each move. returns the number of positions checked, raises AssertionError at the first difference
+"""
+def checkAgainstGameState(batchSize=64, plies=80, seed=1):
+    rng = np.random.default_rng(seed)
+    batch = BatchState.fromStart(batchSize)
+    checked = 0
+    for ply in range(plies):
+        pseudo = batch.pseudoLegalMask()
+        legalMoves = batch.legalMoves()
+        legal = batch.movesToMask(*legalMoves)
+        slots = batch.randomMoves(rng, legalMoves)
+        expectedFens = {}
+        for i in range(batchSize):
+            fen = batch.getFen(i)
+            gs = ChessEngine.GameState(fen)
+            expected = sorted(move.getChessNotation() for move in gs.getAllPossibleMoves())
+            assert batch.moveNotations(pseudo, i) == expected, "pseudo legal moves differ in " + fen
+            validMoves = {move.getChessNotation(): move for move in gs.getValidMoves()}
+            assert batch.moveNotations(legal, i) == sorted(validMoves), "legal moves differ in " + fen
+            if slots[i] >= 0:
+                gs.makeMove(validMoves[SLOT_NOTATION[slots[i]]])
+                expectedFens[i] = gs.getFen()
+            checked += 1
+        batch.applyMoves(slots)
+        for i, expectedFen in expectedFens.items():
+            assert batch.getFen(i) == expectedFen, "position after the move differs: " + batch.getFen(i) + " " + expectedFen
+        for i in np.nonzero(slots < 0)[0]:  # finished games start again
+            batch.setPosition(i, ChessEngine.START_FEN)
+    return checked
+
+
+"""
+positions/s of legal move generation plus one random move per board, for every batch size, next to GameState doing
+the same one position at a time. returns a list of (batch size, positions per second)
+"""
+def benchmark(batchSizes=(1, 16, 256, 1024, 4096), plies=40, seed=1):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for batchSize in batchSizes:
+        batch = BatchState.fromStart(batchSize)
+        start = time.perf_counter()
+        for ply in range(plies):
+            slots = batch.randomMoves(rng)
+            batch.applyMoves(slots)
+            for i in np.nonzero(slots < 0)[0]:
+                batch.setPosition(i, ChessEngine.START_FEN)
+        elapsed = time.perf_counter() - start
+        rows.append((batchSize, batchSize * plies / elapsed))
+        print("batch " + str(batchSize) + ": " + format(rows[-1][1], ",.0f") + " positions/s")
+    # the same work for GameState, one game at a time
+    gs = ChessEngine.GameState()
+    gameRng = np.random.default_rng(seed)
+    positions = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < 1.0:
+        validMoves = gs.getValidMoves()
+        if validMoves:
+            gs.makeMove(validMoves[int(gameRng.integers(len(validMoves)))])
+        else:
+            gs = ChessEngine.GameState()
+        positions += 1
+    print("GameState one at a time: " + format(positions / (time.perf_counter() - start), ",.0f") + " positions/s")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="numpy batch move generation over many boards")
+    parser.add_argument("--bench", action="store_true", help="positions/s for growing batch sizes")
+    parser.add_argument("--check", action="store_true", help="compare with GameState on random games")
+    parser.add_argument("--batch", type=int, default=64, help="boards for --check")
+    parser.add_argument("--plies", type=int, default=40, help="moves played on every board")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    if args.check:
+        print(str(checkAgainstGameState(args.batch, args.plies, args.seed)) + " positions match GameState")
+    if args.bench or not args.check:
+        benchmark(plies=args.plies, seed=args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,270 @@
+"""
+opening book: a sorted binary file of (position hash, move) entries built from pgn games, probed through mmap with a
+binary search. the file is only ever read, so every process that opens it (search workers, the gui's background
+search, uci engines) shares the same pages of the OS page cache instead of loading its own copy.
+
+file layout, all little endian:
+    header  8 bytes magic "CHBOOK01", 8 bytes entry count
+    entries 16 bytes each, sorted by key and then by games (most played first):
+        8 bytes  key     GameState.zobristKey of the position before the move
+        2 bytes  move    start and end square of the move (ChessTransposition.encodeMove)
+        2 bytes  games   games that played the move here, capped at 65535
+        4 bytes  points  half points scored by the side that played it (win 2, draw 1, loss 0)
+
+usage:
+    python ChessBook.py build games1.pgn games2.pgn --out book.bin --plies 20 --min-games 2 --workers 4
+    python ChessBook.py probe book.bin [--fen "<fen>"]
+    python ChessBook.py bench book.bin --probes 100000
+"""
+import argparse
+import mmap
+import multiprocessing
+import random
+import struct
+import time
+
+import ChessEngine
+import ChessPgn
+import ChessTransposition
+
+MAGIC = b"CHBOOK01"
+HEADER = struct.Struct("<8sQ")
+ENTRY = struct.Struct("<QHHI")  # key, move, games, points
+KEY = struct.Struct("<Q")
+DEFAULT_PLIES = 20  # book moves taken from the start of each game
+MAX_GAMES = 0xFFFF
+RESULT_POINTS = {'1-0': (2, 0), '0-1': (0, 2), '1/2-1/2': (1, 1)}  # half points of (white, black)
+
+
+class BookEntry():
+    __slots__ = ('move', 'games', 'points')
+
+    def __init__(self, move, games, points):
+        self.move = move  # a Move from the position's getValidMoves()
+        self.games = games
+        self.points = points
+
+    @property
+    def score(self):  # share of the points the move scored, 0.0 - 1.0
+        return self.points / (2.0 * self.games) if self.games else 0.0
+
+    def __repr__(self):
+        return self.move.getChessNotation() + " (" + str(self.games) + " games, " + format(self.score * 100, ".0f") + "%)"
+
+
+class OpeningBook():
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = f.seek(0, 2)
+            if size < HEADER.size:
+                raise ValueError(path + " is not an opening book")
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)  # stays valid after the file is closed
+        magic, self.count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or HEADER.size + self.count * ENTRY.size != size:
+            self.data.close()
+            raise ValueError(path + " is not an opening book")
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    """
+    (moveCode, games, points) of every book move of the position with this key, most played first. a binary search
+    for the first entry of the key, so a probe reads about log2(count) entries
+    """
+    def probe(self, key):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, HEADER.size + middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        offset = HEADER.size + low * ENTRY.size
+        end = HEADER.size + self.count * ENTRY.size
+        while offset < end:
+            entryKey, moveCode, games, points = ENTRY.unpack_from(self.data, offset)
+            if entryKey != key:
+                break
+            found.append((moveCode, games, points))
+            offset += ENTRY.size
+        return found
+
+    """
+    the book moves of gs as BookEntry objects, only those that are legal in gs (a hash collision can't give an illegal
+    move). validMoves can be passed in when the caller already has them
+    """
+    def getEntries(self, gs, validMoves=None):
+        found = self.probe(gs.zobristKey)
+        if not found:
+            return []
+        if validMoves is None:
+            validMoves = gs.getValidMoves()
+        entries = []
+        for moveCode, games, points in found:
+            move = ChessTransposition.findMove(validMoves, moveCode)
+            if move is not None:
+                entries.append(BookEntry(move, games, points))
+        return entries
+
+    """
+    a book move for gs or None when the position isn't in the book. picked at random weighted by how often it was
+    played, so the engine doesn't always play the same opening; best=True always takes the most played move
+    """
+    def chooseMove(self, gs, validMoves=None, rng=random, best=False):
+        entries = self.getEntries(gs, validMoves)
+        if not entries:
+            return None
+        if best:
+            return entries[0].move
+        return rng.choices(entries, weights=[entry.games for entry in entries])[0].move
+
+
+"""
+pool task of buildBook: the book moves of one pgn file as {(key, moveCode): [games, points]} plus the games read.
+a game is used up to its first move the engine can't play (castling, underpromotion) or can't read
+"""
+def collectFile(task):
+    path, plies = task
+    counts = {}
+    gamesRead = 0
+    for game in ChessPgn.readGames(path):
+        gamesRead += 1
+        whitePoints, blackPoints = RESULT_POINTS.get(game.result, (0, 0))
+        counted = game.result in RESULT_POINTS  # an unfinished game adds to the games but not to the points
+        try:
+            gs = game.startState()
+            for san in game.moves[:plies]:
+                move = ChessPgn.parseSan(gs, san)
+                stats = counts.setdefault((gs.zobristKey, ChessTransposition.encodeMove(move)), [0, 0])
+                stats[0] += 1
+                if counted:
+                    stats[1] += whitePoints if gs.whiteToMove else blackPoints
+                gs.makeMove(move)
+        except ValueError:  # UnsupportedMoveError included
+            continue
+    return counts, gamesRead
+
+
+"""
+writes entries {(key, moveCode): [games, points]} as a sorted book file, returns the number of entries written
+"""
+def writeBook(path, counts, minGames=1):
+    entries = [(key, -games, moveCode, points) for (key, moveCode), (games, points) in counts.items() if games >= minGames]
+    entries.sort()
+    data = bytearray(HEADER.size + len(entries) * ENTRY.size)
+    HEADER.pack_into(data, 0, MAGIC, len(entries))
+    offset = HEADER.size
+    for key, negativeGames, moveCode, points in entries:
+        games = -negativeGames
+        if games > MAX_GAMES:  # keep the score of a capped move right
+            points = points * MAX_GAMES // games
+            games = MAX_GAMES
+        ENTRY.pack_into(data, offset, key, moveCode, games, points)
+        offset += ENTRY.size
+    with open(path, 'wb') as f:
+        f.write(data)
+    return len(entries)
+
+
+"""
+builds a book from pgn files, the files are read on a process pool (one file per task) and merged. prints the build
+time with games/s and entries/s, returns the number of entries
+"""
+def buildBook(paths, outPath, plies=DEFAULT_PLIES, minGames=1, workers=None):
+    start = time.perf_counter()
+    counts = {}
+    gamesRead = 0
+    tasks = [(path, plies) for path in paths]
+    if len(tasks) == 1:
+        results = [collectFile(tasks[0])]  # no pool to start for a single file
+    else:
+        pool = multiprocessing.Pool(min(workers or multiprocessing.cpu_count(), len(tasks)))
+        results = pool.imap_unordered(collectFile, tasks)
+    for fileCounts, fileGames in results:
+        gamesRead += fileGames
+        for key, (games, points) in fileCounts.items():
+            stats = counts.get(key)
+            if stats is None:
+                counts[key] = [games, points]
+            else:
+                stats[0] += games
+                stats[1] += points
+    if len(tasks) > 1:
+        pool.close()
+        pool.join()
+    readTime = time.perf_counter() - start
+    entries = writeBook(outPath, counts, minGames)
+    elapsed = time.perf_counter() - start
+    print(str(gamesRead) + " games read in " + format(readTime, ".2f") + "s (" +
+          format(gamesRead / readTime if readTime > 0 else 0, ",.0f") + " games/s), " + str(len(counts)) + " moves seen")
+    print(str(entries) + " entries (" + str(HEADER.size + entries * ENTRY.size) + " bytes) sorted and written to " +
+          outPath + " in " + format(elapsed - readTime, ".2f") + "s, build time " + format(elapsed, ".2f") + "s (" +
+          format(entries / elapsed if elapsed > 0 else 0, ",.0f") + " entries/s)")
+    return entries
+
+
+"""
+probes the book with the positions of random games played from the book itself, prints probes/s
+"""
+def runBench(path, probes):
+    with OpeningBook(path) as book:
+        rng = random.Random(0)
+        keys = []
+        gs = ChessEngine.GameState()
+        while len(keys) < min(probes, 10000):
+            keys.append(gs.zobristKey)
+            move = book.chooseMove(gs, rng=rng)
+            if move is None:
+                gs = ChessEngine.GameState()
+            else:
+                gs.makeMove(move)
+        hits = 0
+        start = time.perf_counter()
+        for i in range(probes):
+            if book.probe(keys[i % len(keys)]):
+                hits += 1
+        elapsed = time.perf_counter() - start
+    print(str(probes) + " probes of a " + str(len(book)) + " entry book in " + format(elapsed, ".3f") + "s (" +
+          format(probes / elapsed if elapsed > 0 else 0, ",.0f") + " probes/s, " + str(hits) + " hits)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build and probe memory mapped opening books")
+    commands = parser.add_subparsers(dest="command", required=True)
+    buildParser = commands.add_parser("build", help="build a book from pgn files")
+    buildParser.add_argument("files", nargs="+")
+    buildParser.add_argument("--out", default="book.bin")
+    buildParser.add_argument("--plies", type=int, default=DEFAULT_PLIES, help="moves taken from the start of each game")
+    buildParser.add_argument("--min-games", type=int, default=1, help="leave out moves played in fewer games")
+    buildParser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    probeParser = commands.add_parser("probe", help="the book moves of a position")
+    probeParser.add_argument("book")
+    probeParser.add_argument("--fen", default=ChessEngine.START_FEN)
+    benchParser = commands.add_parser("bench", help="probes per second")
+    benchParser.add_argument("book")
+    benchParser.add_argument("--probes", type=int, default=100000)
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        buildBook(args.files, args.out, args.plies, args.min_games, args.workers)
+    elif args.command == "probe":
+        with OpeningBook(args.book) as book:
+            entries = book.getEntries(ChessEngine.GameState(args.fen))
+            print(" ".join(repr(entry) for entry in entries) if entries else "not in the book")
+    else:
+        runBench(args.book, args.probes)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
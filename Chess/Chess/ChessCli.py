@@ -0,0 +1,86 @@
+"""
+headless command line entry point for analysis and batch jobs. it only imports ChessEngine and the other pure logic
+modules, never pygame, so it starts fast on machines without a display or SDL.
+
+usage (from this folder):
+    python ChessCli.py perft --suite --depth 3
+    python ChessCli.py search --depth 4
+    python ChessCli.py parallel batch --depth 3 --workers 4
+    python ChessCli.py batch --bench
+    python ChessCli.py pgn replay games.pgn --workers 4
+    python ChessCli.py uci
+    python ChessCli.py server bench --sessions 1000 --concurrency 100
+    python ChessCli.py book build games.pgn --out book.bin
+    python ChessCli.py tablebase generate --dir tablebases
+    python ChessCli.py tournament --engine name=new,depth=3 --engine name=old,depth=2 --games 1000 --pgn games.pgn
+    python ChessCli.py moves --fen "<fen>"
+    python ChessCli.py moves --file positions.txt      (one fen per line)
+or the same with python -m ChessCli ...
+"""
+import argparse
+import importlib
+import sys
+
+import ChessEngine
+
+# commands that are whole tools with their own main(argv), imported only when they're used
+TOOLS = {
+    'perft': ('ChessPerft', "perft node counts and speed"),
+    'search': ('ChessSearch', "alpha-beta search of one position"),
+    'parallel': ('ChessParallel', "multi core search, batch analysis and scaling report"),
+    'batch': ('ChessBatch', "numpy move generation over many boards at once (needs numpy)"),
+    'pgn': ('ChessPgn', "SAN moves, pgn replay and indexing of game databases"),
+    'uci': ('ChessUci', "uci protocol engine over stdin/stdout for chess guis and tournament managers"),
+    'server': ('ChessServer', "asyncio server for many concurrent games, with a load generator"),
+    'book': ('ChessBook', "build and probe memory mapped opening books"),
+    'tablebase': ('ChessTablebase', "generate and probe KQK / KRK / KPK endgame tables"),
+    'tournament': ('ChessTournament', "engine vs engine matches on a process pool, with Elo and SPRT"),
+}
+
+
+"""
+prints the legal moves (or just how many with --count) of every position, one line per position
+"""
+def moves(args):
+    fens = [args.fen] if args.fen else []
+    if args.file:
+        with open(args.file) as f:
+            fens.extend(line.strip() for line in f if line.strip())
+    if not fens:
+        fens.append(ChessEngine.START_FEN)
+    for fen in fens:
+        try:
+            gs = ChessEngine.GameState(fen)
+        except ValueError as error:
+            print("error: " + str(error))
+            continue
+        validMoves = gs.getValidMoves()
+        status = " checkmate" if gs.checkMate else " stalemate" if gs.staleMate else ""
+        if args.count:
+            print(fen + " | " + str(len(validMoves)) + status)
+        else:
+            print(fen + " | " + " ".join(sorted(move.getChessNotation() for move in validMoves)) + status)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="headless ChessEngine tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, (module, description) in TOOLS.items():
+        commands.add_parser(name, add_help=False, help=description + " (see " + module + ".py --help)")
+    movesParser = commands.add_parser("moves", help="list the legal moves of positions")
+    movesParser.add_argument("--fen", help="a position in FEN")
+    movesParser.add_argument("--file", help="a file with one FEN per line")
+    movesParser.add_argument("--count", action="store_true", help="only print how many legal moves there are")
+    argv = sys.argv[1:] if argv is None else argv
+    # the tools that have their own main get the rest of the command line as it is
+    if argv and argv[0] in TOOLS:
+        return importlib.import_module(TOOLS[argv[0]][0]).main(argv[1:])
+    args = parser.parse_args(argv)
+    if args.command == "moves":
+        return moves(args)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
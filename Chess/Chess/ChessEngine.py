@@ -1,15 +1,198 @@
 """
 this class is responsible for storing all the information about the current stage of a chess game.
 it's also responsible for determining the valid moves at the current state. it will also keep a move log.
+this module is pure game logic, it must not import pygame (or anything else from the gui) so it loads fast on headless machines.
 """
-import pygame as p
+import random
+import time
+
+"""
+bitboard helpers. square index is sq = row * 8 + col, so square 0 is a8 (top left) and square 63 is h1.
+every piece type and colour gets its own 64 bit integer where bit number sq is set if that piece stands on sq.
+"""
+PIECES = ('wp', 'wR', 'wN', 'wB', 'wQ', 'wK', 'bp', 'bR', 'bN', 'bB', 'bQ', 'bK')
+SQUARE_BITS = [1 << sq for sq in range(64)]  # SQUARE_BITS[sq] = the bit of that square
+ALL_SQUARES = (1 << 64) - 1
+LAST_ROWS = 0xFF | 0xFF << 56  # rows 8 and 1, where pawns promote
+NOT_FILE_A = ALL_SQUARES ^ sum(1 << (r * 8) for r in range(8))  # every square except column 0
+NOT_FILE_H = ALL_SQUARES ^ sum(1 << (r * 8 + 7) for r in range(8))  # every square except column 7
+
+
+def buildStepTable(offsets):  # one mask per square with every square reachable in a single (row, col) step
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        for dr, dc in offsets:
+            if 0 <= r + dr <= 7 and 0 <= c + dc <= 7:
+                mask |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(mask)
+    return table
+
+
+def buildRayTable(direction):  # one mask per square with every square from sq to the edge of the board (sq excluded)
+    dr, dc = direction
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        r, c = r + dr, c + dc
+        while 0 <= r <= 7 and 0 <= c <= 7:
+            mask |= 1 << (r * 8 + c)
+            r, c = r + dr, c + dc
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = buildStepTable(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = buildStepTable(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+# PAWN_ATTACKS[color][sq] = the squares a pawn of that color on sq captures on (white pawns capture towards row 0)
+PAWN_ATTACKS = {'w': buildStepTable(((-1, -1), (-1, 1))), 'b': buildStepTable(((1, -1), (1, 1)))}
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))  # up, left , down, right (r, c)
+BISHOP_DIRECTIONS = ((1, -1), (1, 1), (-1, -1), (-1, 1))  # down left , down right, up left, up right
+RAYS = {d: buildRayTable(d) for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+# rays that go towards higher square numbers find their first blocker with the lowest bit, the others with the highest bit
+RAY_IS_INCREASING = {d: d[0] * 8 + d[1] > 0 for d in RAYS}
+# the enemy sliders that can attack along a direction
+RAY_SLIDERS = {d: ('R', 'Q') if d in ROOK_DIRECTIONS else ('B', 'Q') for d in RAYS}
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1"  # castling isn't supported so the castling field is always "-"
+FEN_TO_PIECE = {'P': 'p', 'R': 'R', 'N': 'N', 'B': 'B', 'Q': 'Q', 'K': 'K'}  # fen letter (upper case) to our piece letter
+PIECE_TO_FEN = {v: k for k, v in FEN_TO_PIECE.items()}
+
+"""
+a move is packed into one int (Move.moveID):
+    bits  0-5   start square (row * 8 + col)
+    bits  6-11  end square
+    bit   12    en passant capture
+    bit   13    pawn promotion (always to a queen)
+"""
+MOVE_SQUARES = 0xFFF  # start and end square, enough to tell two legal moves of a position apart
+ENPASSANT_FLAG = 1 << 12
+PROMOTION_FLAG = 1 << 13
+
+
+def packMove(startSq, endSq, pieceMoved, isEnpassantMove=False):
+    moveID = startSq | endSq << 6
+    if isEnpassantMove:
+        moveID |= ENPASSANT_FLAG
+    elif pieceMoved[1] == 'p' and (endSq < 8 or endSq >= 56):  # a pawn reaching the last row
+        moveID |= PROMOTION_FLAG
+    return moveID
+
+"""
+zobrist hashing: every (piece, square) pair, black to move and every en passant column get a random 64 bit number,
+and the hash of a position is the xor of the numbers of everything in it. the seed is fixed so the same position
+has the same hash in every process and every run (caches and opening books can be saved and shared).
+"""
+zobristRandom = random.Random(2024)
+ZOBRIST_PIECE_KEYS = {piece: [zobristRandom.getrandbits(64) for sq in range(64)] for piece in PIECES}
+ZOBRIST_BLACK_TO_MOVE = zobristRandom.getrandbits(64)
+ZOBRIST_ENPASSANT_KEYS = [zobristRandom.getrandbits(64) for col in range(8)]  # one per column of the en passant square
+del zobristRandom
+
+"""
+material + piece square tables, in centipawns. the tables are written the way the board is printed, row 0 = rank 8,
+from white's point of view; black uses the same tables with the rows flipped. GameState keeps the sum of
+PIECE_SQUARE_SCORES over its pieces in evalScore (white positive), updated by putPiece/removePiece/movePiece, so
+evaluating a position is one attribute read instead of a pass over the board.
+"""
+MATERIAL_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+PIECE_SQUARE_TABLES = {
+    'p': (0, 0, 0, 0, 0, 0, 0, 0,
+          50, 50, 50, 50, 50, 50, 50, 50,
+          10, 10, 20, 30, 30, 20, 10, 10,
+          5, 5, 10, 25, 25, 10, 5, 5,
+          0, 0, 0, 20, 20, 0, 0, 0,
+          5, -5, -10, 0, 0, -10, -5, 5,
+          5, 10, 10, -20, -20, 10, 10, 5,
+          0, 0, 0, 0, 0, 0, 0, 0),
+    'N': (-50, -40, -30, -30, -30, -30, -40, -50,
+          -40, -20, 0, 0, 0, 0, -20, -40,
+          -30, 0, 10, 15, 15, 10, 0, -30,
+          -30, 5, 15, 20, 20, 15, 5, -30,
+          -30, 0, 15, 20, 20, 15, 0, -30,
+          -30, 5, 10, 15, 15, 10, 5, -30,
+          -40, -20, 0, 5, 5, 0, -20, -40,
+          -50, -40, -30, -30, -30, -30, -40, -50),
+    'B': (-20, -10, -10, -10, -10, -10, -10, -20,
+          -10, 0, 0, 0, 0, 0, 0, -10,
+          -10, 0, 5, 10, 10, 5, 0, -10,
+          -10, 5, 5, 10, 10, 5, 5, -10,
+          -10, 0, 10, 10, 10, 10, 0, -10,
+          -10, 10, 10, 10, 10, 10, 10, -10,
+          -10, 5, 0, 0, 0, 0, 5, -10,
+          -20, -10, -10, -10, -10, -10, -10, -20),
+    'R': (0, 0, 0, 0, 0, 0, 0, 0,
+          5, 10, 10, 10, 10, 10, 10, 5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          0, 0, 0, 5, 5, 0, 0, 0),
+    'Q': (-20, -10, -10, -5, -5, -10, -10, -20,
+          -10, 0, 0, 0, 0, 0, 0, -10,
+          -10, 0, 5, 5, 5, 5, 0, -10,
+          -5, 0, 5, 5, 5, 5, 0, -5,
+          0, 0, 5, 5, 5, 5, 0, -5,
+          -10, 5, 5, 5, 5, 5, 0, -10,
+          -10, 0, 5, 0, 0, 0, 0, -10,
+          -20, -10, -10, -5, -5, -10, -10, -20),
+    'K': (-30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -20, -30, -30, -40, -40, -30, -30, -20,
+          -10, -20, -20, -20, -20, -20, -20, -10,
+          20, 20, 0, 0, 0, 0, 20, 20,
+          20, 30, 10, 0, 0, 10, 30, 20)}
+PIECE_SQUARE_SCORES = {}  # piece ('wp' ... 'bK'): 64 scores, material included, positive for white
+for piece in PIECES:
+    table = PIECE_SQUARE_TABLES[piece[1]]
+    if piece[0] == 'w':
+        PIECE_SQUARE_SCORES[piece] = [MATERIAL_VALUES[piece[1]] + table[sq] for sq in range(64)]
+    else:
+        PIECE_SQUARE_SCORES[piece] = [-(MATERIAL_VALUES[piece[1]] + table[sq ^ 56]) for sq in range(64)]
+del piece, table
+
+
+def slidingAttacks(sq, directions, occupied):  # squares a slider on sq attacks, stopping at (and including) the first blocker
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if RAY_IS_INCREASING[d]:
+                blockerSq = (blockers & -blockers).bit_length() - 1
+            else:
+                blockerSq = blockers.bit_length() - 1
+            ray ^= RAYS[d][blockerSq]  # cut the ray behind the blocker
+        attacks |= ray
+    return attacks
+
+
 class GameState():
-    def __init__(self):
-        # board is an 8x8 2d list, each element of the list has 2 characters.
-        # the first character represent the color of the piece 'b' or 'w'
-        # the 2nd character represent the type of the piece 'k' 'Q' 'R' 'b' 'n' 'p'
-        # the "--" represent an empty space with no pieces.
-        self.board = [          # this is a one big list with row lists inside of it
+    # when True, reading zobristHash recomputes the hash from scratch and raises if the incremental one drifted
+    debugZobrist = False
+
+    # the same check for the running evaluation: reading evaluation compares evalScore with computeEvaluation
+    debugEvaluation = False
+
+    # getValidMoves uses the pin and check aware generator (getLegalMoves) when this is True, and the old
+    # make/undo filter (getValidMovesByFiltering) when it's False. set it on one GameState or on the class to compare them.
+    useLegalGenerator = True
+
+    # how many positions getValidMoves remembers the moves of (0 = off). with it on, going back to a position (undo)
+    # gives the same MoveList again without generating it. the gui turns it on, searches keep it off
+    moveCacheSize = 0
+
+    def __init__(self, fen=None):  # fen = optional position to start from instead of the normal starting position
+        # board is stored as bitboards: one 64 bit integer for each piece ('wp', 'bK' ...) plus occupancy masks per color.
+        # squares is the same position as a flat list of 64 two character strings ("--" for an empty square),
+        # it's used to find what piece stands on a square without testing all 12 bitboards.
+        # self.board is still available as the old 8x8 2d list (see the board property below).
+        startBoard = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
             ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
             ["--", "--", "--", "--", "--", "--", "--", "--"],
@@ -18,41 +201,245 @@ class GameState():
             ["--", "--", "--", "--", "--", "--", "--", "--"],
             ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]]
-        self.moveFunctions = {'p': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves,
-                              'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves} # dictionary to call on a piece function by his key
         self.whiteToMove = True  # white's turn
-        self.movelog = []  # list contains something like that [(x, y), (x, y), "board"] = one iteration
+        self.movelog = []  # list of Move objects, one for each move made
         self.WhiteKnightLocation = (7, 4)
         self.BlackKnightLocation = (0, 4)
-        self.checkmate = False
-        self.stalemate = False
+        self.checkMate = False
+        self.staleMate = False
         self.enpassantPossible = () # coordinates for the square where en passant capture is possible
+        self.enpassantLog = []  # enpassantPossible before every move in the movelog so undoMove can put it back
+        self.moveCache = {}  # zobristKey: (MoveList, checkMate, staleMate), oldest first, see moveCacheSize
+        self.halfmoveClock = 0  # fen bookkeeping: moves since the last capture or pawn move, and the move number, both at the start of the movelog
+        self.fullmoveNumber = 1
+        self.setBoard(startBoard)
+        if fen is not None:
+            self.loadFen(fen)
+
+    """
+    fills the bitboards, occupancy masks and squares list from an 8x8 2d list of pieces
+    """
+    def setBoard(self, board):
+        self.zobristKey = 0
+        self.evalScore = 0  # putPiece adds every piece's score
+        self.pieceBitboards = {piece: 0 for piece in PIECES}
+        self.colorBitboards = {'w': 0, 'b': 0}
+        self.squares = ["--"] * 64
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece != "--":
+                    self.putPiece(piece, r * 8 + c)
+                    if piece == 'wK':
+                        self.WhiteKnightLocation = (r, c)
+                    elif piece == 'bK':
+                        self.BlackKnightLocation = (r, c)
+        self.occupied = self.colorBitboards['w'] | self.colorBitboards['b']
+        self.zobristKey = self.computeZobristHash()
+
+    """
+    sets the position from a FEN string, for example START_FEN. the castling field is read but ignored
+    """
+    def loadFen(self, fen):
+        fields = fen.split()
+        rows = fields[0].split('/') if fields else []
+        if len(rows) != 8 or len(fields) < 2 or fields[1] not in ('w', 'b'):
+            raise ValueError("invalid FEN: " + fen)
+        board = []
+        for row in rows:
+            boardRow = []
+            for ch in row:
+                if ch.isdigit():  # a digit is a run of empty squares
+                    boardRow.extend(["--"] * int(ch))
+                elif ch.upper() in FEN_TO_PIECE:
+                    boardRow.append(('w' if ch.isupper() else 'b') + FEN_TO_PIECE[ch.upper()])
+                else:
+                    raise ValueError("invalid FEN piece " + repr(ch) + ": " + fen)
+            if len(boardRow) != 8:
+                raise ValueError("invalid FEN row " + repr(row) + ": " + fen)
+            board.append(boardRow)
+        if sum(row.count('wK') for row in board) != 1 or sum(row.count('bK') for row in board) != 1:
+            raise ValueError("FEN needs exactly one king per side: " + fen)
+        if any(piece[1] == 'p' for piece in board[0] + board[7]):
+            raise ValueError("FEN has a pawn on the first or last rank: " + fen)
+        enpassant = fields[3] if len(fields) > 3 else '-'
+        # the en passant square is behind a pawn that just moved two squares: rank 6 with white to move, 3 with black
+        if enpassant != '-' and (len(enpassant) != 2 or enpassant[0] not in Move.filesToCols or
+                                 enpassant[1] != ('6' if fields[1] == 'w' else '3')):
+            raise ValueError("invalid FEN en passant square " + repr(enpassant) + ": " + fen)
+        self.setBoard(board)
+        self.whiteToMove = fields[1] == 'w'
+        # the side that just moved can't have left its king in check, the side to move would take the king
+        waiting = 'b' if self.whiteToMove else 'w'
+        if self.attackersTo(self.pieceBitboards[waiting + 'K'].bit_length() - 1, 'w' if self.whiteToMove else 'b',
+                            self.occupied):
+            raise ValueError("FEN has the side not to move in check: " + fen)
+        self.enpassantPossible = ()
+        if enpassant != '-':
+            self.enpassantPossible = (Move.ranksToRows[enpassant[1]], Move.filesToCols[enpassant[0]])
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+        self.fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        self.movelog = []
+        self.enpassantLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.zobristKey = self.computeZobristHash()  # side to move and en passant changed after setBoard
+
+    """
+    the current position as a FEN string
+    """
+    def getFen(self):
+        rows = []
+        for r in range(8):
+            row = ""
+            empty = 0
+            for piece in self.squares[r * 8:r * 8 + 8]:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                letter = PIECE_TO_FEN[piece[1]]
+                row += letter if piece[0] == 'w' else letter.lower()
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        enpassant = '-'
+        if self.enpassantPossible != ():
+            enpassant = Move.colsToFiles[self.enpassantPossible[1]] + Move.rowsToRanks[self.enpassantPossible[0]]
+        # the clocks aren't kept up to date by makeMove, they're worked out from the movelog when asked for
+        halfmoveClock = self.halfmoveClock
+        for move in self.movelog:
+            halfmoveClock = 0 if move.pieceMoved[1] == 'p' or move.pieceCaptured != "--" else halfmoveClock + 1
+        if (len(self.movelog) % 2 == 0) == self.whiteToMove:  # the log started with a white move
+            blackMovesPlayed = len(self.movelog) // 2
+        else:
+            blackMovesPlayed = (len(self.movelog) + 1) // 2
+        return "/".join(rows) + (" w " if self.whiteToMove else " b ") + "- " + enpassant + \
+            " " + str(halfmoveClock) + " " + str(self.fullmoveNumber + blackMovesPlayed)
+
+    """
+    compatibility view for code that still reads the board as a 2d list (the gui, Move(startsq, endsq, board)).
+    it's rebuilt from the squares list on every access, so it's read only - changes to it don't reach the game state.
+    """
+    @property
+    def board(self):
+        squares = self.squares
+        return [squares[i:i + 8] for i in range(0, 64, 8)]
+
+    """
+    64 bit zobrist hash of the position (pieces, side to move and en passant square). it's kept up to date by
+    makeMove/undoMove, so equal positions give equal hashes no matter how they were reached.
+    """
+    @property
+    def zobristHash(self):
+        if self.debugZobrist and self.zobristKey != self.computeZobristHash():
+            raise AssertionError("incremental zobrist hash " + hex(self.zobristKey) + " doesn't match the position " + self.getFen())
+        return self.zobristKey
+
+    """
+    the zobrist hash worked out from scratch, setBoard/loadFen use it and debugZobrist compares against it
+    """
+    def computeZobristHash(self):
+        key = 0
+        for sq, piece in enumerate(self.squares):
+            if piece != "--":
+                key ^= ZOBRIST_PIECE_KEYS[piece][sq]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT_KEYS[self.enpassantPossible[1]]
+        return key
+
+    """
+    material + piece square score of the position in centipawns, positive when white is better. it's kept up to date
+    by makeMove/undoMove (promotions and en passant go through putPiece/removePiece like every other change)
+    """
+    @property
+    def evaluation(self):
+        if self.debugEvaluation and self.evalScore != self.computeEvaluation():
+            raise AssertionError("incremental evaluation " + str(self.evalScore) + " doesn't match the position " +
+                                 self.getFen() + " (" + str(self.computeEvaluation()) + ")")
+        return self.evalScore
+
+    """
+    the evaluation worked out from scratch by going over the 8x8 board, debugEvaluation compares against it
+    """
+    def computeEvaluation(self):
+        score = 0
+        for r, row in enumerate(self.board):
+            for c, piece in enumerate(row):
+                if piece != "--":
+                    score += PIECE_SQUARE_SCORES[piece][r * 8 + c]
+        return score
+
+    # the three functions below keep the bitboards, the squares list, the zobrist hash and the evaluation in sync,
+    # makeMove/undoMove only use these. the occupied mask is not touched here, the callers refresh it once per move.
+    def putPiece(self, piece, sq):
+        bit = SQUARE_BITS[sq]
+        self.pieceBitboards[piece] |= bit
+        self.colorBitboards[piece[0]] |= bit
+        self.squares[sq] = piece
+        self.zobristKey ^= ZOBRIST_PIECE_KEYS[piece][sq]
+        self.evalScore += PIECE_SQUARE_SCORES[piece][sq]
+
+    def removePiece(self, sq):
+        piece = self.squares[sq]
+        bit = SQUARE_BITS[sq]
+        self.pieceBitboards[piece] ^= bit
+        self.colorBitboards[piece[0]] ^= bit
+        self.squares[sq] = "--"
+        self.zobristKey ^= ZOBRIST_PIECE_KEYS[piece][sq]
+        self.evalScore -= PIECE_SQUARE_SCORES[piece][sq]
+        return piece
 
-    # takes a move as a parameter and excutes it ( this will not work for castling, and en-passant, pawn promotion)
+    def movePiece(self, fromSq, toSq):
+        piece = self.squares[fromSq]
+        bits = SQUARE_BITS[fromSq] | SQUARE_BITS[toSq]
+        self.pieceBitboards[piece] ^= bits
+        self.colorBitboards[piece[0]] ^= bits
+        self.squares[fromSq] = "--"
+        self.squares[toSq] = piece
+        keys = ZOBRIST_PIECE_KEYS[piece]
+        self.zobristKey ^= keys[fromSq] ^ keys[toSq]
+        scores = PIECE_SQUARE_SCORES[piece]
+        self.evalScore += scores[toSq] - scores[fromSq]
+
+    # takes a move as a parameter and excutes it (castling is not supported, pawns always promote to a queen)
     def makeMove(self, move):   # move = object of Move
-        self.board[move.startRow][move.startCol] = "--"  # once a piece left his square, the square becomes empty hence "--"
-        self.board[move.endRow][move.endCol] = move.pieceMoved  # the moved piece in his new position
+        moveID = move.moveID
+        startSq = moveID & 63
+        endSq = (moveID >> 6) & 63
+        if moveID & ENPASSANT_FLAG:
+            self.removePiece((startSq & ~7) | (endSq & 7))  # capturing the pawn, it's beside us and not on the landing square
+        elif move.pieceCaptured != "--":
+            self.removePiece(endSq)
+        self.movePiece(startSq, endSq)
+        # pawn promotion
+        if moveID & PROMOTION_FLAG: # checks to see if the pawn has reached the end of the board and if it's a pawn ( returns true)
+            self.removePiece(endSq)
+            self.putPiece(move.pieceMoved[0] + 'Q', endSq)  # color of the piece plus a queen so pawn promotes to a queen
+        self.occupied = self.colorBitboards['w'] | self.colorBitboards['b']
         self.movelog.append(move) # log the move so we can undo it later or display the history of the logs
         self.whiteToMove = not self.whiteToMove # swap players (white to black) for example.
-            # updates the kings location
+        # updates the kings location
         if move.pieceMoved == 'wK':
-            self.WhiteKnightLocation = (move.endRow, move.endCol)
+            self.WhiteKnightLocation = divmod(endSq, 8)
         elif move.pieceMoved == 'bK':
-            self.BlackKnightLocation = (move.endRow, move.endCol)
-
-        # pawn promotion
-        if move.isPawnPromotion: # checks to see if the pawn has reached the end of the board and if it's a pawn ( returns true)
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'  # color of the piece plus a queen so pawn promotes to a queen
-
-        # en passant move
-        if move.isEnpassantMove:
-            self.board[move.startRow][move.endCol] = '--' # capturing the pawn
+            self.BlackKnightLocation = divmod(endSq, 8)
 
         # update enpassantPossible variable
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2: # only on two square pawn advances
-            self.enpassantPossible = ((move.startRow + move.endRow) // 2, move.startCol)
+        self.enpassantLog.append(self.enpassantPossible)
+        key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE  # the side to move changed
+        if self.enpassantPossible != ():
+            key ^= ZOBRIST_ENPASSANT_KEYS[self.enpassantPossible[1]]  # the old en passant square is gone
+        if move.pieceMoved[1] == 'p' and abs(startSq - endSq) == 16: # only on two square pawn advances
+            self.enpassantPossible = ((startSq + endSq) >> 4, startSq & 7)
+            key ^= ZOBRIST_ENPASSANT_KEYS[startSq & 7]
         else:
             self.enpassantPossible = ()
+        self.zobristKey = key
 
 
 
@@ -61,35 +448,181 @@ class GameState():
     """
 
 
-    def undoMove(self): 
+    def undoMove(self):
         if len(self.movelog) != 0: # make sure that there is a move to undo
             move = self.movelog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            moveID = move.moveID
+            startSq = moveID & 63
+            endSq = (moveID >> 6) & 63
+            if moveID & PROMOTION_FLAG:  # take the queen off and put the pawn back before moving it home
+                self.removePiece(endSq)
+                self.putPiece(move.pieceMoved, endSq)
+            self.movePiece(endSq, startSq)
+            if moveID & ENPASSANT_FLAG:  # the captured pawn goes back beside the start square, the landing square stays blank
+                self.putPiece(move.pieceCaptured, (startSq & ~7) | (endSq & 7))
+            elif move.pieceCaptured != "--":
+                self.putPiece(move.pieceCaptured, endSq)
+            self.occupied = self.colorBitboards['w'] | self.colorBitboards['b']
             self.whiteToMove = not self.whiteToMove
             #update the king's location
             if move.pieceMoved == 'wK':
-                self.WhiteKnightLocation = (move.startRow, move.startCol)
-                print(self.WhiteKnightLocation)
+                self.WhiteKnightLocation = divmod(startSq, 8)
             elif move.pieceMoved == 'bK':
-                self.BlackKnightLocation = (move.startRow, move.startCol)
-            # undo the en passant move
-            if move.isEnpassantMove:
-                self.board[move.endRow][move.endCol] = "--" # leave the landing square blank
-                self.board[move.startRow][move.endCol] = move.pieceCaptured
-                self.enpassantPossible = (move.endRow, move.endCol)
-            # undo a 2 square pawn advance
-            if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-                self.enpassantPossible = ()
+                self.BlackKnightLocation = divmod(startSq, 8)
+            key = self.zobristKey ^ ZOBRIST_BLACK_TO_MOVE
+            if self.enpassantPossible != ():
+                key ^= ZOBRIST_ENPASSANT_KEYS[self.enpassantPossible[1]]
+            self.enpassantPossible = self.enpassantLog.pop()
+            if self.enpassantPossible != ():
+                key ^= ZOBRIST_ENPASSANT_KEYS[self.enpassantPossible[1]]
+            self.zobristKey = key
 
 
     """
-    ALL moves considering checks
+    ALL moves considering checks, as a MoveList. with moveCacheSize set the list of a position that was seen
+    recently is given back as it is, so it must not be changed by the caller
     """
     def getValidMoves(self):
+        if self.moveCacheSize:
+            cached = self.moveCache.get(self.zobristKey)
+            if cached is not None:
+                moves, self.checkMate, self.staleMate = cached
+                return moves
+        moves = self.getLegalMoves() if self.useLegalGenerator else MoveList(self.getValidMovesByFiltering())
+        if self.moveCacheSize:
+            while len(self.moveCache) >= self.moveCacheSize:
+                del self.moveCache[next(iter(self.moveCache))]  # forget the oldest position
+            self.moveCache[self.zobristKey] = (moves, self.checkMate, self.staleMate)
+        return moves
+
+    """
+    legal moves without making them: pins, checkers and the squares that answer a check are worked out once,
+    then every piece only generates moves that keep the king safe.
+    """
+    def getLegalMoves(self):
+        if self.whiteToMove:
+            color, enemyColor, kingRow, kingCol = 'w', 'b', self.WhiteKnightLocation[0], self.WhiteKnightLocation[1]
+        else:
+            color, enemyColor, kingRow, kingCol = 'b', 'w', self.BlackKnightLocation[0], self.BlackKnightLocation[1]
+        kingSq = kingRow * 8 + kingCol
+        checkers, checkMask, pinLines = self.checkForPinsAndChecks(kingSq, color)
+        moves = MoveList()
+        # the king may go to any square the enemy doesn't attack. the king is taken off the board first so
+        # it can't hide behind itself when stepping back along the line of a checking rook/bishop/queen
+        enemyAttacks = self.attackedSquares(enemyColor, self.occupied ^ SQUARE_BITS[kingSq])
+        self.getKingMoves(kingRow, kingCol, moves, ALL_SQUARES ^ enemyAttacks)
+        if not checkers & (checkers - 1):  # with two checkers only the king can move
+            squares = self.squares
+            epSq = self.enpassantPossible[0] * 8 + self.enpassantPossible[1] if self.enpassantPossible != () else -1
+            own = self.colorBitboards[color] ^ SQUARE_BITS[kingSq]
+            while own:
+                bit = own & -own
+                own ^= bit
+                sq = bit.bit_length() - 1
+                allowed = checkMask & pinLines.get(sq, ALL_SQUARES)  # pinned pieces can only move along the pin
+                piece = squares[sq][1]
+                if piece == 'p' and epSq != -1:
+                    # en passant takes two pawns off one row, so it gets its own check
+                    if self.enpassantIsLegal(sq, epSq):
+                        allowed |= SQUARE_BITS[epSq]
+                    else:
+                        allowed &= ~SQUARE_BITS[epSq]
+                if allowed:
+                    r, c = divmod(sq, 8)
+                    self.moveFunctions[piece](self, r, c, moves, allowed)
+        if len(moves) == 0:  # no legal move: it's checkmate if we're in check, otherwise stalemate
+            self.checkMate = checkers != 0
+            self.staleMate = checkers == 0
+        else:
+            self.checkMate = False
+            self.staleMate = False
+        return moves
+
+    """
+    walks outward from the king on square kingSq (color 'w' or 'b') and finds:
+    checkers - bitboard of the enemy pieces giving check
+    checkMask - squares a non king move must land on to answer the check (everything when not in check)
+    pinLines - {square of a pinned piece: the squares it may still move to (between the king and the pinner, pinner included)}
+    """
+    def checkForPinsAndChecks(self, kingSq, color):
+        enemyColor = 'b' if color == 'w' else 'w'
+        squares = self.squares
+        occupied = self.occupied
+        checkers = 0
+        checkMask = 0
+        pinLines = {}
+        for d, ray in RAYS.items():
+            ray = ray[kingSq]
+            blockers = ray & occupied
+            if not blockers:
+                continue
+            increasing = RAY_IS_INCREASING[d]
+            firstSq = (blockers & -blockers).bit_length() - 1 if increasing else blockers.bit_length() - 1
+            firstPiece = squares[firstSq]
+            if firstPiece[0] == enemyColor:
+                if firstPiece[1] in RAY_SLIDERS[d]:  # an enemy slider looking straight at the king
+                    checkers |= SQUARE_BITS[firstSq]
+                    checkMask |= ray ^ RAYS[d][firstSq]
+            else:  # our own piece, it's pinned if an enemy slider is right behind it
+                behind = blockers ^ SQUARE_BITS[firstSq]
+                if behind:
+                    secondSq = (behind & -behind).bit_length() - 1 if increasing else behind.bit_length() - 1
+                    secondPiece = squares[secondSq]
+                    if secondPiece[0] == enemyColor and secondPiece[1] in RAY_SLIDERS[d]:
+                        pinLines[firstSq] = ray ^ RAYS[d][secondSq]
+        knightCheckers = KNIGHT_ATTACKS[kingSq] & self.pieceBitboards[enemyColor + 'N']
+        # an enemy pawn attacks the king from the squares our own pawn would capture on from the king's square
+        pawnCheckers = PAWN_ATTACKS[color][kingSq] & self.pieceBitboards[enemyColor + 'p']
+        checkers |= knightCheckers | pawnCheckers
+        checkMask |= knightCheckers | pawnCheckers  # a knight or pawn check can only be answered by capturing it
+        if not checkers:
+            checkMask = ALL_SQUARES
+        return checkers, checkMask, pinLines
+
+    """
+    bitboard of every square the pieces of color attack, sliders stop at the pieces in occupied
+    """
+    def attackedSquares(self, color, occupied):
+        bitboards = self.pieceBitboards
+        pawns = bitboards[color + 'p']
+        if color == 'w':  # white pawns capture towards row 0
+            attacks = ((pawns & NOT_FILE_A) >> 9) | ((pawns & NOT_FILE_H) >> 7)
+        else:
+            attacks = (((pawns & NOT_FILE_A) << 7) | ((pawns & NOT_FILE_H) << 9)) & ALL_SQUARES
+        for piece, table in ((color + 'N', KNIGHT_ATTACKS), (color + 'K', KING_ATTACKS)):
+            pieces = bitboards[piece]
+            while pieces:
+                bit = pieces & -pieces
+                pieces ^= bit
+                attacks |= table[bit.bit_length() - 1]
+        queens = bitboards[color + 'Q']
+        for sliders, directions in ((bitboards[color + 'R'] | queens, ROOK_DIRECTIONS), (bitboards[color + 'B'] | queens, BISHOP_DIRECTIONS)):
+            while sliders:
+                bit = sliders & -sliders
+                sliders ^= bit
+                attacks |= slidingAttacks(bit.bit_length() - 1, directions, occupied)
+        return attacks
+
+    """
+    checks that the en passant capture of the pawn on fromSq doesn't leave our king in check.
+    the occupancy after the capture is built by hand (two pawns leave, one arrives) and the king square is tested on it.
+    """
+    def enpassantIsLegal(self, fromSq, epSq):
+        color, enemyColor = ('w', 'b') if self.whiteToMove else ('b', 'w')
+        if not PAWN_ATTACKS[color][fromSq] & SQUARE_BITS[epSq]:
+            return False  # this pawn isn't next to the pawn that just moved two squares
+        capturedBit = SQUARE_BITS[epSq + (8 if self.whiteToMove else -8)]
+        occupied = (self.occupied ^ SQUARE_BITS[fromSq] ^ capturedBit) | SQUARE_BITS[epSq]
+        kingRow, kingCol = self.WhiteKnightLocation if self.whiteToMove else self.BlackKnightLocation
+        return not self.attackersTo(kingRow * 8 + kingCol, enemyColor, occupied) & ~capturedBit
+
+    """
+    the original way of finding the valid moves: make every possible move and throw away the ones that leave the king in check
+    """
+    def getValidMovesByFiltering(self):
         tempEnPassantPossible = self.enpassantPossible
         #1) generate all possible moves
-        moves = self.getAllPossibleMoves() # list of possible moves [(x, y), (x, y), self.board] .. ..
+        moves = self.getAllPossibleMoves() # list of possible moves
         #2 for each move, make the move
         for i in range(len(moves)-1, -1, -1):
             self.makeMove(moves[i]) # everytime I make a move it changes turn
@@ -126,158 +659,147 @@ class GameState():
     determine if the enemy can attack the square r, c
     """
     def squareUnderAttack(self, r, c): # for example r, c is the position of a king under attack
-        self.whiteToMove = not self.whiteToMove # switch to the opponent's turn
-        oppMoves = self.getAllPossibleMoves()
-        self.whiteToMove = not self.whiteToMove  # we switched turns to check at the start opp moves ( so we switching back)
-        for move in oppMoves:
-            if move.endRow == r and move.endCol == c: #if one of the oppmoves can be positioned on a king
-                return True # true if the king is under attack
-        return False # false if the king is NOT under attack
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        return self.attackersTo(r * 8 + c, enemyColor, self.occupied) != 0 # true if the square is under attack
+
+    """
+    bitboard of the pieces of color that attack square sq, sliders are blocked by the pieces in occupied.
+    instead of generating the enemy's moves we look outward from sq: a knight attacks sq if a knight on sq would
+    attack the knight, a rook attacks sq if a rook on sq would reach it, and so on. no Move objects are made.
+    """
+    def attackersTo(self, sq, color, occupied):
+        bitboards = self.pieceBitboards
+        queens = bitboards[color + 'Q']
+        attackers = KNIGHT_ATTACKS[sq] & bitboards[color + 'N']
+        attackers |= KING_ATTACKS[sq] & bitboards[color + 'K']
+        attackers |= PAWN_ATTACKS['b' if color == 'w' else 'w'][sq] & bitboards[color + 'p']
+        rooks = bitboards[color + 'R'] | queens
+        if rooks:
+            attackers |= slidingAttacks(sq, ROOK_DIRECTIONS, occupied) & rooks
+        bishops = bitboards[color + 'B'] | queens
+        if bishops:
+            attackers |= slidingAttacks(sq, BISHOP_DIRECTIONS, occupied) & bishops
+        return attackers
 
 
 
     """
     All moves without considering checks
     """
-    def getAllPossibleMoves(self): # goes with a for loop iterates over all the positions in the current board
-        moves = []  # each item in this list will be [Move((x, y), (x, y), self.board)]
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]   # turn = "w" or "b"
-                if (turn == "w" and self.whiteToMove) or (turn == "b" and not self.whiteToMove): # TODO: I used OR, guider used AND
-                    piece = self.board[r][c][1]   # piece = "King" or "Bishop" or "Queen" etc etc..
-                    self.moveFunctions[piece](r, c, moves) # gets all possible moves for that piece (dicitionary being used at the top to call at said piece function ('p' = getPawnMoves) for example
+    def getAllPossibleMoves(self): # goes over the set bits of the side to move instead of all 64 squares
+        moves = []
+        squares = self.squares
+        own = self.colorBitboards['w' if self.whiteToMove else 'b']
+        while own:
+            bit = own & -own # lowest set bit = next piece of ours
+            own ^= bit
+            sq = bit.bit_length() - 1
+            r, c = divmod(sq, 8)
+            self.moveFunctions[squares[sq][1]](self, r, c, moves) # gets all possible moves for that piece (dicitionary being used at the top to call at said piece function ('p' = getPawnMoves) for example
         return moves
 
+    """
+    turns a bitboard of target squares into Move objects from the square sq
+    """
+    def addMoves(self, sq, targets, moves):
+        squares = self.squares
+        pieceMoved = squares[sq]
+        if pieceMoved[1] == 'p' and targets & LAST_ROWS:  # promotions get their flag from packMove
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                endSq = bit.bit_length() - 1
+                moves.append(Move.fromSquares(sq, endSq, pieceMoved, squares[endSq]))
+            return
+        newMove = Move.__new__  # the common case skips fromSquares and packMove, a move is just three slots
+        append = moves.append
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            endSq = bit.bit_length() - 1
+            move = newMove(Move)
+            move.moveID = sq | endSq << 6
+            move.pieceMoved = pieceMoved
+            move.pieceCaptured = squares[endSq]
+            append(move)
+
     """
     get all the pawn moves for the pawn located at row, col and add these moves to the list
     """
-    def getPawnMoves(self, r, c, moves):  # the r, c, moves = [] are being used from the function above ^
-        if self.whiteToMove:# white pawn turn
-            if self.board[r-1][c] == "--":  # 1 square pawn advance (checks to see if the up square is empty )
-                moves.append(Move((r, c), (r-1, c), self.board)) # adds the move to the list of valid moves above
-                if r == 6 and self.board[r-2][c] == "--": # if the pawn at his starting location (row = 6) and two square up is empty
-                    moves.append(Move((r, c), (r-2, c), self.board))
-            if c - 1 >= 0: # capture to the left
-                if self.board[r-1][c-1][0] == "b": # enemy piece to capture
-                    moves.append(Move((r, c), (r-1, c-1), self.board))
-                elif (r-1, c-1) == self.enpassantPossible: # enpassantpossible = tuple (x, y)
-                    moves.append(Move((r, c), (r-1, c-1), self.board, isEnpassantMove=True))
-            if c + 1 <= 7: # capture to the right
-                if self.board[r-1][c + 1][0] == "b": # enemy piece to capture
-                    moves.append(Move((r, c), (r-1, c+1), self.board))
-                elif (r-1, c+1) == self.enpassantPossible:  # enpassantpossible = tuple (x, y)
-                    moves.append(Move((r, c), (r-1, c+1), self.board, isEnpassantMove=True))
-        else: # Black's turn to move
-            if self.board[r+1][c] == "--": # moves forward once square
-                moves.append(Move((r, c), (r+1, c), self.board))
-                if r == 1 and self.board[r+2][c] == "--": # moves forward 2nd square
-                    moves.append(Move((r, c), (r+2, c), self.board))
-            if c + 1 <= 7:  # capture to the right
-                if self.board[r+1][c+1][0] == "w": # enemy piece to capture
-                    moves.append(Move((r, c), (r+1, c+1), self.board))
-                elif (r+1, c+1) == self.enpassantPossible: # enpassantpossible = tuple (x, y)
-                    moves.append(Move((r, c), (r+1, c+1), self.board, isEnpassantMove=True))
-            if c - 1 >= 0: # capture to the left
-                if self.board[r+1][c-1][0] == "w": # enemy piece to capture
-                    moves.append(Move((r, c), (r+1, c-1), self.board))
-                elif (r+1, c-1) == self.enpassantPossible: # enpassantpossible = tuple (x, y)
-                    moves.append(Move((r, c), (r+1, c-1), self.board, isEnpassantMove=True))
+    def getPawnMoves(self, r, c, moves, allowed=ALL_SQUARES):
+        sq = r * 8 + c
+        occupied = self.occupied
+        if self.whiteToMove:  # white pawns move up the board (towards square 0)
+            step, startRow, enemyColor = -8, 6, 'b'
+        else:
+            step, startRow, enemyColor = 8, 1, 'w'
+        targets = 0
+        oneStep = sq + step
+        if not occupied & SQUARE_BITS[oneStep]:  # 1 square pawn advance (checks to see if the square in front is empty)
+            targets |= SQUARE_BITS[oneStep]
+            if r == startRow and not occupied & SQUARE_BITS[oneStep + step]:  # two square advance from the starting row
+                targets |= SQUARE_BITS[oneStep + step]
+        enemies = self.colorBitboards[enemyColor]
+        for dc in (-1, 1):  # capture to the left and to the right
+            if 0 <= c + dc <= 7:
+                captureSq = oneStep + dc
+                if enemies & SQUARE_BITS[captureSq]:  # enemy piece to capture
+                    targets |= SQUARE_BITS[captureSq]
+                elif divmod(captureSq, 8) == self.enpassantPossible and allowed & SQUARE_BITS[captureSq]:
+                    moves.append(Move.fromSquares(sq, captureSq, self.squares[sq], "--", isEnpassantMove=True))
+        self.addMoves(sq, targets & allowed, moves)
+
     """
     get all the rook moves for the rook located at row, col and add these moves to the list
     """
-    def getRookMoves(self, r, c, moves):
-        enemyColor = "b" if self.whiteToMove else "w"
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1)) # up, left , down, right (r, c)
-        for d in directions:
-            for i in range(1, 8):
-                endRow = r + d[0] * i # ( starting row + direction * square ) = row number
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8: # on board
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--": # empty space valid
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor: # either 'b' or 'w'
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break # breaks the 2nd loop and then goes on to another direction (breaks inner loop)
-                    else: # friend piece invalid ( to not jump over friendly pieces or capture them)
-                        break
-                else: # off board
-                    break
+    def getRookMoves(self, r, c, moves, allowed=ALL_SQUARES):
+        sq = r * 8 + c
+        own = self.colorBitboards['w' if self.whiteToMove else 'b']
+        self.addMoves(sq, slidingAttacks(sq, ROOK_DIRECTIONS, self.occupied) & ~own & allowed, moves) # can't capture friendly pieces
 
     """
     get all the knight moves for the knight located at row, col and add these moves to the list
     """
-    def getKnightMoves(self, r, c, moves):
-        enemyColor = "b" if self.whiteToMove else "w" # row is left right, coln is up down 
-        direction = {"UP_LEFT" :(r-2, c-1), "UP_RIGHT" :(r-2, c+1), "LEFT_UP" :(r-1, c-2), "LEFT_DOWN" :(r+1, c-2), "RIGHT_UP" :(r-1, c+2),
-                      "RIGHT_DOWN": (r+1, c+2), "DOWN_LEFT": (r+2, c-1), "DOWN_RIGHT": (r+2, c+1)}
-        for key, value in direction.items():
-            if (0 <= direction[key][0] <= 7 and 0 <= direction[key][1] <= 7) and\
-                    ((self.board[value[0]][value[1]][0] == enemyColor) or (self.board[value[0]][value[1]] == "--")):
-                moves.append(Move((r, c), (value[0], value[1]), self.board))
-            # the conidition above is to check if the endpiece is within the limit of the board and then if the endpiece is an enemy or an empty space
-            # that way it won't capture friendly pieces.
-            # Knight can skip through pieces so it made the job a bit easier for us
+    def getKnightMoves(self, r, c, moves, allowed=ALL_SQUARES):
+        sq = r * 8 + c
+        own = self.colorBitboards['w' if self.whiteToMove else 'b']
+        self.addMoves(sq, KNIGHT_ATTACKS[sq] & ~own & allowed, moves) # Knight can skip through pieces so only friendly pieces block it
 
     """
     get all the Bishop moves for the bishop located at row, col and add these moves to the list
     """
-    def getBishopMoves(self, r, c, moves):
-        enemyColor = "b" if self.whiteToMove else "w"
-        directions = ((1, -1), (1, 1), (-1, -1), (-1, 1)) # down left , down right, up left, up right
-        for d in directions:
-            for i in range(1, 8):
-                endRow = r + d[0] * i # starting row + end row times square = end x number
-                endCol = c + d[1] * i # starting col + end col times square = end y number
-                if 0 <= endRow <= 7 and 0 <= endCol <= 7: # check to see that it's within the board limit
-                    endMove = self.board[endRow][endCol]    # located the end piece
-                    if endMove == "--":
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endMove[0] == enemyColor: # if the end piece is 'b' or 'w'
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break # breaks once it sees there is an enemy piece ( so we won't jump above it)
-                    else:
-                        break # breaks once it sees friendly piece
-                else: # conidition for a break if it's out of board
-                    break
+    def getBishopMoves(self, r, c, moves, allowed=ALL_SQUARES):
+        sq = r * 8 + c
+        own = self.colorBitboards['w' if self.whiteToMove else 'b']
+        self.addMoves(sq, slidingAttacks(sq, BISHOP_DIRECTIONS, self.occupied) & ~own & allowed, moves)
 
     """
     get all the Queen moves for the queen located at row, col and add these moves to the list
     """
-    def getQueenMoves(self, r, c, moves): # queen is a bishop & rook combined (techniaclly can put self.getRookMoves & self.getBishopMoves)
-        enemyColor = "b" if self.whiteToMove else "w"
-        directions = ((1, -1), (1, 1), (-1, -1), (-1, 1), (-1, 0), (1, 0), (0, -1), (0, 1))
-        for d in directions:
-            for i in range(1, 8):
-                endRow = r + d[0] * i # starting row + end row times square = end x number
-                endCol = c + d[1] * i # starting col + end col times square = end y number
-                if 0 <= endRow <= 7 and 0 <= endCol <= 7:
-                    endpiece = self.board[endRow][endCol]
-                    if endpiece == "--":
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endpiece[0] == enemyColor:
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break # breaks once it sees there is an enemy piece ( so we won't jump above it)
-                    else:
-                        break # breaks once it sees friendly piece
-                else: # conidition for a break if it's out of board
-                    break
+    def getQueenMoves(self, r, c, moves, allowed=ALL_SQUARES): # queen is a bishop & rook combined
+        sq = r * 8 + c
+        own = self.colorBitboards['w' if self.whiteToMove else 'b']
+        self.addMoves(sq, slidingAttacks(sq, ROOK_DIRECTIONS + BISHOP_DIRECTIONS, self.occupied) & ~own & allowed, moves)
 
 
 
     """
     get all the king moves for the king located at row, col and add these moves to the list
     """
-    def getKingMoves(self, r, c, moves):
-        enemyColor = "b" if self.whiteToMove else "w"
-        directions = {"UP_LEFT": (r - 1, c - 1), "UP_RIGHT": (r - 1, c + 1), "LEFT": (r, c - 1), "LEFT_DOWN": (r + 1, c - 1),
-                      "DOWN": (r - 1, c), "DOWN_right": (r + 1, c + 1), "RIGHT": (r, c + 1), "UP": (r-1, c)}
-        for key, value in directions.items():
-            if (0 <= value[0] <= 7 and 0 <= value[1] <= 7) and ((self.board[value[0]][value[1]][0] == enemyColor) or (self.board[value[0]][value[1]] == "--")):
-                moves.append(Move((r, c), (value[0], value[1]), self.board))
+    def getKingMoves(self, r, c, moves, allowed=ALL_SQUARES):
+        sq = r * 8 + c
+        own = self.colorBitboards['w' if self.whiteToMove else 'b']
+        self.addMoves(sq, KING_ATTACKS[sq] & ~own & allowed, moves)
+
+    # dictionary to call on a piece function by his key, called as self.moveFunctions[piece](self, r, c, moves).
+    # it lives on the class, not on each game state, so enableStats / disableStats reach every GameState at once
+    moveFunctions = {'p': getPawnMoves, 'R': getRookMoves, 'N': getKnightMoves,
+                     'B': getBishopMoves, 'Q': getQueenMoves, 'K': getKingMoves}
 
 class Move():
+    # a move is packed into one int, moveID (see MOVE_SQUARES / ENPASSANT_FLAG / PROMOTION_FLAG), plus the two pieces.
+    # __slots__ means no __dict__ per move, the generators make thousands of these for every position
+    __slots__ = ('moveID', 'pieceMoved', 'pieceCaptured')
     # maps keys to values
     # key : value
     ranksToRows = {"1": 7, "2": 6, "3": 5, "4": 4,   # reminder that our positional is 0,0 top left (where right is Y and bottom is X)
@@ -286,38 +808,77 @@ class Move():
     filesToCols = {"a": 0, "b": 1, "c": 2, "d": 3,
                    "e": 4, "f": 5, "g": 6, "h": 7}
     colsToFiles = {v: k for k, v in filesToCols.items()}
-                    # startsq = (x, y) endsq = (x, y) board = big string above
+                    # startsq = (x, y) endsq = (x, y) board = 8x8 2d list (GameState.board)
     def __init__(self, startsq, endsq, board, isEnpassantMove=False):  # start square and end square are tuples (first and last click) boards stands for board state
-        self.startRow = startsq[0]    # coordinates the X
-        self.startCol = startsq[1]    # coordinates the Y
-        self.endRow = endsq[0]        #     same
-        self.endCol = endsq[1]        #     same
-        self.pieceMoved = board[self.startRow][self.startCol]  # could be any piece (king , queen, knight etc.. or even an empty space)
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        # pawn promotion
-        self.isPawnPromotion = False
-        if (self.pieceMoved == 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7): # checks to see if the pieceMoved is a pawn and if it reached the end board
-            self.isPawnPromotion = True # if the pawn reached the end board, returns true for pawn promotion
-        # en passant
-        self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
+        self.pieceMoved = board[startsq[0]][startsq[1]]  # could be any piece (king , queen, knight etc.. or even an empty space)
+        self.pieceCaptured = board[endsq[0]][endsq[1]]
+        self.moveID = packMove(startsq[0] * 8 + startsq[1], endsq[0] * 8 + endsq[1], self.pieceMoved, isEnpassantMove)
+        if isEnpassantMove:
             self.pieceCaptured = 'wp' if self.pieceMoved == 'bp' else 'bp'
 
+    """
+    builds a move straight from square numbers (row * 8 + col) and the pieces on them, the move generators use this
+    so they don't need a 2d board.
+    """
+    @classmethod
+    def fromSquares(cls, startSq, endSq, pieceMoved, pieceCaptured, isEnpassantMove=False):
+        move = cls.__new__(cls)
+        move.moveID = packMove(startSq, endSq, pieceMoved, isEnpassantMove)
+        move.pieceMoved = pieceMoved
+        move.pieceCaptured = ('wp' if pieceMoved == 'bp' else 'bp') if isEnpassantMove else pieceCaptured
+        return move
+
+    # everything below is read from moveID, so a move can't get out of step with itself
+    @property
+    def startSq(self):
+        return self.moveID & 63
 
+    @property
+    def endSq(self):
+        return (self.moveID >> 6) & 63
 
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol # generates a move ID (each ID is unique) used for the __eq__ method below TODO: figure out a way to make it better and cleaner
+    @property
+    def startRow(self):
+        return (self.moveID & 63) >> 3
 
+    @property
+    def startCol(self):
+        return self.moveID & 7
 
+    @property
+    def endRow(self):
+        return (self.moveID >> 9) & 7
 
+    @property
+    def endCol(self):
+        return (self.moveID >> 6) & 7
+
+    @property
+    def isPawnPromotion(self):
+        return self.moveID & PROMOTION_FLAG != 0
+
+    @property
+    def isEnpassantMove(self):
+        return self.moveID & ENPASSANT_FLAG != 0
 
     """
-    overriding the equals method 
+    overriding the equals method. only the squares are compared, so a move the gui builds from two clicks (which
+    doesn't know it's en passant) still equals the generated move with the flag
     """
     def __eq__(self, other):    # since we can't check if an object equals to another object (object(Move) == object(Move) for example, with this method we will be able to
         if isinstance(other, Move): # checks if both of them are objects (other stands for the other object), (Move stands object)
-            return self.moveID == other.moveID   # returns True
+            return (self.moveID ^ other.moveID) & MOVE_SQUARES == 0   # returns True
         return False  # returns False
 
+    def __hash__(self):
+        return self.moveID & MOVE_SQUARES
+
+    def __getstate__(self):  # slots have no __dict__, this keeps moves picklable (the background search sends them)
+        return (self.moveID, self.pieceMoved, self.pieceCaptured)
+
+    def __setstate__(self, state):
+        self.moveID, self.pieceMoved, self.pieceCaptured = state
+
     def getChessNotation(self):   # allows us to see what the move is (A8 >>> B5) for example. always a string
         return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)  # this is two tuples ( start move) (end move)
                                                                                                             # for example (a, 8) >> (b, 5)
@@ -325,10 +886,235 @@ class Move():
         return self.colsToFiles[c] + self.rowsToRanks[r]   # example is "A8" or "B5" etc always a string  so if my tuple is (0, 0) it will give me (a, 8)
 
 
+"""
+the legal moves of one position (what getValidMoves returns). it's a list like before, plus lookups by start
+square and by start and end square that are built the first time they're needed, so finding the moves of a clicked
+piece doesn't scan the whole list
+"""
+class MoveList(list):
+    __slots__ = ('startIndex', 'pairIndex')
 
+    def __init__(self, moves=()):
+        super().__init__(moves)
+        self.startIndex = None  # start square: [moves]
+        self.pairIndex = None  # start | end << 6 (the squares of Move.moveID): move
 
+    def buildIndex(self):
+        self.startIndex = {}
+        self.pairIndex = {}
+        for move in self:
+            self.startIndex.setdefault(move.startSq, []).append(move)
+            self.pairIndex[move.moveID & MOVE_SQUARES] = move
 
+    """
+    the moves of the piece on row r, column c
+    """
+    def fromSquare(self, r, c):
+        if self.startIndex is None:
+            self.buildIndex()
+        return self.startIndex.get(r * 8 + c, [])
+
+    """
+    the move from startsq to endsq ((row, col) tuples like the gui's clicks), None if it isn't legal
+    """
+    def find(self, startsq, endsq):
+        if self.pairIndex is None:
+            self.buildIndex()
+        return self.pairIndex.get(startsq[0] * 8 + startsq[1] | (endsq[0] * 8 + endsq[1]) << 6)
 
 
+"""
+instrumentation: call counters and timers for the hot GameState methods and every move generator down to the
+per-piece ones, Move objects allocated and makeMove calls per second. enableStats swaps the methods on the classes for
+counting / timing wrappers and disableStats puts the originals back, so while it's off the engine runs its own code
+with no extra call and no flag test anywhere. the timers are inclusive: getValidMoves includes the getLegalMoves it
+calls, the generators include the per-piece generators they call, the filtering generator includes its makeMove /
+undoMove / squareUnderAttack calls. the generators call the per-piece ones through GameState.moveFunctions, which is
+rebuilt from the class on every swap, so game states made before and after enableStats are all timed and all go back
+to the plain generators on disableStats.
+makeMove calls aren't nodes: a search also makes the moves of its quiescence and a perft never makes its leaf moves,
+so a caller that counts its own nodes passes them to getStats / printStats for a real nodes per second.
+the generators make their moves with Move.__new__, which can't be swapped back once replaced, so the moves they
+allocate are counted from the lists getLegalMoves / getAllPossibleMoves return, plus every Move.__init__ call.
+"""
+COUNTED_METHODS = ('makeMove', 'undoMove', 'squareUnderAttack')
+TIMED_METHODS = ('getValidMoves', 'getLegalMoves', 'getValidMovesByFiltering', 'getAllPossibleMoves',
+                 'getPawnMoves', 'getRookMoves', 'getKnightMoves', 'getBishopMoves', 'getQueenMoves', 'getKingMoves')
+ALLOCATING_METHODS = ('getLegalMoves', 'getAllPossibleMoves')  # the two generators that make Move objects
 
 
+class EngineStats():
+    def __init__(self):
+        self.originals = None  # method name: the original function while the wrappers are in place
+        self.calls = dict.fromkeys(COUNTED_METHODS + TIMED_METHODS, 0)
+        self.times = dict.fromkeys(TIMED_METHODS, 0.0)  # seconds
+        self.movesAllocated = [0]  # a list so the wrapper can add to it without a lookup on self
+        self.started = time.perf_counter()
+
+    """
+    zeroes the counters in place (the wrappers hold on to the dictionaries) and restarts the clock
+    """
+    def reset(self):
+        for name in self.calls:
+            self.calls[name] = 0
+        for name in self.times:
+            self.times[name] = 0.0
+        self.movesAllocated[0] = 0
+        self.started = time.perf_counter()
+
+
+engineStats = EngineStats()
+
+
+def countedMethod(name, function):
+    calls = engineStats.calls
+
+    def counted(*args, **kwargs):
+        calls[name] += 1
+        return function(*args, **kwargs)
+    counted.__name__ = function.__name__
+    counted.__doc__ = function.__doc__
+    return counted
+
+
+def timedMethod(name, function):
+    calls = engineStats.calls
+    times = engineStats.times
+    movesAllocated = engineStats.movesAllocated if name in ALLOCATING_METHODS else None
+    clock = time.perf_counter
+
+    def timed(*args, **kwargs):
+        calls[name] += 1
+        start = clock()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            times[name] += clock() - start
+        if movesAllocated is not None:
+            movesAllocated[0] += len(result)
+        return result
+    timed.__name__ = function.__name__
+    timed.__doc__ = function.__doc__
+    return timed
+
+
+def countedMoveInit(function):
+    movesAllocated = engineStats.movesAllocated
+
+    def counted(*args, **kwargs):
+        movesAllocated[0] += 1
+        function(*args, **kwargs)
+    return counted
+
+
+def enableStats():
+    if engineStats.originals is None:
+        engineStats.originals = {name: GameState.__dict__[name] for name in COUNTED_METHODS + TIMED_METHODS}
+        engineStats.originals['Move.__init__'] = Move.__init__
+        for name in COUNTED_METHODS:
+            setattr(GameState, name, countedMethod(name, engineStats.originals[name]))
+        for name in TIMED_METHODS:
+            setattr(GameState, name, timedMethod(name, engineStats.originals[name]))
+        Move.__init__ = countedMoveInit(Move.__init__)
+        bindMoveFunctions()
+    engineStats.reset()
+
+
+def disableStats():
+    if engineStats.originals is not None:
+        Move.__init__ = engineStats.originals.pop('Move.__init__')
+        for name, function in engineStats.originals.items():
+            setattr(GameState, name, function)
+        bindMoveFunctions()
+        engineStats.originals = None
+
+
+def bindMoveFunctions():  # points GameState.moveFunctions at the per-piece generators the class has right now
+    for piece, function in list(GameState.moveFunctions.items()):
+        GameState.moveFunctions[piece] = GameState.__dict__[function.__name__]
+
+
+"""
+checks the switch of the stats: game states made before and while they are on are all counted down to the per-piece
+generators, and after disableStats none of them is (the counters stay where they were). returns the calls counted
+while on, raises AssertionError when the switch leaks either way
+"""
+def checkStats():
+    enabled = engineStats.originals is not None
+    before = GameState()
+    enableStats()
+    during = GameState()
+    for gs in (before, during):
+        gs.getAllPossibleMoves()
+        gs.getLegalMoves()
+    calls = dict(engineStats.calls)
+    for name in TIMED_METHODS:
+        assert calls[name] > 0 or name in ('getValidMoves', 'getValidMovesByFiltering'), name + " wasn't counted"
+    disableStats()
+    for gs in (before, during, GameState()):
+        gs.getAllPossibleMoves()
+        gs.getLegalMoves()
+    assert engineStats.calls == calls, "counters still running after disableStats"
+    for function in GameState.moveFunctions.values():  # the wrappers' code is named timed, the generators' their own
+        assert function.__code__.co_name == function.__name__, function.__name__ + " is still wrapped"
+    if enabled:
+        enableStats()
+    return sum(calls.values())
+
+
+def resetStats():
+    engineStats.reset()
+
+
+"""
+snapshot of the counters as a dictionary: calls and seconds per method, moves allocated, the seconds since
+enableStats / resetStats and makeMove calls per second over them. nodes is the caller's own node count (perft
+leaves, search nodes), with it the snapshot also has nodes and nodes per second
+"""
+def getStats(nodes=None):
+    seconds = time.perf_counter() - engineStats.started
+    calls = dict(engineStats.calls)
+    stats = {
+        'enabled': engineStats.originals is not None,
+        'seconds': seconds,
+        'calls': calls,
+        'times': dict(engineStats.times),
+        'movesAllocated': engineStats.movesAllocated[0],
+        'makeMovesPerSecond': calls['makeMove'] / seconds if seconds > 0 else 0.0,
+    }
+    if nodes is not None:
+        stats['nodes'] = nodes
+        stats['nodesPerSecond'] = nodes / seconds if seconds > 0 else 0.0
+    return stats
+
+
+def printStats(stats=None, nodes=None):
+    stats = stats or getStats(nodes)
+    line = "engine stats over " + format(stats['seconds'], ".3f") + "s: "
+    if 'nodes' in stats:
+        line += str(stats['nodes']) + " nodes (" + format(stats['nodesPerSecond'], ",.0f") + " nodes/s), "
+    print(line + str(stats['calls']['makeMove']) + " makeMove calls (" + format(stats['makeMovesPerSecond'], ",.0f") +
+          " make/s), " + str(stats['movesAllocated']) + " moves allocated")
+    for name, calls in stats['calls'].items():
+        line = "    " + name.ljust(26) + str(calls).rjust(10) + " calls"
+        if name in stats['times']:
+            seconds = stats['times'][name]
+            line += format(seconds, "10.3f") + "s" + format(seconds / calls * 1e6 if calls else 0, "10.1f") + " us/call"
+        print(line)
+
+
+"""
+runs function(*args) under cProfile and returns what it returns. the profile is written to path (a pstats file,
+for snakeviz or pstats.Stats) when given, and its top limit functions by sortBy are printed
+"""
+def profile(function, *args, path=None, sortBy='cumulative', limit=20):
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        if path:
+            profiler.dump_stats(path)
+        if limit:
+            pstats.Stats(profiler).strip_dirs().sort_stats(sortBy).print_stats(limit)
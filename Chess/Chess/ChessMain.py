@@ -1,16 +1,30 @@
 """
 Our main driver file, handling user info and displaying the current gamestate
 """
+import os
+import sys
+import time
 import pygame as p
 import ChessEngine
-import winsound
+import ChessSearch
 
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8 # dimension chest board are 8x8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15 # for animation later on
+ANIMATION_FPS = 144 # frames per second while a piece slides, each frame only redraws the sprite's old and new rect
+ENGINE_TIME = 1.0 # seconds the computer thinks about each move
+MOVE_CACHE_SIZE = 256 # positions whose valid moves the game state remembers (see GameState.moveCacheSize)
 IMAGES = {}   #techniaclly already full of images after we start our main function
+IMAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images") # next to this file, so it works from any working directory
+SOUNDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sounds") # next to this file as well
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin") # opening book of the computer (ChessBook build), optional
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases") # endgame tables (ChessTablebase generate), optional
+# optional extras, the game runs without them when the files aren't there
+ICON_PATH = os.path.join(IMAGES_DIR, "myimage.png")
+BACKGROUND_MUSIC_PATH = os.path.join(SOUNDS_DIR, "Chess_winning_music.mp3")
+MOVE_SOUND_PATH = os.path.join(SOUNDS_DIR, "chess_sound.wav")
 
 """
 initialize a global dictionary of images. this will be called exactly once in the main
@@ -18,38 +32,44 @@ initialize a global dictionary of images. this will be called exactly once in th
 def loadImages():
     pieces = ['wp', 'wR', 'wN', 'wB', 'wK', 'wQ', 'bp', 'bR', 'bN', 'bB', 'bK', 'bQ']
     for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE)) #uploads each image as a VALUE
+        IMAGES[piece] = p.transform.scale(p.image.load(os.path.join(IMAGES_DIR, piece + ".png")), (SQ_SIZE, SQ_SIZE)) #uploads each image as a VALUE
     # Note: we can accses an image by saying 'IMAGES['WP'] for example. (the images are the values)
 
 """
 the main driver for our code. this will handle user input and updating the graphics
 """
 
-def main():
+def main(playerOne=True, playerTwo=False): # playerOne/playerTwo: True if a human plays white/black, False for the computer
     p.display.set_caption("Ohad's_chess_game")
-    icon = p.image.load(r"C:\Users\shine\OneDrive\Desktop\myimage.png")
-    p.display.set_icon(icon)
+    if os.path.exists(ICON_PATH):
+        p.display.set_icon(p.image.load(ICON_PATH))
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))  # displaying a 8 x 8 window white screen
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
     gs = ChessEngine.GameState()   # an object of the class ''ChessEngine''
-    validMoves = gs.getValidMoves() # list of valid moves to check later on if the move is valid
+    gs.moveCacheSize = MOVE_CACHE_SIZE # undo goes back to positions whose moves are already known
+    validMoves = gs.getValidMoves() # ChessEngine.MoveList of valid moves to check later on if the move is valid
     moveMade = False # flag variable for when a move is made
     animate = False # flag variable for when we should animate a move
     loadImages() # only doing this once, before the while loop   (already loaded once we start the main function)
+    view = BoardView(screen) # draws only the squares that changed since the last frame
     running = True
     sqSelected = () # no square is selected, keep track of the last click of the user (tuple: (row, cow))
     playerClicks = [] # keep track of player clicks two tuples: [(6, 4), (4, 4)]
     gameOver = False
+    engineSearch = None # the ChessSearch.BackgroundSearch the computer is thinking with, None when it's not thinking
     playBackgroundMusic()
     while running:
+        humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)
         for e in p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type in (p.VIDEOEXPOSE, p.WINDOWEXPOSED): # the window was covered, its content may be gone
+                view.invalidate()
             # mouse handler
             elif e.type == p.MOUSEBUTTONDOWN:
-                if not gameOver: # conidition so that if gave is not over, then allow everything else to work
+                if not gameOver and humanTurn: # conidition so that if gave is not over, then allow everything else to work
                     location = p.mouse.get_pos() # (x, y) location of mouse
                     col = location[0] // SQ_SIZE     # determines the position of the X
                     row = location[1] // SQ_SIZE  # determines the position of the Y
@@ -60,54 +80,86 @@ def main():
                         sqSelected = (row, col) # (x , y)
                         playerClicks.append(sqSelected)   # append position of both the first and the last clicks.
                     if len(playerClicks) == 2:
-                        move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board) # מופע ! playerclicks = רשימה עם tuples
-                        print(move.getChessNotation())
-                        for i in range(len(validMoves)):
-                            if move == validMoves[i]: # checks to see if the move (the clicks) are the same move that are in the list of validmoves
-                                gs.makeMove(validMoves[i]) # makes the move generated by the engine
-                                Chess_Music()
-                                moveMade = True
-                                animate = True
-                                sqSelected = () # reset the clicks
-                                playerClicks = []
+                        move = validMoves.find(playerClicks[0], playerClicks[1]) # the valid move the two clicks make, None if there isn't one
+                        if move is not None:
+                            print(move.getChessNotation())
+                            gs.makeMove(move) # makes the move generated by the engine
+                            Chess_Music()
+                            moveMade = True
+                            animate = True
+                            sqSelected = () # reset the clicks
+                            playerClicks = []
                         if not moveMade:
                             playerClicks = [sqSelected] # quality of life for when I decide to move another piece after I already clicked on a piece ( de-select )
 
             # key handler
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z: # undo when Z is pressed
+                    if engineSearch is not None: # stop the computer from answering a move that's being taken back
+                        engineSearch.cancel()
+                        engineSearch = None
                     gs.undoMove()
+                    # against the computer, keep undoing until it's a human's turn again, otherwise it would just replay
+                    while (playerOne or playerTwo) and gs.movelog and not ((gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo)):
+                        gs.undoMove()
                     moveMade = True
                     animate = False
+                    gameOver = False
                 if e.key == p.K_r: # reset the board when "r" is pressed
+                    if engineSearch is not None:
+                        engineSearch.cancel()
+                        engineSearch = None
                     gs = ChessEngine.GameState()
+                    gs.moveCacheSize = MOVE_CACHE_SIZE
                     validMoves = gs.getValidMoves()
                     sqSelected = ()
                     playerClicks = []
                     moveMade = False
                     animate = False
+                    gameOver = False
+
+        # computer move. the search runs in another process and is only polled here, so the loop keeps drawing and
+        # handling input at MAX_FPS however long the computer thinks
+        humanTurn = (gs.whiteToMove and playerOne) or (not gs.whiteToMove and playerTwo) # an undo or reset may have changed it
+        if not gameOver and not humanTurn and not moveMade:
+            if engineSearch is None:
+                engineSearch = ChessSearch.BackgroundSearch(gs, timeLimit=ENGINE_TIME,
+                                                            bookPath=BOOK_PATH if os.path.exists(BOOK_PATH) else None,
+                                                            tablebaseDir=TABLEBASE_DIR if os.path.isdir(TABLEBASE_DIR) else None)
+            elif engineSearch.poll():
+                for move in validMoves:
+                    if move.getChessNotation() == engineSearch.result:
+                        gs.makeMove(move)
+                        moveMade = True
+                        animate = True
+                        break
+                engineSearch = None
 
         if moveMade: # if a move was made, we need to generate a new valid moves for the next move (say I played pawn and then played Bishop for example)
             if animate:
-                animateMove(gs.movelog[-1], screen, gs.board, clock)
+                animateMove(gs.movelog[-1], view, gs, clock)
             validMoves = gs.getValidMoves()
             moveMade = False
             animate = False
 
-        drawGameState(screen, gs, validMoves, sqSelected)        # starts the drawgamestate function below which starts the drawboard function below it
-
+        message = None
         if gs.checkMate:
             gameOver = True
             if gs.whiteToMove:
-                drawText(screen, "Black wins by checkmate")
+                message = "Black wins by checkmate"
             else:
-                drawText(screen, "White wins by checkmate")
+                message = "White wins by checkmate"
         elif gs.staleMate:
             gameOver = True
-            drawText(screen, "Stalemate")
+            message = "Stalemate"
 
+        status = "thinking..." if engineSearch is not None else None
+        dirtyRects = view.draw(gs, validMoves, sqSelected, status, message) # only what changed since the last frame
+        if dirtyRects: # idle frames draw nothing and send nothing to the display
+            p.display.update(dirtyRects)
         clock.tick(MAX_FPS)
-        p.display.flip()
+    if engineSearch is not None:
+        engineSearch.cancel()
 
 
 
@@ -125,9 +177,8 @@ def hightlightSquares(screen, gs, validMoves, sqSelected):
             screen.blit(s, (c*SQ_SIZE, r*SQ_SIZE)) # position of the hightlight ( the same x, y of the position of the square selected)
             #hightlight moves from that square
             s.fill(p.Color("green"))
-            for move in validMoves:
-                if move.startRow == r and move.startCol == c:
-                    screen.blit(s, (move.endCol * SQ_SIZE, move.endRow * SQ_SIZE))
+            for move in validMoves.fromSquare(r, c):
+                screen.blit(s, (move.endCol * SQ_SIZE, move.endRow * SQ_SIZE))
 
 
 """
@@ -167,50 +218,259 @@ def rectest(screen):   # test will delete later.
     p.draw.rect( screen, p.Color( "black" ), p.Rect( 2 * SQ_SIZE, 2 * SQ_SIZE, SQ_SIZE, SQ_SIZE ) )
 
 """
-animating a move
+animating a move. gs is the position after the move. the squares under the slide are drawn once without the moving
+piece (the captured piece stays on the end square until the slide ends) and kept as a background copy, then each
+frame only puts the background back under the sprite's last rect and draws the sprite at its new one.
+clock=None doesn't wait between frames and frameTimes gets the seconds of every frame, both for the benchmark
 """
-def animateMove(move, screen, board, clock):
-    global colors
+def animateMove(move, view, gs, clock, frameTimes=None):
+    screen = view.screen
     dR = move.endRow - move.startRow # distance
     dC = move.endCol - move.startCol # distance
     framesPerSquare = 10 # frames to move one square
     frameCount = (abs(dR) + abs(dC)) * framesPerSquare # counts how many squares for each move if it's 7/7 -> 6/6 it's just one square for example
+    endSq = move.endRow * DIMENSION + move.endCol
+    start = time.perf_counter()
+    p.display.update(view.draw(gs, squareOverrides={endSq: (move.pieceCaptured, None)}, keepTexts=True))
+    background = screen.copy()
+    if frameTimes is not None:
+        frameTimes.append(time.perf_counter() - start)
+    lastRect = None
     for frame in range(frameCount + 1): # one square = 10 frames
+        start = time.perf_counter()
         r, c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount) # frames if say I moved 2 squares -> 1/20 -> 2/20 etc etc in position (x+x\\ 20, y+ y\\20) -> etc etc
+        spriteRect = p.Rect(int(c*SQ_SIZE), int(r*SQ_SIZE), SQ_SIZE, SQ_SIZE)
+        dirtyRects = [spriteRect]
+        if lastRect is not None:
+            screen.blit(background, lastRect, lastRect) # erase the sprite where it was
+            dirtyRects.append(lastRect)
+        screen.blit(IMAGES[move.pieceMoved], spriteRect) # drawng the image as it moves frame per frame
+        p.display.update(dirtyRects)
+        if frameTimes is not None:
+            frameTimes.append(time.perf_counter() - start)
+        lastRect = spriteRect
+        if clock is not None:
+            clock.tick(ANIMATION_FPS)
+    screen.blit(background, lastRect, lastRect)
+    p.display.update(lastRect)
+    view.forget(endSq) # the end square still shows the captured piece, the next draw puts the moved piece there
+
+"""
+small text in the bottom left corner, used to show that the computer is thinking
+"""
+def drawStatus(screen, text):
+    textObject, location = renderStatus(text)
+    screen.blit(textObject, location)
+
+def drawText(screen, text):
+    textObject, location = renderMessage(text)
+    screen.blit(textObject, location)
+
+def renderStatus(text): # the status text as a surface and where it goes
+    font = p.font.SysFont("Times", 20, True, False)
+    textObject = font.render(text, 0, p.Color("blue"))
+    return textObject, p.Rect(4, HEIGHT - textObject.get_height() - 4, textObject.get_width(), textObject.get_height())
+
+def renderMessage(text): # the big game over text (black with a blue copy over it) as a surface and where it goes
+    font = p.font.SysFont("Times", 48, True, False)
+    shadow = font.render(text, 0, p.Color("Black"))
+    textObject = p.Surface((shadow.get_width() + 2, shadow.get_height() + 2), p.SRCALPHA)
+    textObject.blit(shadow, (0, 0))
+    textObject.blit(font.render(text, 0, p.Color("blue")), (2, 2))
+    textlocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - shadow.get_width()/2, HEIGHT/2 - shadow.get_height()/2)
+    return textObject, p.Rect(textlocation.x, textlocation.y, textObject.get_width(), textObject.get_height())
+
+
+"""
+draws the game a square at a time and remembers what every square shows, so a frame only redraws the squares whose
+piece or highlight changed. the empty board is drawn once to a surface and copied from, and the texts are rendered
+once per string. draw returns the rects that changed for p.display.update, an empty list when nothing did
+"""
+class BoardView():
+    def __init__(self, screen):
+        self.screen = screen
+        self.boardSurface = p.Surface((WIDTH, HEIGHT)) # the empty board, drawn once
+        drawBoard(self.boardSurface)
+        self.highlights = {}
+        for kind, color in (('selected', "blue"), ('target', "green")):
+            s = p.Surface((SQ_SIZE, SQ_SIZE))
+            s.set_alpha(100) # transperancy value -> 0 transparent, 255 is none transparent
+            s.fill(p.Color(color))
+            self.highlights[kind] = s
+        self.textCache = {} # (kind, text): (surface, rect)
+        self.invalidate()
+
+    """
+    forget everything on the screen, the next draw redraws it all
+    """
+    def invalidate(self):
+        self.drawn = [None] * (DIMENSION * DIMENSION) # (piece, highlight) every square shows, None = redraw it
+        self.texts = [] # (kind, text) of the texts on the screen
+
+    def forget(self, sq):
+        self.drawn[sq] = None
+
+    def text(self, kind, text):
+        if (kind, text) not in self.textCache:
+            self.textCache[(kind, text)] = renderStatus(text) if kind == 'status' else renderMessage(text)
+        return self.textCache[(kind, text)]
+
+    """
+    what every square should show: (piece, None / 'selected' / 'target')
+    """
+    def wantedSquares(self, gs, validMoves, sqSelected):
+        wanted = [(piece, None) for piece in gs.squares]
+        if sqSelected != () and validMoves is not None:
+            r, c = sqSelected
+            if gs.squares[r * DIMENSION + c][0] == ('w' if gs.whiteToMove else 'b'): # sqselected is a piece that can be moved
+                wanted[r * DIMENSION + c] = (wanted[r * DIMENSION + c][0], 'selected')
+                for move in validMoves.fromSquare(r, c):
+                    wanted[move.endSq] = (wanted[move.endSq][0], 'target')
+        return wanted
+
+    """
+    brings the screen up to date and returns the rects that changed. squareOverrides = {square: (piece, highlight)}
+    replaces what gs has on those squares, keepTexts leaves the texts as they are (status and message are ignored)
+    """
+    def draw(self, gs, validMoves=None, sqSelected=(), status=None, message=None, squareOverrides=None, keepTexts=False):
+        wanted = self.wantedSquares(gs, validMoves, sqSelected)
+        for sq, shown in (squareOverrides or {}).items():
+            wanted[sq] = shown
+        texts = self.texts
+        if not keepTexts:
+            texts = [(kind, text) for kind, text in (('status', status), ('message', message)) if text is not None]
+        textsChanged = texts != self.texts
+        if textsChanged:
+            for kind, text in self.texts: # the squares under the old texts have to be drawn again
+                self.forgetRect(self.text(kind, text)[1])
+        dirtyRects = []
+        for sq in range(DIMENSION * DIMENSION):
+            if wanted[sq] != self.drawn[sq]:
+                dirtyRects.append(self.drawSquare(sq, wanted[sq]))
+                self.drawn[sq] = wanted[sq]
+        for kind, text in texts: # texts go on top, again whenever a square under them was redrawn
+            textObject, rect = self.text(kind, text)
+            if textsChanged or rect.collidelist(dirtyRects) != -1:
+                self.screen.blit(textObject, rect)
+                dirtyRects.append(rect)
+        self.texts = texts
+        return dirtyRects
+
+    def forgetRect(self, rect):
+        for sq in range(DIMENSION * DIMENSION):
+            r, c = divmod(sq, DIMENSION)
+            if rect.colliderect(p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)):
+                self.drawn[sq] = None
+
+    def drawSquare(self, sq, shown):
+        piece, highlight = shown
+        r, c = divmod(sq, DIMENSION)
+        rect = p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        self.screen.blit(self.boardSurface, rect, rect) # the empty square from the cached board
+        if highlight is not None:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        return rect
+
+
+"""
+the old way of sliding a piece, for the benchmark: every frame draws the whole board and all the pieces again and
+flips the display. gs is the position after the move
+"""
+def animateMoveFullRedraw(move, screen, gs, frameTimes):
+    dR = move.endRow - move.startRow
+    dC = move.endCol - move.startCol
+    frameCount = (abs(dR) + abs(dC)) * 10
+    endSquare = p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    for frame in range(frameCount + 1):
+        start = time.perf_counter()
+        r, c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount)
         drawBoard(screen)
-        drawPieces(screen, board)
-        # erase the piece moved from it's ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endSquare)
-        #draw the captured piece onto the rectangle
+        drawPieces(screen, gs.board)
+        p.draw.rect(screen, colors[(move.endRow + move.endCol) % 2], endSquare) # erase the moved piece from its end square
         if move.pieceCaptured != "--":
             screen.blit(IMAGES[move.pieceCaptured], endSquare)
-        # draw the moving piece
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)) # drawng the image as it moves frame per frame
+        screen.blit(IMAGES[move.pieceMoved], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
         p.display.flip()
-        clock.tick(144)
+        frameTimes.append(time.perf_counter() - start)
 
-def drawText(screen, text):
-    font = p.font.SysFont("Times", 48, True, False)
-    textObject = font.render(text, 0, p.Color("Black"))
-    textlocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
-    screen.blit(textObject, textlocation)
-    textObject = font.render(text, 0, p.Color("blue"))
-    screen.blit(textObject, textlocation.move(2, 2))
+"""
+headless frame time benchmark with SDL's dummy video driver: the same scripted game (idle frames, selecting pieces,
+moves with their slide) drawn the old way (drawGameState plus flip every frame) and with BoardView. prints the mean
+and 95th percentile milliseconds per frame of both, for all the frames and for the slide frames alone, and returns
+{name: list of frame seconds}
+"""
+def benchmark(moves=12, idleFrames=30):
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    p.init()
+    screen = p.display.set_mode((WIDTH, HEIGHT))
+    loadImages()
+    results = {}
+    for name in ("full redraw", "dirty rects"):
+        gs = ChessEngine.GameState()
+        validMoves = gs.getValidMoves()
+        view = BoardView(screen)
+        frameTimes = []
+        slideTimes = [] # the frames of the slides, also in frameTimes
+
+        def frame(sqSelected=()):
+            start = time.perf_counter()
+            if name == "full redraw":
+                drawGameState(screen, gs, validMoves, sqSelected)
+                p.display.flip()
+            else:
+                dirtyRects = view.draw(gs, validMoves, sqSelected)
+                if dirtyRects:
+                    p.display.update(dirtyRects)
+            frameTimes.append(time.perf_counter() - start)
+
+        for i in range(moves):
+            for f in range(idleFrames):
+                frame()
+            move = validMoves[(i * 7) % len(validMoves)]
+            for f in range(idleFrames // 3): # a piece is selected, its moves are highlighted
+                frame((move.startRow, move.startCol))
+            gs.makeMove(move)
+            slide = []
+            if name == "full redraw":
+                animateMoveFullRedraw(move, screen, gs, slide)
+            else:
+                animateMove(move, view, gs, None, slide)
+            frameTimes.extend(slide)
+            slideTimes.extend(slide)
+            validMoves = gs.getValidMoves()
+            frame()
+        results[name] = frameTimes
+        for label, times in ((name, frameTimes), (name + " (slides)", slideTimes)):
+            times = sorted(times)
+            print(label + ": " + format(sum(times) / len(times) * 1000, ".3f") + " ms/frame mean, " +
+                  format(times[int(len(times) * 0.95)] * 1000, ".3f") + " ms p95 over " + str(len(times)) + " frames")
+    p.quit()
+    return results
 
 
 def playBackgroundMusic():
-    p.mixer.init()
-    p.mixer.music.load(r"C:\Users\shine\Downloads\Chess_winning_music.mp3")
-    p.mixer.music.play(-1)
+    playSound(BACKGROUND_MUSIC_PATH, -1) # -1 = loop forever
 
 def Chess_Music():
-    p.mixer.init()
-    p.mixer.music.load(r"C:\Users\shine\Downloads\chess_sound.wav")
-    p.mixer.music.play()
+    playSound(MOVE_SOUND_PATH)
+
+def playSound(path, loops=0): # silently skips missing files and machines without an audio device
+    if not os.path.exists(path):
+        return
+    try:
+        p.mixer.init()
+        p.mixer.music.load(path)
+        p.mixer.music.play(loops)
+    except p.error:
+        pass
 
 if __name__ == "__main__":
-    main()
+    if "--bench" in sys.argv[1:]: # python ChessMain.py --bench runs the headless frame time benchmark
+        benchmark()
+    else:
+        main()
 
 
@@ -0,0 +1,250 @@
+"""
+multi core search and analysis. one python process can only use one core (the GIL), so the work is spread over a
+multiprocessing pool where every worker process has its own GameState and its own ChessSearch.Searcher
+(with its own transposition table).
+
+- ParallelSearcher.search splits the root moves of one position over the workers, one depth at a time
+- ParallelSearcher.analyse searches many positions at once, one position per task
+- scalingReport runs the same batch with 1, 2, 4 ... workers and prints how the throughput scales
+- checkAgainstSerial makes sure a parallel search to depth N scores the same as ChessSearch to depth N
+
+usage:
+    python ChessParallel.py search --depth 4 --workers 4 [--fen "<fen>"]
+    python ChessParallel.py batch --file positions.txt --depth 3 --workers 4     (one fen per line)
+    python ChessParallel.py scaling --depth 3 --max-workers 8
+    python ChessParallel.py check --depth 4                                      (scores match ChessSearch)
+"""
+import argparse
+import multiprocessing
+import time
+
+import ChessEngine
+import ChessSearch
+
+workerSearcher = None  # the Searcher of this worker process, made once by initWorker
+# positions with mates in the tree, where the workers' searches stop before their depth. checked along with the quiet
+# perft positions
+MATE_POSITIONS = [
+    "rnbqkbnr/pppp1ppp/8/4p3/8/5P2/PPPPP1PP/RNBQKBNR w - - 0 2",  # black threatens Qh4 mate
+    "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w - - 4 4",  # Qxf7 mate
+    "6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1",  # back rank mate
+]
+
+
+def initWorker(ttSizeMB):
+    global workerSearcher
+    workerSearcher = ChessSearch.Searcher(ttSizeMB)
+
+
+"""
+worker task: plays one root move of fen and searches the position after it depth - 1 plies deep, so a root depth
+means the same number of plies as in ChessSearch. at depth 1 the position after the move only gets a quiescence search.
+returns (move notation, score for the side to move at the root, depth reached from the root, nodes)
+"""
+def searchRootMove(task):
+    fen, notation, depth, deadline = task
+    gs = ChessEngine.GameState(fen)
+    gs.makeMove(findMoveByNotation(gs, notation))
+    if depth <= 1:
+        childScore, nodes = workerSearcher.quiescenceSearch(gs)
+        reached = depth
+    else:
+        timeLimit = None if deadline is None else max(deadline - time.time(), 0.001)
+        result = workerSearcher.search(gs, maxDepth=depth - 1, timeLimit=timeLimit)
+        childScore, nodes = result.score, result.nodes
+        # a search that stops early on a mate it can't improve (or on no legal moves) has an exact score, only one that
+        # ran out of time didn't search depth - 1 plies
+        reached = result.depth + 1 if result.aborted else depth
+    score = -childScore
+    if childScore > ChessSearch.MATE_BOUND:  # the mate is one ply further away when seen from the root
+        score += 1
+    elif childScore < -ChessSearch.MATE_BOUND:
+        score -= 1
+    return notation, score, reached, nodes
+
+
+"""
+worker task: searches a whole position. returns (fen, best move notation or None, score, depth, nodes, seconds)
+"""
+def analysePosition(task):
+    fen, depth, timeLimit = task
+    result = workerSearcher.search(ChessEngine.GameState(fen), maxDepth=depth, timeLimit=timeLimit)
+    notation = result.bestMove.getChessNotation() if result.bestMove else None
+    return fen, notation, result.score, result.depth, result.nodes, result.elapsed
+
+
+def findMoveByNotation(gs, notation):
+    for move in gs.getValidMoves():
+        if move.getChessNotation() == notation:
+            return move
+    raise ValueError("no legal move " + notation + " in " + gs.getFen())
+
+
+class ParallelSearcher():
+    def __init__(self, workers=None, ttSizeMB=16):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.pool = multiprocessing.Pool(self.workers, initializer=initWorker, initargs=(ttSizeMB,))
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    """
+    root split search: every iteration sends each root move to the pool as its own task (the best moves of the last
+    iteration first) and takes the highest score. returns a ChessSearch.SearchResult like Searcher.search does.
+    depth N searches N plies like Searcher.search (depth 1 scores the root moves with a quiescence search).
+    the position is sent as a fen, so repetitions of positions before gs are not seen by the workers
+    """
+    def search(self, gs, maxDepth=None, timeLimit=None, infoCallback=None):
+        if maxDepth is None and timeLimit is None:
+            maxDepth = ChessSearch.DEFAULT_DEPTH
+        maxDepth = min(maxDepth or ChessSearch.MAX_PLY, ChessSearch.MAX_PLY)
+        start = time.perf_counter()
+        deadline = time.time() + timeLimit if timeLimit is not None else None  # wall clock, the workers can read it too
+        fen = gs.getFen()
+        rootMoves = gs.getValidMoves()
+        if not rootMoves:
+            return ChessSearch.SearchResult(None, -ChessSearch.CHECKMATE if gs.checkMate else ChessSearch.STALEMATE, 0, 0, 0.0)
+        movesByNotation = {move.getChessNotation(): move for move in rootMoves}
+        order = list(movesByNotation)
+        nodes = 0
+        result = ChessSearch.SearchResult(rootMoves[0], 0, 0, 0, 0.0)
+        for depth in range(1, maxDepth + 1):
+            scores = {}
+            complete = True
+            for notation, score, reached, taskNodes in self.pool.imap_unordered(
+                    searchRootMove, [(fen, notation, depth, deadline) for notation in order]):
+                scores[notation] = score
+                nodes += taskNodes
+                complete = complete and reached >= depth
+            if not complete:  # the clock ran out in the middle of this depth, keep the last full one
+                break
+            order.sort(key=lambda notation: scores[notation], reverse=True)
+            result = ChessSearch.SearchResult(movesByNotation[order[0]], scores[order[0]], depth, nodes,
+                                              time.perf_counter() - start)
+            if infoCallback:
+                infoCallback(result)
+            if abs(result.score) > ChessSearch.MATE_BOUND and ChessSearch.CHECKMATE - abs(result.score) <= depth:
+                break  # a mate that this depth already sees can't get any better
+            if deadline is not None and time.time() >= deadline:
+                break
+        result.nodes = nodes
+        result.elapsed = time.perf_counter() - start
+        result.nps = int(nodes / result.elapsed) if result.elapsed > 0 else 0
+        return result
+
+    """
+    batch analysis: searches every fen (to maxDepth and/or for timeLimit seconds each) on the pool.
+    returns one (fen, best move notation, score, depth, nodes, seconds) tuple per fen, in the same order
+    """
+    def analyse(self, fens, maxDepth=None, timeLimit=None):
+        if maxDepth is None and timeLimit is None:
+            maxDepth = ChessSearch.DEFAULT_DEPTH
+        return self.pool.map(analysePosition, [(fen, maxDepth, timeLimit) for fen in fens], chunksize=1)
+
+
+"""
+analyses the same batch with every worker count and prints positions/s, nodes/s and the speedup over one worker.
+returns a list of (workers, positions per second, nodes per second)
+"""
+def scalingReport(fens, maxDepth, workerCounts, ttSizeMB=16):
+    rows = []
+    for workers in workerCounts:
+        with ParallelSearcher(workers, ttSizeMB) as searcher:
+            start = time.perf_counter()
+            results = searcher.analyse(fens, maxDepth)
+            elapsed = time.perf_counter() - start
+        nodes = sum(result[4] for result in results)
+        rows.append((workers, len(fens) / elapsed, nodes / elapsed))
+        print(str(workers) + " workers: " + format(len(fens) / elapsed, ".2f") + " positions/s, " +
+              format(nodes / elapsed, ",.0f") + " nodes/s, speedup " + format(rows[-1][1] / rows[0][1], ".2f") + "x")
+    return rows
+
+
+"""
+searches every fen to depth 1, 2 ... maxDepth with ParallelSearcher.search and with ChessSearch.Searcher and compares
+the depths reached and the scores. every fen gets its own pool and the depths go up, so no worker table holds deeper results than the search
+asks for. returns the number of searches compared, raises AssertionError at the first difference
+"""
+def checkAgainstSerial(fens, maxDepth=4, workers=None, ttSizeMB=16):
+    compared = 0
+    for fen in fens:
+        with ParallelSearcher(workers, ttSizeMB) as searcher:
+            for depth in range(1, maxDepth + 1):
+                parallel = searcher.search(ChessEngine.GameState(fen), depth)
+                serial = ChessSearch.Searcher(ttSizeMB).search(ChessEngine.GameState(fen), depth)
+                # both stop before depth on a mate that can't get better, but at the same depth
+                assert parallel.depth == serial.depth, "depth " + str(depth) + " stopped at " + str(parallel.depth) + \
+                    " parallel, " + str(serial.depth) + " serial in " + fen
+                assert parallel.score == serial.score, "depth " + str(depth) + " scores differ in " + fen + ": " + \
+                    str(parallel.score) + " parallel, " + str(serial.score) + " serial"
+                compared += 1
+    return compared
+
+
+def readFens(path):
+    if path is None:
+        import ChessPerft
+        return [fen for name, fen, expected in ChessPerft.REFERENCE_POSITIONS]
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="parallel search and batch analysis on a process pool")
+    commands = parser.add_subparsers(dest="command", required=True)
+    searchParser = commands.add_parser("search", help="root split search of one position")
+    searchParser.add_argument("--fen", default=ChessEngine.START_FEN)
+    searchParser.add_argument("--time", type=float, help="wall clock budget in seconds")
+    batchParser = commands.add_parser("batch", help="analyse many positions")
+    batchParser.add_argument("--time", type=float, help="wall clock budget per position in seconds")
+    scalingParser = commands.add_parser("scaling", help="throughput of a batch for 1, 2, 4 ... workers")
+    scalingParser.add_argument("--max-workers", type=int, default=multiprocessing.cpu_count())
+    checkParser = commands.add_parser("check", help="compare the scores with the serial search at depth 1 to --depth "
+                                                    "(default: the perft and mate positions to depth 4)")
+    for sub in (batchParser, scalingParser, checkParser):
+        sub.add_argument("--file", help="one fen per line (default: the perft reference positions)")
+    for sub in (searchParser, batchParser, scalingParser, checkParser):
+        sub.add_argument("--depth", type=int)
+        sub.add_argument("--hash", type=int, default=16, help="transposition table size per worker in MB")
+    for sub in (searchParser, batchParser, checkParser):
+        sub.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+    if args.command == "search":
+        with ParallelSearcher(args.workers, args.hash) as searcher:
+            result = searcher.search(ChessEngine.GameState(args.fen), args.depth, args.time, ChessSearch.printInfo)
+        print("bestmove " + (result.bestMove.getChessNotation() if result.bestMove else "none") + " (" +
+              str(result.nodes) + " nodes, " + str(result.nps) + " nodes/s)")
+    elif args.command == "batch":
+        fens = readFens(args.file)
+        with ParallelSearcher(args.workers, args.hash) as searcher:
+            start = time.perf_counter()
+            results = searcher.analyse(fens, args.depth, args.time)
+            elapsed = time.perf_counter() - start
+        for fen, notation, score, depth, nodes, seconds in results:
+            print(fen + " | " + str(notation) + " score " + str(score) + " depth " + str(depth) + " nodes " + str(nodes))
+        print(str(len(fens)) + " positions in " + format(elapsed, ".3f") + "s (" + format(len(fens) / elapsed, ".2f") + " positions/s)")
+    elif args.command == "check":
+        fens = readFens(args.file) if args.file else readFens(None) + MATE_POSITIONS
+        compared = checkAgainstSerial(fens, args.depth or 4, args.workers, args.hash)
+        print(str(compared) + " searches give the same score as the serial search")
+    else:
+        counts = []
+        workers = 1
+        while workers <= args.max_workers:
+            counts.append(workers)
+            workers *= 2
+        if counts[-1] != args.max_workers:
+            counts.append(args.max_workers)
+        scalingReport(readFens(args.file), args.depth or ChessSearch.DEFAULT_DEPTH - 1, counts, args.hash)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,148 @@
+"""
+perft (performance test) for the move generator. it walks the game tree to a fixed depth with getValidMoves,
+makeMove and undoMove and counts the leaf nodes. the counts are compared with known numbers to check the rules,
+and the time it took gives the nodes per second of the engine. no display is needed.
+
+usage:
+    python ChessPerft.py --depth 4                      (starting position)
+    python ChessPerft.py --fen "<fen>" --depth 3 --divide
+    python ChessPerft.py --suite --depth 3              (all the reference positions up to depth 3)
+    python ChessPerft.py --depth 4 --stats --profile perft.prof   (engine counters and a cProfile dump)
+    python ChessPerft.py --check-stats                            (the counters switch on and off for every game state)
+"""
+import argparse
+import time
+
+import ChessEngine
+
+"""
+reference positions with their known leaf counts {depth: nodes}. the engine doesn't castle and always promotes to a
+queen, so only positions without castling rights and without promotions at these depths are used.
+"""
+REFERENCE_POSITIONS = [
+    ("start position", ChessEngine.START_FEN,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("rook and pawns endgame (cpw position 3)", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624, 6: 11030083}),
+    ("middlegame (cpw position 6)", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    ("stalemate and checkmate", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",
+     {4: 23527}),
+]
+
+
+"""
+number of leaf nodes depth moves from the current position
+"""
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if depth == 1:  # bulk counting: the leaves are the moves themselves, no need to play them
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1)
+        gs.undoMove()
+    return nodes
+
+
+"""
+perft split by the first move: returns a dictionary {move notation: leaf nodes under that move}
+"""
+def divide(gs, depth):
+    counts = {}
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts[move.getChessNotation()] = perft(gs, depth - 1)
+        gs.undoMove()
+    return counts
+
+
+"""
+runs perft (or divide) on a fen and prints the result with the nodes per second. returns the node count
+"""
+def runPerft(fen, depth, showDivide=False, useLegalGenerator=True):
+    gs = ChessEngine.GameState(fen)
+    gs.useLegalGenerator = useLegalGenerator
+    start = time.perf_counter()
+    if showDivide:
+        counts = divide(gs, depth)
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(gs, depth)
+    elapsed = time.perf_counter() - start
+    if showDivide:
+        for notation in sorted(counts):
+            print(notation + ": " + str(counts[notation]))
+        print()
+    print("position: " + gs.getFen())
+    print("depth " + str(depth) + ": " + str(nodes) + " nodes in " + format(elapsed, ".3f") + "s (" +
+          format(nodes / elapsed if elapsed > 0 else 0, ",.0f") + " nodes/s)")
+    return nodes
+
+
+"""
+checks every reference position up to maxDepth, prints one line per check and returns True if all of them matched
+"""
+def runSuite(maxDepth, useLegalGenerator=True):
+    allPassed = True
+    totalNodes = 0
+    totalTime = 0.0
+    for name, fen, expected in REFERENCE_POSITIONS:
+        for depth in sorted(expected):
+            if depth > maxDepth:
+                break
+            gs = ChessEngine.GameState(fen)
+            gs.useLegalGenerator = useLegalGenerator
+            start = time.perf_counter()
+            nodes = perft(gs, depth)
+            elapsed = time.perf_counter() - start
+            totalNodes += nodes
+            totalTime += elapsed
+            passed = nodes == expected[depth]
+            allPassed = allPassed and passed
+            print(("ok   " if passed else "FAIL ") + name + " depth " + str(depth) + ": " + str(nodes) +
+                  ("" if passed else " (expected " + str(expected[depth]) + ")") + " " + format(elapsed, ".3f") + "s")
+    print(str(totalNodes) + " nodes in " + format(totalTime, ".3f") + "s (" +
+          format(totalNodes / totalTime if totalTime > 0 else 0, ",.0f") + " nodes/s)")
+    return allPassed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="perft node counts and speed of the ChessEngine move generator")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN, help="position to start from (default: starting position)")
+    parser.add_argument("--depth", type=int, default=3, help="plies to search (with --suite: the deepest depth checked)")
+    parser.add_argument("--divide", action="store_true", help="print the node count under each first move")
+    parser.add_argument("--suite", action="store_true", help="check the reference positions instead of --fen")
+    parser.add_argument("--filter", action="store_true",
+                        help="use the old make/undo filter (getValidMovesByFiltering) instead of the legal generator")
+    parser.add_argument("--stats", action="store_true", help="print the engine's call counters and generator times")
+    parser.add_argument("--profile", metavar="PATH", help="run under cProfile and write the pstats dump to PATH")
+    parser.add_argument("--check-stats", action="store_true",
+                        help="check that --stats counts every game state while on and none once it's off")
+    args = parser.parse_args(argv)
+    if args.check_stats:
+        print(str(ChessEngine.checkStats()) + " calls counted while on, none after disableStats")
+        return 0
+    if args.stats:
+        ChessEngine.enableStats()
+    if args.suite:
+        function, functionArgs = runSuite, (args.depth, not args.filter)
+    else:
+        function, functionArgs = runPerft, (args.fen, args.depth, args.divide, not args.filter)
+    if args.profile:
+        result = ChessEngine.profile(function, *functionArgs, path=args.profile)
+    else:
+        result = function(*functionArgs)
+    if args.stats:
+        ChessEngine.printStats(nodes=None if args.suite else result)  # the suite prints its own node totals
+        ChessEngine.disableStats()
+    if args.suite:
+        return 0 if result else 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,341 @@
+"""
+SAN moves and PGN games for ChessEngine: a SAN writer and parser, a streaming PGN reader, a PGN writer for a
+GameState's movelog, and a replayer that checks whole game databases by playing every move through makeMove.
+
+the reader is a generator that holds one game at a time, so files of any size are read in constant memory. the
+engine doesn't castle and always promotes to a queen, so games with castling or an underpromotion are counted as
+unsupported rather than as errors.
+
+usage:
+    python ChessPgn.py replay games1.pgn games2.pgn --workers 4    (check every game, games/s per file and in total)
+    python ChessPgn.py index games.pgn                             (byte offset, plies, result and final fen per game)
+    python ChessPgn.py san --fen "<fen>"                           (the legal moves of a position in SAN)
+"""
+import argparse
+import multiprocessing
+import re
+import time
+
+import ChessEngine
+
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(=?[NBRQ])?[+#]?[!?]*$")
+# one pgn movetext token: a comment, a variation bracket, a nag, a move number, a result or a move
+TOKEN_PATTERN = re.compile(r"\{[^}]*\}?|;.*|[()]|\$\d+|\d+\.+|1-0|0-1|1/2-1/2|\*|[^\s{}();$]+")
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+SEVEN_TAG_ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+
+
+class UnsupportedMoveError(ValueError):  # a legal chess move the engine can't play (castling, underpromotion)
+    pass
+
+
+"""
+the SAN of move (one of gs.getValidMoves()) in the current position, with + or # when it gives check or mate
+"""
+def getSan(gs, move, validMoves=None):
+    validMoves = gs.getValidMoves() if validMoves is None else validMoves
+    checkMate, staleMate = gs.checkMate, gs.staleMate
+    target = move.getRankFile(move.endRow, move.endCol)
+    capture = move.pieceCaptured != "--"
+    if move.pieceMoved[1] == 'p':
+        san = (move.colsToFiles[move.startCol] + 'x' if capture else '') + target + ('=Q' if move.isPawnPromotion else '')
+    else:
+        # another piece of the same kind that can go to the same square: add the file, the rank, or both
+        others = [other for other in validMoves if other.pieceMoved == move.pieceMoved and
+                  other.endSq == move.endSq and other.startSq != move.startSq]
+        fromSquare = ''
+        if others:
+            if all(other.startCol != move.startCol for other in others):
+                fromSquare = move.colsToFiles[move.startCol]
+            elif all(other.startRow != move.startRow for other in others):
+                fromSquare = move.rowsToRanks[move.startRow]
+            else:
+                fromSquare = move.getRankFile(move.startRow, move.startCol)
+        san = move.pieceMoved[1] + fromSquare + ('x' if capture else '') + target
+    gs.makeMove(move)
+    if gs.inCheck():
+        san += '#' if not gs.getValidMoves() else '+'
+    gs.undoMove()
+    gs.checkMate, gs.staleMate = checkMate, staleMate
+    return san
+
+
+"""
+the move of gs.getValidMoves() that a SAN string stands for. check marks and annotations (+ # ! ?) are ignored.
+raises UnsupportedMoveError for castling and underpromotions and ValueError for anything else that doesn't match
+exactly one legal move
+"""
+def parseSan(gs, san, validMoves=None):
+    if san.startswith(('O-O', '0-0')):
+        raise UnsupportedMoveError("castling is not supported: " + san)
+    match = SAN_PATTERN.match(san)
+    if not match:
+        raise ValueError("invalid SAN move " + repr(san))
+    piece, fromFile, fromRank, capture, target, promotion = match.groups()
+    if promotion and promotion[-1] != 'Q':
+        raise UnsupportedMoveError("only promotions to a queen are supported: " + san)
+    pieceLetter = piece or 'p'
+    endSq = ChessEngine.Move.ranksToRows[target[1]] * 8 + ChessEngine.Move.filesToCols[target[0]]
+    validMoves = gs.getValidMoves() if validMoves is None else validMoves
+    found = None
+    for move in validMoves:
+        if move.endSq != endSq or move.pieceMoved[1] != pieceLetter:
+            continue
+        if fromFile and move.colsToFiles[move.startCol] != fromFile:
+            continue
+        if fromRank and move.rowsToRanks[move.startRow] != fromRank:
+            continue
+        if found is not None:
+            raise ValueError("ambiguous SAN move " + repr(san) + " in " + gs.getFen())
+        found = move
+    if found is None:
+        raise ValueError("illegal SAN move " + repr(san) + " in " + gs.getFen())
+    return found
+
+
+class PgnGame():
+    def __init__(self, tags, moves, result, offset):
+        self.tags = tags  # {name: value} in file order
+        self.moves = moves  # the main line as SAN strings (comments, variations and nags left out)
+        self.result = result  # the game termination marker, '*' if there wasn't one
+        self.offset = offset  # byte offset of the game in its file
+
+    """
+    a GameState at the game's starting position (the FEN tag or the normal start)
+    """
+    def startState(self):
+        return ChessEngine.GameState(self.tags.get('FEN'))
+
+    def __repr__(self):
+        return "PgnGame(" + self.tags.get('White', '?') + " - " + self.tags.get('Black', '?') + ", " + \
+            str(len(self.moves)) + " plies, " + self.result + ")"
+
+
+"""
+generator over the games of a pgn file (a path or a file opened in binary mode), one PgnGame at a time.
+only the game being read is kept in memory
+"""
+def readGames(source):
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            yield from readGames(f)
+        return
+    tags, moves, offset = {}, [], None
+    inComment = False  # inside a { } comment that goes over more than one line
+    variationDepth = 0  # inside ( ) variations, their moves aren't part of the game
+    position = 0
+    for rawLine in source:
+        lineOffset = position
+        position += len(rawLine)
+        line = rawLine.decode('utf-8', errors='replace').strip()
+        if inComment:
+            end = line.find('}')
+            if end < 0:
+                continue
+            line = line[end + 1:]
+            inComment = False
+        if not line or line[0] == '%':
+            continue
+        if line[0] == '[' and not variationDepth:
+            if moves:  # tags after movetext without a result: the last game ended without one
+                yield PgnGame(tags, moves, '*', offset)
+                tags, moves, offset = {}, [], None
+            if offset is None:
+                offset = lineOffset
+            name, _, value = line[1:].rstrip(']').partition(' ')
+            tags[name] = value.strip().strip('"')
+            continue
+        if offset is None:
+            offset = lineOffset
+        for token in TOKEN_PATTERN.findall(line):
+            first = token[0]
+            if first == '{':
+                inComment = not token.endswith('}')
+            elif first == ';' or first == '$' or first.isdigit() and token.endswith('.'):
+                continue
+            elif token == '(':
+                variationDepth += 1
+            elif token == ')':
+                variationDepth = max(variationDepth - 1, 0)
+            elif variationDepth:
+                continue
+            elif token in RESULTS:
+                yield PgnGame(tags, moves, token, offset)
+                tags, moves, offset = {}, [], None
+            else:
+                moves.append(token)
+    if moves or tags:
+        yield PgnGame(tags, moves, '*', offset)
+
+
+"""
+plays a game through makeMove and returns the final GameState. raises UnsupportedMoveError or ValueError at the first
+move that can't be played, and ValueError when a checkmate doesn't agree with the result
+"""
+def replayGame(game):
+    gs = game.startState()
+    for san in game.moves:
+        gs.makeMove(parseSan(gs, san))
+    validMoves = gs.getValidMoves()
+    if not validMoves and gs.checkMate and game.result in ('1-0', '0-1'):
+        winner = '0-1' if gs.whiteToMove else '1-0'
+        if game.result != winner:
+            raise ValueError("the game ends in checkmate but the result is " + game.result)
+    return gs
+
+
+"""
+the pgn text of gs's game: the moves of its movelog in SAN from the position before the first one. tags are added to
+the seven tag roster ('?' where missing), the result is worked out from the position when it isn't given
+"""
+def gameToPgn(gs, tags=None, result=None):
+    checkMate, staleMate = gs.checkMate, gs.staleMate
+    played = list(gs.movelog)
+    for move in played:
+        gs.undoMove()
+    startFen = gs.getFen()
+    startWhite = gs.whiteToMove
+    startNumber = int(startFen.split()[5])
+    sanMoves = []
+    for move in played:
+        sanMoves.append(getSan(gs, move))
+        gs.makeMove(move)
+    if result is None:
+        gs.getValidMoves()  # sets checkMate / staleMate
+        result = ('0-1' if gs.whiteToMove else '1-0') if gs.checkMate else '1/2-1/2' if gs.staleMate else '*'
+    gs.checkMate, gs.staleMate = checkMate, staleMate
+    tags = dict(tags or {})
+    tags['Result'] = result
+    if startFen != ChessEngine.START_FEN:
+        tags['SetUp'] = '1'
+        tags['FEN'] = startFen
+    return formatPgn(tags, sanMoves, result, startWhite, startNumber)
+
+
+"""
+pgn text from tags, SAN moves and a result. movetext lines are kept under 80 characters
+"""
+def formatPgn(tags, sanMoves, result, startWhite=True, startNumber=1):
+    lines = ['[' + name + ' "' + str(tags.get(name, '?')) + '"]' for name in SEVEN_TAG_ROSTER]
+    lines.extend('[' + name + ' "' + str(value) + '"]' for name, value in tags.items() if name not in SEVEN_TAG_ROSTER)
+    lines.append('')
+    tokens = []
+    number = startNumber
+    white = startWhite
+    for i, san in enumerate(sanMoves):
+        if white:
+            tokens.append(str(number) + '.')
+        elif i == 0:
+            tokens.append(str(number) + '...')
+        tokens.append(san)
+        if not white:
+            number += 1
+        white = not white
+    tokens.append(result)
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = line + ' ' + token if line else token
+    lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+class ReplayReport():
+    def __init__(self, path):
+        self.path = path
+        self.games = 0  # games that replayed to the end
+        self.plies = 0  # moves played in those games
+        self.unsupported = 0  # games with castling or an underpromotion
+        self.errors = []  # (byte offset, message) of the games with an illegal or unreadable move
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return self.path + ": " + str(self.games) + " games, " + str(self.plies) + " plies, " + \
+            str(self.unsupported) + " unsupported, " + str(len(self.errors)) + " errors, " + format(self.seconds, ".2f") + "s"
+
+
+"""
+replays every game of one pgn file, returns a ReplayReport. it's the pool task of replayFiles, so it only takes and
+returns picklable things
+"""
+def replayFile(path):
+    report = ReplayReport(path)
+    start = time.perf_counter()
+    for game in readGames(path):
+        try:
+            replayGame(game)
+        except UnsupportedMoveError:
+            report.unsupported += 1
+            continue
+        except ValueError as error:
+            report.errors.append((game.offset, str(error)))
+            continue
+        report.games += 1
+        report.plies += len(game.moves)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+"""
+replays many pgn files on a process pool, one file per task. prints a line per file as it finishes and the total
+games/s, returns the ReplayReports
+"""
+def replayFiles(paths, workers=None, showErrors=0):
+    reports = []
+    start = time.perf_counter()
+    with multiprocessing.Pool(min(workers or multiprocessing.cpu_count(), max(len(paths), 1))) as pool:
+        for report in pool.imap_unordered(replayFile, paths):
+            reports.append(report)
+            print(report)
+            for offset, message in report.errors[:showErrors]:
+                print("    at byte " + str(offset) + ": " + message)
+    elapsed = time.perf_counter() - start
+    games = sum(report.games + report.unsupported + len(report.errors) for report in reports)
+    plies = sum(report.plies for report in reports)
+    print(str(games) + " games (" + str(plies) + " plies) in " + format(elapsed, ".2f") + "s: " +
+          format(games / elapsed if elapsed > 0 else 0, ",.0f") + " games/s, " +
+          format(plies / elapsed if elapsed > 0 else 0, ",.0f") + " plies/s")
+    return reports
+
+
+"""
+prints one line per game: byte offset, plies, result and the final fen (or why it couldn't be replayed)
+"""
+def printIndex(path):
+    for game in readGames(path):
+        try:
+            final = replayGame(game).getFen()
+        except ValueError as error:
+            final = "error: " + str(error)
+        print(str(game.offset) + "\t" + str(len(game.moves)) + "\t" + game.result + "\t" + final)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="SAN and PGN tools: replay and index game databases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replayParser = commands.add_parser("replay", help="check every game of pgn files on a process pool")
+    replayParser.add_argument("files", nargs="+")
+    replayParser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    replayParser.add_argument("--show-errors", type=int, default=5, help="errors printed per file")
+    indexParser = commands.add_parser("index", help="offset, plies, result and final fen of every game")
+    indexParser.add_argument("file")
+    sanParser = commands.add_parser("san", help="the legal moves of a position in SAN")
+    sanParser.add_argument("--fen", default=ChessEngine.START_FEN)
+    args = parser.parse_args(argv)
+    if args.command == "replay":
+        reports = replayFiles(args.files, args.workers, args.show_errors)
+        return 1 if any(report.errors for report in reports) else 0
+    if args.command == "index":
+        printIndex(args.file)
+    else:
+        gs = ChessEngine.GameState(args.fen)
+        validMoves = gs.getValidMoves()
+        print(" ".join(sorted(getSan(gs, move, validMoves) for move in validMoves)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
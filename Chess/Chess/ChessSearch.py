@@ -0,0 +1,528 @@
+"""
+picks a move for the side to move. negamax alpha-beta search with iterative deepening on top of
+GameState.getValidMoves/makeMove/undoMove, a transposition table (ChessTransposition), a quiescence search over
+captures at the leaves, and MVV-LVA + killer move ordering. a search can be limited by depth, wall clock time or
+nodes and returns the best move with its score, the depth it reached and the nodes per second.
+
+usage:
+    python ChessSearch.py --depth 4 [--fen "<fen>"]
+    python ChessSearch.py --time 2.5
+    python ChessSearch.py --bench --depth 3        (fixed depth over the perft reference positions)
+    python ChessSearch.py --eval-bench             (evaluations/s, incremental against a full board scan)
+    python ChessSearch.py --depth 4 --stats --profile search.prof   (engine counters and a cProfile dump)
+"""
+import argparse
+import multiprocessing
+import time
+
+import ChessEngine
+import ChessTransposition
+
+PIECE_VALUES = ChessEngine.MATERIAL_VALUES  # centipawns
+ATTACKER_ORDER = {'p': 1, 'N': 2, 'B': 3, 'R': 4, 'Q': 5, 'K': 6}  # least valuable attacker first
+CHECKMATE = 100000  # score of being mated right now, a mate n plies away scores CHECKMATE - n
+MATE_BOUND = CHECKMATE - 1000  # scores beyond this are mate scores
+STALEMATE = 0
+MAX_PLY = 64
+DEFAULT_DEPTH = 4  # used when no depth, time or node limit is given
+CHECK_EVERY = 1024  # nodes between two looks at the clock
+
+
+"""
+material + piece square score in centipawns from the side to move's point of view. GameState keeps the score up to
+date move by move (evalScore), so this is a read instead of a pass over the board. with gs.debugEvaluation set the
+running score is checked against a full recomputation every time
+"""
+def evaluate(gs):
+    score = gs.evaluation if gs.debugEvaluation else gs.evalScore
+    return score if gs.whiteToMove else -score
+
+
+class SearchAborted(Exception):  # raised inside the search when the time/node budget runs out or stop() is called
+    pass
+
+
+class SearchResult():
+    def __init__(self, bestMove, score, depth, nodes, elapsed):
+        self.bestMove = bestMove  # a Move from gs.getValidMoves(), None when there are no legal moves
+        self.score = score  # centipawns for the side to move
+        self.depth = depth  # deepest iteration that finished
+        self.nodes = nodes
+        self.elapsed = elapsed  # seconds
+        self.nps = int(nodes / elapsed) if elapsed > 0 else 0
+        self.fromBook = False  # the move came from the opening book, nothing was searched
+        self.fromTablebase = False  # the move and its exact score came from the endgame tables, nothing was searched
+        self.aborted = False  # the time/node budget or stop() ended the search before maxDepth or a mate it can't improve
+
+    """
+    plies (not moves) to mate (positive: we mate, negative: we get mated) or None when the score isn't a mate score
+    """
+    def mateIn(self):
+        if self.score > MATE_BOUND:
+            return CHECKMATE - self.score
+        if self.score < -MATE_BOUND:
+            return -(CHECKMATE + self.score)
+        return None
+
+    def __repr__(self):
+        move = self.bestMove.getChessNotation() if self.bestMove else "none"
+        return "SearchResult(move=" + move + ", score=" + str(self.score) + ", depth=" + str(self.depth) + \
+               ", nodes=" + str(self.nodes) + ", nps=" + str(self.nps) + ")"
+
+
+class Searcher():
+    def __init__(self, ttSizeMB=16, replacement=ChessTransposition.REPLACE_DEPTH, book=None, tablebase=None):
+        self.tt = ChessTransposition.TranspositionTable(ttSizeMB, replacement)  # kept between searches on purpose
+        self.book = book  # a ChessBook.OpeningBook, positions found in it are answered without a search
+        self.tablebase = tablebase  # a ChessTablebase.Tablebase, endings it covers are played perfectly without a search
+        self.stopRequested = False
+        self.nodes = 0
+
+    """
+    asks a running search to finish, it returns the best move of the deepest finished iteration.
+    safe to call from another thread
+    """
+    def stop(self):
+        self.stopRequested = True
+
+    """
+    iterative deepening search of gs. maxDepth/timeLimit (seconds)/nodeLimit can be combined, the first one reached
+    ends the search. infoCallback(result) is called after every finished depth. gs is left as it was given.
+    with a book a book position returns one of its book moves at once (result.fromBook, depth 0), and with a
+    tablebase an ending it covers returns the perfect move with its exact score (result.fromTablebase, depth 0)
+    """
+    def search(self, gs, maxDepth=None, timeLimit=None, nodeLimit=None, infoCallback=None):
+        if maxDepth is None and timeLimit is None and nodeLimit is None:
+            maxDepth = DEFAULT_DEPTH
+        maxDepth = min(maxDepth or MAX_PLY, MAX_PLY)
+        start = time.perf_counter()
+        self.deadline = start + timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.nodes = 0
+        self.stopRequested = False
+        self.killers = [[0, 0] for ply in range(MAX_PLY + 1)]
+        self.pathKeys = gameHistoryKeys(gs)  # positions already on the board, a repetition of one of them scores as a draw
+        checkMate, staleMate = gs.checkMate, gs.staleMate
+        moveCacheSize = gs.moveCacheSize
+        gs.moveCacheSize = 0  # the tree's positions would flush the caller's cache, and its lists get sorted in place
+        rootLength = len(gs.movelog)
+        rootMoves = gs.getValidMoves()
+        if not rootMoves:
+            gs.moveCacheSize = moveCacheSize
+            return SearchResult(None, -CHECKMATE if gs.checkMate else STALEMATE, 0, 0, time.perf_counter() - start)
+        bookMove = self.book.chooseMove(gs, rootMoves) if self.book is not None else None
+        if bookMove is not None:
+            gs.moveCacheSize = moveCacheSize
+            result = SearchResult(bookMove, 0, 0, 0, time.perf_counter() - start)
+            result.fromBook = True
+            return result
+        found = self.tablebase.bestMove(gs) if self.tablebase is not None else None
+        if found is not None:
+            move, outcome, plies = found
+            score = CHECKMATE - plies if outcome > 0 else -CHECKMATE + plies if outcome < 0 else STALEMATE
+            gs.checkMate, gs.staleMate = checkMate, staleMate
+            gs.moveCacheSize = moveCacheSize
+            result = SearchResult(move, score, 0, 0, time.perf_counter() - start)
+            result.fromTablebase = True
+            if infoCallback:
+                infoCallback(result)
+            return result
+        result = SearchResult(rootMoves[0], 0, 0, 0, 0.0)
+        try:
+            for depth in range(1, maxDepth + 1):
+                self.rootBest = None  # (move, score) of the best root move so far in this iteration
+                score, bestMove = self.searchRoot(gs, rootMoves, depth)
+                result = SearchResult(bestMove, score, depth, self.nodes, time.perf_counter() - start)
+                if infoCallback:
+                    infoCallback(result)
+                if abs(score) > MATE_BOUND and CHECKMATE - abs(score) <= depth:
+                    break  # a mate that this depth already sees can't get any better
+        except SearchAborted:
+            while len(gs.movelog) > rootLength:  # unwind the moves the interrupted search had on the board
+                gs.undoMove()
+            if self.rootBest is not None:
+                # the unfinished iteration searches the previous best move first, so its best move so far is at least as good
+                result = SearchResult(self.rootBest[0], self.rootBest[1], result.depth, 0, 0.0)
+            result.aborted = True
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        result.nps = int(self.nodes / result.elapsed) if result.elapsed > 0 else 0
+        gs.checkMate, gs.staleMate = checkMate, staleMate  # the search ran getValidMoves on other positions
+        gs.moveCacheSize = moveCacheSize
+        return result
+
+    """
+    the quiescence score of gs for the side to move, a depth 0 search with no move to return. the parallel search uses
+    it for the positions after the root moves at depth 1. returns (score, nodes); gs is left as it was given
+    """
+    def quiescenceSearch(self, gs):
+        self.deadline = None
+        self.nodeLimit = None
+        self.nodes = 0
+        self.stopRequested = False
+        checkMate, staleMate = gs.checkMate, gs.staleMate
+        moveCacheSize = gs.moveCacheSize
+        gs.moveCacheSize = 0
+        score = self.quiescence(gs, -CHECKMATE - 1, CHECKMATE + 1, 0)
+        gs.checkMate, gs.staleMate = checkMate, staleMate
+        gs.moveCacheSize = moveCacheSize
+        return score, self.nodes
+
+    def checkLimits(self):
+        if self.stopRequested or (self.nodeLimit is not None and self.nodes >= self.nodeLimit) or \
+                (self.deadline is not None and time.perf_counter() >= self.deadline):
+            raise SearchAborted()
+
+    """
+    one iteration at the root, returns (score, best move). rootMoves gets re-sorted so the best move is tried first
+    in the next iteration
+    """
+    def searchRoot(self, gs, rootMoves, depth):
+        alpha, beta = -CHECKMATE - 1, CHECKMATE + 1
+        entry = self.tt.probe(gs.zobristKey)
+        self.orderMoves(rootMoves, entry[3] if entry else 0, 0)
+        bestMove = None
+        for move in rootMoves:
+            score = self.searchChild(gs, move, depth - 1, -beta, -alpha, 1)
+            if score > alpha:
+                alpha = score
+                bestMove = move
+                self.rootBest = (move, score)
+        rootMoves.remove(bestMove)
+        rootMoves.insert(0, bestMove)
+        self.tt.store(gs.zobristKey, depth, alpha, ChessTransposition.BOUND_EXACT, ChessTransposition.encodeMove(bestMove))
+        return alpha, bestMove
+
+    """
+    plays move, scores the position after it from our side (repetitions are draws) and takes it back
+    """
+    def searchChild(self, gs, move, depth, alpha, beta, ply):
+        gs.makeMove(move)
+        key = gs.zobristKey
+        if key in self.pathKeys:
+            score = 0
+        else:
+            self.pathKeys.add(key)
+            score = -self.negamax(gs, depth, alpha, beta, ply)
+            self.pathKeys.discard(key)
+        gs.undoMove()
+        return score
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiescence(gs, alpha, beta, ply)
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            self.checkLimits()
+        alphaOriginal = alpha
+        key = gs.zobristKey
+        ttMove = 0
+        entry = self.tt.probe(key)
+        if entry:
+            entryDepth, entryScore, bound, ttMove = entry
+            if entryDepth >= depth:
+                entryScore = scoreFromTable(entryScore, ply)
+                if bound == ChessTransposition.BOUND_EXACT:
+                    return entryScore
+                if bound == ChessTransposition.BOUND_LOWER:
+                    alpha = max(alpha, entryScore)
+                else:
+                    beta = min(beta, entryScore)
+                if alpha >= beta:
+                    return entryScore
+        moves = gs.getValidMoves()
+        if not moves:
+            return -CHECKMATE + ply if gs.checkMate else STALEMATE
+        self.orderMoves(moves, ttMove, ply)
+        bestScore = -CHECKMATE - 1
+        bestMove = None
+        for move in moves:
+            score = self.searchChild(gs, move, depth - 1, -beta, -alpha, ply + 1)
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if move.pieceCaptured == "--":  # quiet moves that cut off are remembered as killers for this ply
+                            killers = self.killers[ply]
+                            if killers[0] != move.moveID:
+                                killers[1] = killers[0]
+                                killers[0] = move.moveID
+                        break
+        if bestScore <= alphaOriginal:
+            bound = ChessTransposition.BOUND_UPPER
+        elif bestScore >= beta:
+            bound = ChessTransposition.BOUND_LOWER
+        else:
+            bound = ChessTransposition.BOUND_EXACT
+        self.tt.store(key, depth, scoreToTable(bestScore, ply), bound, ChessTransposition.encodeMove(bestMove))
+        return bestScore
+
+    """
+    only captures (and promotions) are searched until the position is quiet, so the leaves aren't scored in the
+    middle of an exchange. the side to move may also "stand pat" and keep the static evaluation, except in check:
+    there it has to answer the check, so every evasion is searched and a mate is scored as a mate whatever the window
+    """
+    def quiescence(self, gs, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            self.checkLimits()
+        inCheck = gs.inCheck()
+        if not inCheck:
+            standPat = evaluate(gs)
+            if standPat >= beta or ply >= MAX_PLY:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+        elif ply >= MAX_PLY:
+            return evaluate(gs)
+        moves = gs.getValidMoves()
+        if not moves:
+            return -CHECKMATE + ply if gs.checkMate else STALEMATE
+        captures = moves if inCheck else [move for move in moves if move.pieceCaptured != "--" or move.isPawnPromotion]
+        captures.sort(key=mvvLva, reverse=True)
+        for move in captures:
+            gs.makeMove(move)
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+    """
+    sorts moves best first: the transposition table move, captures by MVV-LVA, promotions, killer moves, the rest
+    """
+    def orderMoves(self, moves, ttMove, ply):
+        killers = self.killers[ply]
+
+        def moveScore(move):
+            if ttMove and move.moveID & ChessEngine.MOVE_SQUARES == ttMove:
+                return 1000000
+            if move.pieceCaptured != "--":
+                return 100000 + mvvLva(move)
+            if move.isPawnPromotion:
+                return 90000
+            if move.moveID == killers[0]:
+                return 80000
+            if move.moveID == killers[1]:
+                return 70000
+            return 0
+        moves.sort(key=moveScore, reverse=True)
+
+
+"""
+most valuable victim, least valuable attacker: pawn takes queen comes before queen takes pawn
+"""
+def mvvLva(move):
+    return PIECE_VALUES[move.pieceCaptured[1]] * 10 - ATTACKER_ORDER[move.pieceMoved[1]] if move.pieceCaptured != "--" else 0
+
+
+# mate scores are stored relative to the node (mate in n from here) and turned back into distance from the root
+def scoreToTable(score, ply):
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+"""
+zobrist hashes of every position of the game so far (current one included), found by stepping back through the movelog
+"""
+def gameHistoryKeys(gs):
+    keys = {gs.zobristKey}
+    undone = []
+    while gs.movelog:
+        undone.append(gs.movelog[-1])
+        gs.undoMove()
+        keys.add(gs.zobristKey)
+    for move in reversed(undone):
+        gs.makeMove(move)
+    return keys
+
+
+"""
+runs a search in its own process so the caller (the gui loop) never waits for it. poll() gives the result once it's
+ready and cancel() kills the search at once. gs is copied into the new process, the caller's GameState isn't touched.
+bookPath is an opening book file and tablebaseDir a directory of endgame tables that the process maps (and shares
+through the page cache) before searching
+"""
+class BackgroundSearch():
+    def __init__(self, gs, maxDepth=None, timeLimit=None, nodeLimit=None, bookPath=None, tablebaseDir=None):
+        self.resultQueue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=backgroundSearchMain, daemon=True,
+                                               args=(gs, maxDepth, timeLimit, nodeLimit, self.resultQueue, bookPath,
+                                                     tablebaseDir))
+        self.process.start()
+        self.result = None
+        self.done = False
+
+    """
+    True once the search finished, the best move's notation ("e2e4", or None without legal moves) is in self.result
+    """
+    def poll(self):
+        if not self.done and not self.resultQueue.empty():
+            self.result = self.resultQueue.get()
+            self.done = True
+            self.process.join()
+        return self.done
+
+    def cancel(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+
+
+def backgroundSearchMain(gs, maxDepth, timeLimit, nodeLimit, resultQueue, bookPath=None, tablebaseDir=None):
+    book = tablebase = None
+    if bookPath is not None:
+        import ChessBook
+        book = ChessBook.OpeningBook(bookPath)
+    if tablebaseDir is not None:
+        import ChessTablebase
+        tablebase = ChessTablebase.Tablebase(tablebaseDir)
+    result = Searcher(book=book, tablebase=tablebase).search(gs, maxDepth, timeLimit, nodeLimit)
+    resultQueue.put(result.bestMove.getChessNotation() if result.bestMove else None)
+
+
+"""
+one shot search with a fresh transposition table, returns a SearchResult
+"""
+def findBestMove(gs, maxDepth=None, timeLimit=None, nodeLimit=None, ttSizeMB=16, book=None, tablebase=None):
+    return Searcher(ttSizeMB, book=book, tablebase=tablebase).search(gs, maxDepth, timeLimit, nodeLimit)
+
+
+def printInfo(result):
+    move = result.bestMove.getChessNotation() if result.bestMove else "none"
+    mate = result.mateIn()
+    score = "mate " + str(mate) if mate is not None else "cp " + str(result.score)
+    print("depth " + str(result.depth) + " score " + score + " nodes " + str(result.nodes) + " nps " + str(result.nps) +
+          " time " + format(result.elapsed, ".3f") + " move " + move)
+
+
+"""
+fixed depth search over the perft reference positions, prints the totals. the node count only changes when the
+search itself changes, so it doubles as a quick regression check
+"""
+def runBench(depth, ttSizeMB=16):
+    import ChessPerft
+    totalNodes = 0
+    totalTime = 0.0
+    for name, fen, expected in ChessPerft.REFERENCE_POSITIONS:
+        result = Searcher(ttSizeMB).search(ChessEngine.GameState(fen), maxDepth=depth)
+        totalNodes += result.nodes
+        totalTime += result.elapsed
+        print(name + ": " + repr(result))
+    print(str(totalNodes) + " nodes in " + format(totalTime, ".3f") + "s (" +
+          format(totalNodes / totalTime if totalTime > 0 else 0, ",.0f") + " nodes/s)")
+    return totalNodes
+
+
+"""
+micro-benchmark of evaluate: evaluations/s of the running score against GameState.computeEvaluation's full scan of
+the board, over positions of random games from the reference positions (every one of them checked on the way),
+and what keeping the score costs makeMove + undoMove
+"""
+def runEvalBench(positions=2000, repeat=50):
+    import random
+    import ChessPerft
+    rng = random.Random(0)
+    states = []
+    for i in range(positions):
+        gs = ChessEngine.GameState(ChessPerft.REFERENCE_POSITIONS[i % len(ChessPerft.REFERENCE_POSITIONS)][1])
+        gs.debugEvaluation = True
+        for ply in range(rng.randrange(40)):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(rng.choice(moves))
+            evaluate(gs)  # raises when the running score drifted
+        for ply in range(len(gs.movelog) // 2):
+            gs.undoMove()
+            evaluate(gs)
+        gs.debugEvaluation = False
+        states.append(gs)
+    start = time.perf_counter()
+    for i in range(repeat):
+        for gs in states:
+            evaluate(gs)
+    incremental = time.perf_counter() - start
+    start = time.perf_counter()
+    for gs in states:
+        gs.computeEvaluation()
+    full = (time.perf_counter() - start) * repeat
+    count = positions * repeat
+    print(str(positions) + " positions checked against a full recomputation after every make/undo")
+    print("incremental: " + format(count / incremental, ",.0f") + " evaluations/s")
+    print("full scan:   " + format(count / full, ",.0f") + " evaluations/s (" + format(full / incremental, ".0f") + "x slower)")
+    gs = ChessEngine.GameState()
+    moves = list(gs.getValidMoves())
+    start = time.perf_counter()
+    for i in range(repeat * 100):
+        for move in moves:
+            gs.makeMove(move)
+            gs.undoMove()
+    elapsed = time.perf_counter() - start
+    print("makeMove + undoMove: " + format(repeat * 100 * len(moves) / elapsed, ",.0f") + " pairs/s with the score kept")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="search a position with the alpha-beta engine")
+    parser.add_argument("--fen", default=ChessEngine.START_FEN, help="position to search (default: starting position)")
+    parser.add_argument("--depth", type=int, help="deepest iteration")
+    parser.add_argument("--time", type=float, help="wall clock budget in seconds")
+    parser.add_argument("--nodes", type=int, help="node budget")
+    parser.add_argument("--hash", type=int, default=16, help="transposition table size in MB")
+    parser.add_argument("--book", help="opening book file (see ChessBook), book positions aren't searched")
+    parser.add_argument("--tablebases", help="directory of endgame tables (see ChessTablebase)")
+    parser.add_argument("--bench", action="store_true", help="fixed depth search of the reference positions")
+    parser.add_argument("--eval-bench", action="store_true", help="evaluations/s, incremental against a full scan")
+    parser.add_argument("--stats", action="store_true", help="print the engine's call counters and generator times")
+    parser.add_argument("--profile", metavar="PATH", help="run under cProfile and write the pstats dump to PATH")
+    args = parser.parse_args(argv)
+
+    def run():  # returns the nodes searched for --stats, None when nothing was searched
+        if args.bench:
+            return runBench(args.depth or DEFAULT_DEPTH, args.hash)
+        if args.eval_bench:
+            runEvalBench()
+            return None
+        book = None
+        if args.book:
+            import ChessBook
+            book = ChessBook.OpeningBook(args.book)
+        tablebase = None
+        if args.tablebases:
+            import ChessTablebase
+            tablebase = ChessTablebase.Tablebase(args.tablebases)
+        result = Searcher(args.hash, book=book, tablebase=tablebase).search(ChessEngine.GameState(args.fen), args.depth,
+                                                                            args.time, args.nodes, printInfo)
+        source = "book move" if result.fromBook else "tablebase move" if result.fromTablebase else \
+            str(result.nodes) + " nodes, " + str(result.nps) + " nodes/s"
+        print("bestmove " + (result.bestMove.getChessNotation() if result.bestMove else "none") + " (" + source + ")")
+        return result.nodes
+
+    if args.stats:
+        ChessEngine.enableStats()
+    if args.profile:
+        nodes = ChessEngine.profile(run, path=args.profile)
+    else:
+        nodes = run()
+    if args.stats:
+        ChessEngine.printStats(nodes=nodes)
+        ChessEngine.disableStats()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
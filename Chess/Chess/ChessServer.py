@@ -0,0 +1,377 @@
+"""
+asyncio game server: hosts many independent games at once over a local socket. every session has its own GameState
+(and with it its own move log), so thousands of games can be played side by side by any number of clients.
+
+the protocol is one json object per line in both directions. every request has a "cmd", answers have "ok" and either
+the result fields or an "error":
+    {"cmd": "new", "fen": "<optional fen>"}          -> {"ok": true, "session": 1, "fen": ..., "status": "play"}
+    {"cmd": "move", "session": 1, "move": "e2e4"}     -> {"ok": true, "fen": ..., "status": "play"/"checkmate"/"stalemate"}
+    {"cmd": "undo", "session": 1}                     -> {"ok": true, "fen": ..., "status": ...}
+    {"cmd": "reset", "session": 1}                    -> {"ok": true, "fen": ..., "status": ...}
+    {"cmd": "legal", "session": 1}                    -> {"ok": true, "moves": ["a2a3", ...]}
+    {"cmd": "state", "session": 1}                    -> {"ok": true, "fen": ..., "status": ..., "moves": [move log]}
+    {"cmd": "close", "session": 1}                    -> {"ok": true}
+    {"cmd": "stats"}                                  -> sessions, requests, sessions/s and latency percentiles
+moves are in the uci notation of ChessUci ("e7e8q" for a promotion). sessions belong to the connection that opened
+them and are closed with it.
+
+move generation is the expensive part, so everything that touches a GameState runs on a thread pool and the event
+loop only parses and routes lines. the GIL still runs one thread at a time, the pool is there so that a slow request
+never holds up the loop (and with it every other connection). requests of one session are serialized by a lock.
+
+usage:
+    python ChessServer.py serve --port 8765 [--threads 4]
+    python ChessServer.py load --port 8765 --sessions 1000 --concurrency 100 --plies 40
+    python ChessServer.py bench --sessions 1000 --concurrency 100     (starts its own server process)
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import multiprocessing
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ChessEngine
+import ChessUci
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_THREADS = 4
+LATENCY_SAMPLES = 100000  # latencies kept per command for the percentiles, the oldest are dropped first
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+"""
+the value below which fraction percent of the sorted values lie (nearest rank)
+"""
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return 0.0
+    rank = int(round(fraction / 100.0 * len(sortedValues) + 0.5)) - 1
+    return sortedValues[min(max(rank, 0), len(sortedValues) - 1)]
+
+
+"""
+{"count", "p50", "p90", ...} of a list of latencies in seconds, the percentiles in milliseconds
+"""
+def latencySummary(latencies):
+    values = sorted(latencies)
+    summary = {"count": len(values)}
+    for fraction in PERCENTILES:
+        summary["p" + format(fraction, "g")] = round(percentile(values, fraction) * 1000, 3)
+    return summary
+
+
+def gameStatus(gs):
+    return "checkmate" if gs.checkMate else "stalemate" if gs.staleMate else "play"
+
+
+class Session():
+    def __init__(self, sessionId, fen=None):
+        self.sessionId = sessionId
+        self.fen = fen  # the start position, reset goes back to it
+        self.gs = ChessEngine.GameState(fen)
+        self.gs.getValidMoves()  # sets checkMate / staleMate of the start position
+        self.lock = asyncio.Lock()
+
+    """
+    the functions below run on the thread pool, never on the event loop
+    """
+    def position(self):
+        return {"fen": self.gs.getFen(), "status": gameStatus(self.gs)}
+
+    def move(self, text):
+        self.gs.makeMove(ChessUci.parseUciMove(self.gs, text))  # ValueError for an illegal move
+        self.gs.getValidMoves()
+        return self.position()
+
+    def undo(self):
+        if not self.gs.movelog:
+            raise ValueError("no move to undo")
+        self.gs.undoMove()
+        self.gs.getValidMoves()
+        return self.position()
+
+    def reset(self):
+        self.gs = ChessEngine.GameState(self.fen)
+        self.gs.getValidMoves()
+        return self.position()
+
+    def legal(self):
+        return {"moves": [ChessUci.uciMove(move) for move in self.gs.getValidMoves()]}
+
+    def state(self):
+        result = self.position()
+        result["moves"] = [ChessUci.uciMove(move) for move in self.gs.movelog]
+        return result
+
+
+class GameServer():
+    def __init__(self, threads=DEFAULT_THREADS):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="chess")
+        self.sessions = {}  # session id: Session
+        self.nextId = itertools.count(1)
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_SAMPLES))  # cmd: seconds
+        self.requests = 0
+        self.errors = 0
+        self.sessionsOpened = 0
+        self.sessionsClosed = 0
+        self.connections = 0
+        self.started = time.perf_counter()
+        self.server = None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.server = await asyncio.start_server(self.handleClient, host, port)
+        return self.server.sockets[0].getsockname()[1]  # the real port when port 0 was asked for
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    """
+    reads request lines of one connection until it closes and answers each of them in order
+    """
+    async def handleClient(self, reader, writer):
+        self.connections += 1
+        owned = set()  # sessions opened on this connection
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                startTime = time.perf_counter()
+                cmd, response = await self.dispatch(line, owned)
+                writer.write(json.dumps(response, separators=(",", ":")).encode() + b"\n")
+                await writer.drain()
+                self.requests += 1
+                self.latencies[cmd].append(time.perf_counter() - startTime)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.connections -= 1
+            for sessionId in owned:
+                self.closeSession(sessionId)
+            writer.close()
+
+    """
+    one request line to (cmd, response dict). errors are answered, they never close the connection. a connection
+    can only use the sessions it opened itself
+    """
+    async def dispatch(self, line, owned):
+        cmd = "invalid"
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("a request is a json object")
+            cmd = str(request.get("cmd"))
+            if cmd == "new":
+                fen = request.get("fen")
+                if fen is not None and not isinstance(fen, str):
+                    raise ValueError("fen must be a string")
+                session = await self.run(Session, next(self.nextId), fen)
+                self.sessions[session.sessionId] = session
+                owned.add(session.sessionId)
+                self.sessionsOpened += 1
+                result = dict(session.position(), session=session.sessionId)
+            elif cmd == "stats":
+                result = self.stats()
+            elif cmd in ("move", "undo", "reset", "legal", "state", "close"):
+                sessionId = request.get("session")
+                # another connection's session is answered as if it didn't exist
+                if not isinstance(sessionId, int) or sessionId not in owned:
+                    raise ValueError("no session " + str(sessionId))
+                session = self.sessions[sessionId]
+                if cmd == "move" and not isinstance(request.get("move"), str):
+                    raise ValueError("move must be a string")
+                async with session.lock:
+                    if cmd == "move":
+                        result = await self.run(session.move, request["move"])
+                    elif cmd == "close":
+                        owned.discard(session.sessionId)
+                        self.closeSession(session.sessionId)
+                        result = {}
+                    else:
+                        result = await self.run(getattr(session, cmd))
+            else:
+                raise ValueError("unknown cmd " + cmd)
+        except (ValueError, TypeError) as error:  # bad json, bad fields, illegal moves
+            self.errors += 1
+            return cmd, {"ok": False, "error": str(error)}
+        result["ok"] = True
+        return cmd, result
+
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def closeSession(self, sessionId):
+        if self.sessions.pop(sessionId, None) is not None:
+            self.sessionsClosed += 1
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started
+        return {"uptime": round(elapsed, 3), "connections": self.connections, "activeSessions": len(self.sessions),
+                "sessionsOpened": self.sessionsOpened, "sessionsClosed": self.sessionsClosed,
+                "sessionsPerSecond": round(self.sessionsClosed / elapsed, 2) if elapsed > 0 else 0.0,
+                "requests": self.requests, "errors": self.errors,
+                "requestsPerSecond": round(self.requests / elapsed, 2) if elapsed > 0 else 0.0,
+                "latency": {cmd: latencySummary(values) for cmd, values in sorted(self.latencies.items())}}
+
+
+async def serve(host, port, threads):
+    server = GameServer(threads)
+    port = await server.start(host, port)
+    print("serving on " + host + ":" + str(port), flush=True)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+class Client():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.latencies = collections.defaultdict(list)  # cmd: seconds, as seen by the client
+
+    async def request(self, cmd, **fields):
+        fields["cmd"] = cmd
+        startTime = time.perf_counter()
+        self.writer.write(json.dumps(fields, separators=(",", ":")).encode() + b"\n")
+        response = json.loads(await self.reader.readline())
+        self.latencies[cmd].append(time.perf_counter() - startTime)
+        return response
+
+
+"""
+load generator: concurrency connections share sessions games. each game is opened, played with random legal moves
+(now and then taking one back) until it ends or reaches plies, and closed. returns a report dict with the client side
+latencies and the server's own stats
+"""
+async def loadTest(host, port, sessions=1000, concurrency=100, plies=40, undoRate=0.05, seed=0):
+    remaining = iter(range(sessions))
+    clients = []
+    failures = []
+
+    async def playGames(number):
+        rng = random.Random(seed * 100003 + number)
+        client = Client(*await asyncio.open_connection(host, port))
+        clients.append(client)
+        for game in remaining:  # a shared iterator, every game is played by exactly one connection
+            response = await client.request("new")
+            sessionId = response["session"]
+            played = 0
+            for ply in range(plies):
+                moves = (await client.request("legal", session=sessionId))["moves"]
+                if not moves:
+                    break
+                if played and rng.random() < undoRate:
+                    response = await client.request("undo", session=sessionId)
+                    played -= 1
+                else:
+                    response = await client.request("move", session=sessionId, move=rng.choice(moves))
+                    played += 1
+                if not response["ok"]:
+                    failures.append(response["error"])
+                    break
+            await client.request("close", session=sessionId)
+        client.writer.close()
+
+    startTime = time.perf_counter()
+    await asyncio.gather(*(playGames(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - startTime
+    reader, writer = await asyncio.open_connection(host, port)
+    serverStats = await Client(reader, writer).request("stats")
+    writer.close()
+    latencies = collections.defaultdict(list)
+    for client in clients:
+        for cmd, values in client.latencies.items():
+            latencies[cmd].extend(values)
+    requests = sum(len(values) for values in latencies.values())
+    return {"sessions": sessions, "concurrency": concurrency, "seconds": round(elapsed, 3),
+            "sessionsPerSecond": round(sessions / elapsed, 2), "requestsPerSecond": round(requests / elapsed, 2),
+            "failures": failures[:10], "clientLatency": {cmd: latencySummary(values) for cmd, values in sorted(latencies.items())},
+            "server": serverStats}
+
+
+def printReport(report):
+    print("sessions " + str(report["sessions"]) + " over " + str(report["concurrency"]) + " connections in " +
+          str(report["seconds"]) + " s: " + str(report["sessionsPerSecond"]) + " sessions/s, " +
+          str(report["requestsPerSecond"]) + " requests/s, " + str(len(report["failures"])) + " failures")
+    for title, latency in (("client", report["clientLatency"]), ("server", report["server"]["latency"])):
+        print(title + " latency (ms):")
+        for cmd, summary in latency.items():
+            print("    " + cmd.ljust(6) + " n=" + str(summary["count"]).ljust(8) +
+                  "  ".join(key + " " + format(value, ".3f") for key, value in summary.items() if key != "count"))
+    server = report["server"]
+    print("server: " + str(server["sessionsClosed"]) + " sessions closed, " + str(server["sessionsPerSecond"]) +
+          " sessions/s and " + str(server["requestsPerSecond"]) + " requests/s over its uptime, " +
+          str(server["errors"]) + " errors")
+
+
+def runServer(host, port, threads, ports):  # the server process of bench, tells its port through the queue
+    async def main():
+        server = GameServer(threads)
+        ports.put(await server.start(host, port))
+        await server.server.serve_forever()
+    asyncio.run(main())
+
+
+"""
+starts a server in its own process (so the load generator doesn't share its core), loads it and prints the report
+"""
+def bench(host, sessions, concurrency, plies, threads, seed):
+    ports = multiprocessing.Queue()
+    process = multiprocessing.Process(target=runServer, args=(host, 0, threads, ports), daemon=True)
+    process.start()
+    try:
+        port = ports.get(timeout=30)
+        report = asyncio.run(loadTest(host, port, sessions, concurrency, plies, seed=seed))
+    finally:
+        process.terminate()
+        process.join()
+    printReport(report)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="asyncio server for many concurrent games, with a load generator")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serveParser = commands.add_parser("serve", help="run the game server")
+    serveParser.add_argument("--host", default=DEFAULT_HOST)
+    serveParser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serveParser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="move generation threads")
+    for name, description in (("load", "play random games against a running server"),
+                       ("bench", "start a server process and load it")):
+        loadParser = commands.add_parser(name, help=description)
+        loadParser.add_argument("--host", default=DEFAULT_HOST)
+        if name == "load":
+            loadParser.add_argument("--port", type=int, default=DEFAULT_PORT)
+        else:
+            loadParser.add_argument("--threads", type=int, default=DEFAULT_THREADS)
+        loadParser.add_argument("--sessions", type=int, default=1000, help="games to play")
+        loadParser.add_argument("--concurrency", type=int, default=100, help="connections playing at once")
+        loadParser.add_argument("--plies", type=int, default=40, help="moves per game at most")
+        loadParser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(args.host, args.port, args.threads))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "load":
+        report = asyncio.run(loadTest(args.host, args.port, args.sessions, args.concurrency, args.plies, seed=args.seed))
+        printReport(report)
+        return 1 if report["failures"] else 0
+    else:
+        report = bench(args.host, args.sessions, args.concurrency, args.plies, args.threads, args.seed)
+        return 1 if report["failures"] else 0
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,422 @@
+"""
+endgame tablebases for king + queen / rook / pawn against a lone king (KQK, KRK, KPK), made by retrograde analysis
+with the ChessEngine move rules. every position of an ending has one byte in a dense table, addressed by the squares
+of its three pieces and the side to move, that says whether the side to move wins, draws or loses and in how many
+plies the game ends in mate with best play (distance to mate). the tables are written to disk and read back through
+mmap, so probing costs an index computation and a byte read and the pages are shared between processes.
+
+the tables are for white having the extra piece; a position where black has it is probed with the colors swapped
+and the board mirrored. the engine only promotes to a queen and doesn't count the fifty move rule, so the tables
+are exact for its rules (KPK promotions lead into KQK, which has to be generated first).
+
+byte values, for the side to move:
+    0           draw (and stalemate)
+    1 - 127     wins, mate in that many plies
+    128 - 254   loses, mated in (value - 128) plies (128 = checkmated now)
+    255         not a legal position (two pieces on one square, the side not to move in check, a pawn on row 1 or 8)
+
+generation: a process pool generates the legal moves of every position (one white king square per task) and returns
+the successor indices, the main process then walks backwards from the checkmates: a position with a move into a lost
+position is won one ply later, a position whose moves all lead into won positions is lost one ply after the longest
+of them. whatever is never reached is a draw.
+
+usage:
+    python ChessTablebase.py generate --dir tablebases [--workers 4] [KQK KRK KPK]
+    python ChessTablebase.py probe --dir tablebases --fen "8/8/8/4k3/8/8/8/4K2R w - - 0 1"
+"""
+import argparse
+import mmap
+import multiprocessing
+import os
+import time
+from array import array
+
+import ChessEngine
+
+MATERIALS = ('KQK', 'KRK', 'KPK')  # in generation order, KPK needs KQK for its promotions
+STRONG_PIECE = {'KQK': 'wQ', 'KRK': 'wR', 'KPK': 'wp'}
+TABLE_SIZE = 64 * 64 * 64 * 2  # white king, white piece, black king, side to move
+SLICE_SIZE = 64 * 64 * 2  # the positions of one white king square, one pool task
+MAGIC = b"CHTB0001"
+HEADER_SIZE = 16  # magic + material name padded to 8 bytes
+
+DRAW = 0
+WIN = 1
+LOSS = -1
+LOSS_BASE = 128
+INVALID = 255
+MAX_PLIES = 126
+
+# position status from the move generation pass
+NORMAL, ILLEGAL, MATED, STALEMATED = 0, 1, 2, 3
+BARE_FEN = "7k/8/8/8/8/8/8/K7 w - - 0 1"
+
+
+"""
+table index of a position: white king, white piece and black king squares (row * 8 + col), whiteToMove
+"""
+def tableIndex(whiteKing, whitePiece, blackKing, whiteToMove):
+    return ((whiteKing * 64 + whitePiece) * 64 + blackKing) * 2 + (0 if whiteToMove else 1)
+
+
+"""
+(result, plies) of a table byte: result is WIN, DRAW or LOSS for the side to move, None for an illegal position
+"""
+def decodeValue(value):
+    if value == INVALID:
+        return None
+    if value == DRAW:
+        return DRAW, 0
+    if value < LOSS_BASE:
+        return WIN, value
+    return LOSS, value - LOSS_BASE
+
+
+def tablePath(directory, material):
+    return os.path.join(directory, material + ".tb")
+
+
+"""
+which table a position belongs to and its index there: (material, index), ('KK', None) for two bare kings and
+None for material no table covers
+"""
+def positionKey(gs):
+    occupied = gs.colorBitboards['w'] | gs.colorBitboards['b']
+    count = bin(occupied).count('1')
+    if count == 2:
+        return 'KK', None
+    if count != 3:
+        return None
+    whiteKing = gs.pieceBitboards['wK'].bit_length() - 1
+    blackKing = gs.pieceBitboards['bK'].bit_length() - 1
+    pieceSq = (occupied ^ ChessEngine.SQUARE_BITS[whiteKing] ^ ChessEngine.SQUARE_BITS[blackKing]).bit_length() - 1
+    piece = gs.squares[pieceSq]
+    material = 'K' + piece[1].upper() + 'K'
+    if material not in STRONG_PIECE:
+        return None
+    if piece[0] == 'w':
+        return material, tableIndex(whiteKing, pieceSq, blackKing, gs.whiteToMove)
+    # black has the piece: swap the colors and mirror the rows (sq ^ 56) so it becomes white's piece
+    return material, tableIndex(blackKing ^ 56, pieceSq ^ 56, whiteKing ^ 56, not gs.whiteToMove)
+
+
+class Tablebase():
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}  # material: mmap of its file, opened on first use
+        self.probes = 0
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+        self.tables = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    """
+    the mmap of a material's table, None when its file isn't there
+    """
+    def getTable(self, material):
+        table = self.tables.get(material)
+        if table is None:
+            path = tablePath(self.directory, material)
+            if not os.path.exists(path):
+                return None
+            with open(path, 'rb') as f:
+                table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if len(table) != HEADER_SIZE + TABLE_SIZE or table[:8] != MAGIC or table[8:8 + len(material)] != material.encode():
+                table.close()
+                raise ValueError(path + " is not a " + material + " table")
+            self.tables[material] = table
+        return table
+
+    """
+    (result, plies) of gs for the side to move, see decodeValue. None when no table covers the position
+    """
+    def probe(self, gs):
+        key = positionKey(gs)
+        if key is None:
+            return None
+        material, index = key
+        if material == 'KK':
+            return DRAW, 0
+        table = self.getTable(material)
+        if table is None:
+            return None
+        self.probes += 1
+        return decodeValue(table[HEADER_SIZE + index])
+
+    """
+    the move that keeps the best result: the fastest mate when winning, a move that holds the draw, the slowest mate
+    when losing. returns (move, result, plies) or None when the position (or one after a move) isn't in the tables.
+    gs is left as it was given
+    """
+    def bestMove(self, gs):
+        current = self.probe(gs)
+        if current is None:
+            return None
+        checkMate, staleMate = gs.checkMate, gs.staleMate
+        best = None
+        bestRank = None
+        for move in gs.getValidMoves():
+            gs.makeMove(move)
+            after = self.probe(gs)
+            gs.undoMove()
+            if after is None:
+                best = None
+                break
+            result, plies = after
+            if result == LOSS:  # the opponent is lost: we win, sooner is better
+                rank = (2, -plies)
+            elif result == DRAW:
+                rank = (1, 0)
+            else:  # the opponent wins: hold out as long as possible
+                rank = (0, plies)
+            if bestRank is None or rank > bestRank:
+                best, bestRank = move, rank
+        gs.checkMate, gs.staleMate = checkMate, staleMate
+        if best is None:
+            return None
+        return best, current[0], current[1]
+
+
+workerState = None  # the GameState a generation worker sets positions up on, made once by initWorker
+workerPromotions = None  # the KQK table of a worker, for the promotions of KPK
+
+
+def initWorker(directory):
+    global workerState, workerPromotions
+    workerState = ChessEngine.GameState(BARE_FEN)
+    path = tablePath(directory, 'KQK')
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            workerPromotions = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+"""
+puts the three pieces on workerState's (otherwise empty) board
+"""
+def setPosition(gs, whiteKing, piece, pieceSq, blackKing):
+    occupied = gs.occupied
+    while occupied:
+        bit = occupied & -occupied
+        occupied ^= bit
+        gs.removePiece(bit.bit_length() - 1)
+    gs.putPiece('wK', whiteKing)
+    gs.putPiece(piece, pieceSq)
+    gs.putPiece('bK', blackKing)
+    gs.occupied = gs.colorBitboards['w'] | gs.colorBitboards['b']
+    gs.WhiteKnightLocation = divmod(whiteKing, 8)
+    gs.BlackKnightLocation = divmod(blackKing, 8)
+
+
+"""
+pool task: the move generation pass over the positions with the white king on one square.
+returns (whiteKing, statuses, offsets, successors): the status of every position of the slice, and for every
+position its successors from offsets[i] to offsets[i + 1]. a successor is a table index, or -1 - value for a move
+that leaves the table (a capture gives two bare kings, a promotion a KQK position) with the value of where it lands
+"""
+def generateSlice(task):
+    material, whiteKing = task
+    piece = STRONG_PIECE[material]
+    gs = workerState
+    statuses = bytearray(SLICE_SIZE)
+    offsets = array('l', [0]) * (SLICE_SIZE + 1)
+    successors = array('l')
+    kingBit = ChessEngine.SQUARE_BITS[whiteKing]
+    for pieceSq in range(64):
+        for blackKing in range(64):
+            local = (pieceSq * 64 + blackKing) * 2
+            offsets[local] = offsets[local + 1] = len(successors)  # a position ends where the next one starts
+            if pieceSq == whiteKing or blackKing == whiteKing or blackKing == pieceSq or \
+                    (piece[1] == 'p' and ChessEngine.SQUARE_BITS[pieceSq] & ChessEngine.LAST_ROWS):
+                statuses[local] = statuses[local + 1] = ILLEGAL
+                continue
+            setPosition(gs, whiteKing, piece, pieceSq, blackKing)
+            for side in (0, 1):
+                local = (pieceSq * 64 + blackKing) * 2 + side
+                offsets[local] = len(successors)
+                gs.whiteToMove = side == 0
+                waitingKing, waitingColor = (blackKing, 'w') if side == 0 else (whiteKing, 'b')
+                if gs.attackersTo(waitingKing, waitingColor, gs.occupied):  # the side not to move is in check
+                    statuses[local] = ILLEGAL
+                    continue
+                moves = gs.getValidMoves()
+                if not moves:
+                    statuses[local] = MATED if gs.checkMate else STALEMATED
+                    continue
+                for move in moves:
+                    start, end = move.startSq, move.endSq
+                    if move.pieceCaptured != "--":
+                        successors.append(-1 - DRAW)  # only a king can capture, leaving two bare kings
+                    elif move.isPawnPromotion:
+                        index = tableIndex(whiteKing, end, blackKing, False)
+                        successors.append(-1 - workerPromotions[HEADER_SIZE + index])
+                    elif start == whiteKing:
+                        successors.append(tableIndex(end, pieceSq, blackKing, side == 1))
+                    elif start == pieceSq:
+                        successors.append(tableIndex(whiteKing, end, blackKing, side == 1))
+                    else:
+                        successors.append(tableIndex(whiteKing, pieceSq, end, side == 1))
+    offsets[SLICE_SIZE] = len(successors)
+    return whiteKing, bytes(statuses), offsets, successors
+
+
+"""
+generates one material's table with a pool of workers and writes it to directory. returns the table as bytes
+"""
+def generateTable(material, directory, workers=None):
+    if material == 'KPK' and not os.path.exists(tablePath(directory, 'KQK')):
+        raise ValueError("KPK promotes into KQK, generate KQK first")
+    start = time.perf_counter()
+    statuses = bytearray(TABLE_SIZE)
+    sliceMoves = [None] * 64  # white king square: (offsets, successors)
+    with multiprocessing.Pool(workers or multiprocessing.cpu_count(), initWorker, (directory,)) as pool:
+        for whiteKing, sliceStatuses, offsets, successors in pool.imap_unordered(
+                generateSlice, [(material, whiteKing) for whiteKing in range(64)]):
+            statuses[whiteKing * SLICE_SIZE:(whiteKing + 1) * SLICE_SIZE] = sliceStatuses
+            sliceMoves[whiteKing] = (offsets, successors)
+    generated = time.perf_counter() - start
+
+    # predecessors of every position (the edges reversed) and the moves left to refute, plus the moves that leave
+    # the table grouped by the plies of where they land
+    predecessorCount = array('l', [0]) * (TABLE_SIZE + 1)
+    movesLeft = array('l', [0]) * TABLE_SIZE
+    exits = {}  # plies: [(index, the side to move after the exit wins)]
+    edges = 0
+    for whiteKing in range(64):
+        offsets, successors = sliceMoves[whiteKing]
+        base = whiteKing * SLICE_SIZE
+        for local in range(SLICE_SIZE):
+            first, last = offsets[local], offsets[local + 1]
+            movesLeft[base + local] = last - first
+            for successor in successors[first:last]:
+                if successor >= 0:
+                    predecessorCount[successor + 1] += 1
+                else:
+                    decoded = decodeValue(-1 - successor)
+                    if decoded is not None and decoded[0] != DRAW:
+                        exits.setdefault(decoded[1], []).append((base + local, decoded[0] == WIN))
+        edges += len(successors)
+    for index in range(TABLE_SIZE):
+        predecessorCount[index + 1] += predecessorCount[index]
+    predecessors = array('l', [0]) * predecessorCount[TABLE_SIZE]
+    fill = array('l', predecessorCount)
+    for whiteKing in range(64):
+        offsets, successors = sliceMoves[whiteKing]
+        base = whiteKing * SLICE_SIZE
+        for local in range(SLICE_SIZE):
+            for successor in successors[offsets[local]:offsets[local + 1]]:
+                if successor >= 0:
+                    predecessors[fill[successor]] = base + local
+                    fill[successor] += 1
+    sliceMoves = None
+
+    # retrograde pass, one ply at a time from the checkmates
+    values = bytearray(TABLE_SIZE)
+    for index in range(TABLE_SIZE):
+        if statuses[index] == ILLEGAL:
+            values[index] = INVALID
+    resolved = bytearray(statuses[index] != NORMAL for index in range(TABLE_SIZE))  # stalemates stay draws
+    frontier = [index for index in range(TABLE_SIZE) if statuses[index] == MATED]
+    for index in frontier:
+        values[index] = LOSS_BASE
+    plies = 0
+    longest = 0
+    while frontier or exits:
+        if plies + 1 > MAX_PLIES:
+            raise ValueError(material + " has mates longer than a table byte can hold")
+        successorWins = plies % 2 == 1  # the frontier is lost (even plies) or won (odd plies) for its side to move
+        reached = []
+        for index in frontier:
+            reached.extend((predecessor, successorWins) for predecessor in
+                           predecessors[predecessorCount[index]:predecessorCount[index + 1]])
+        nextFrontier = []
+        for index, successorWins in reached + exits.pop(plies, []):
+            if resolved[index]:
+                continue
+            if not successorWins:  # a move into a lost position: won in one more ply
+                values[index] = plies + 1
+                resolved[index] = 1
+                nextFrontier.append(index)
+            else:
+                movesLeft[index] -= 1
+                if movesLeft[index] == 0:  # every move leads into a win of the opponent, this is the longest one
+                    values[index] = LOSS_BASE + plies + 1
+                    resolved[index] = 1
+                    nextFrontier.append(index)
+        if nextFrontier:
+            longest = plies + 1
+        frontier = nextFrontier
+        plies += 1
+
+    os.makedirs(directory, exist_ok=True)
+    with open(tablePath(directory, material), 'wb') as f:
+        f.write(MAGIC + material.encode().ljust(8, b'\0'))
+        f.write(values)
+    elapsed = time.perf_counter() - start
+    wins = sum(1 for value in values if 0 < value < LOSS_BASE)
+    losses = sum(1 for value in values if LOSS_BASE <= value < INVALID)
+    draws = sum(1 for value in values if value == DRAW)
+    print(material + ": " + str(TABLE_SIZE - values.count(INVALID)) + " positions, " + str(edges) + " moves, " +
+          str(wins) + " won, " + str(draws) + " drawn, " + str(losses) + " lost, longest mate " + str(longest) +
+          " plies. moves generated in " + format(generated, ".1f") + "s, " + format(elapsed, ".1f") + "s in total")
+    return bytes(values)
+
+
+def generateAll(directory, materials=MATERIALS, workers=None):
+    for material in MATERIALS:  # dependency order, whatever order they were asked in
+        if material in materials:
+            generateTable(material, directory, workers)
+
+
+"""
+prints the tablebase value of a position and the perfect line from it until the game ends
+"""
+def printLine(directory, fen, maxPlies=200):
+    gs = ChessEngine.GameState(fen)
+    with Tablebase(directory) as tablebase:
+        value = tablebase.probe(gs)
+        if value is None:
+            print("no table for " + fen)
+            return
+        result, plies = value
+        print({WIN: "win, mate in " + str(plies) + " plies", DRAW: "draw",
+               LOSS: "loss, mated in " + str(plies) + " plies"}[result])
+        line = []
+        while len(line) < (maxPlies if result != DRAW else 1):  # a drawn line never ends, only its first move
+            found = tablebase.bestMove(gs)
+            if found is None:
+                break
+            gs.makeMove(found[0])
+            line.append(found[0].getChessNotation())
+        print(" ".join(line) + (" (checkmate)" if gs.checkMate else ""))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="generate and probe KQK / KRK / KPK endgame tables")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generateParser = commands.add_parser("generate", help="retrograde generation on a process pool")
+    generateParser.add_argument("materials", nargs="*", default=list(MATERIALS), help="tables to make (default: all)")
+    generateParser.add_argument("--dir", default="tablebases")
+    generateParser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    probeParser = commands.add_parser("probe", help="value and perfect line of a position")
+    probeParser.add_argument("--dir", default="tablebases")
+    probeParser.add_argument("--fen", required=True)
+    args = parser.parse_args(argv)
+    if args.command == "generate":
+        unknown = [material for material in args.materials if material not in MATERIALS]
+        if unknown:
+            parser.error("no tables for " + " ".join(unknown) + ", only " + " ".join(MATERIALS))
+        generateAll(args.dir, args.materials, args.workers)
+    else:
+        printLine(args.dir, args.fen)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,403 @@
+"""
+engine against engine tournaments: two engine configurations play many games on a multiprocessing pool, the games
+are streamed to a pgn file as they finish and the result is reported as an Elo difference with a sequential
+probability ratio test (SPRT) that stops the match as soon as the evidence is strong enough either way.
+
+an engine is given as comma separated key=value pairs:
+    name=<name>              shown in the pgn and the report
+    depth=N, nodes=N, time=S limits of every search (default: depth 3)
+    hash=MB                  transposition table size
+    book=<file>              ChessBook opening book
+    tablebases=<directory>   ChessTablebase endgame tables
+    generator=legal|filter   GameState.useLegalGenerator, to match the two move generators against each other
+
+games come in pairs: both engines play the same opening once with each color. the openings are random legal moves
+from the starting position (--opening-plies), or the positions of a file with one fen per line. a game ends with
+checkmate or stalemate (GameState.checkMate / staleMate), and is adjudicated a draw on a threefold repetition,
+fifty moves without a capture or pawn move, two bare kings or when it reaches --max-plies.
+
+usage:
+    python ChessTournament.py --engine name=new,depth=3 --engine name=old,depth=2 --games 1000 --pgn games.pgn
+    python ChessTournament.py --engine name=legal,time=0.1 --engine name=filter,time=0.1,generator=filter \\
+        --games 2000 --elo0 0 --elo1 10 --workers 8
+"""
+import argparse
+import math
+import multiprocessing
+import queue
+import random
+import time
+
+import ChessEngine
+import ChessPgn
+import ChessSearch
+
+DEFAULT_GAMES = 1000
+DEFAULT_MAX_PLIES = 300
+DEFAULT_OPENING_PLIES = 8
+FIFTY_MOVE_PLIES = 100
+REPORT_EVERY = 20  # games between two progress lines
+SPRT_MIN_GAMES = 20  # the normal approximation of the llr needs some games before its variance can be trusted
+TASKS_PER_WORKER = 2  # games handed to the pool ahead of the results, so a worker never waits for its next game
+
+
+class EngineConfig():
+    def __init__(self, name, depth=None, nodes=None, timeLimit=None, hashMB=16, book=None, tablebases=None,
+                 legalGenerator=True):
+        self.name = name
+        self.depth = depth if depth is not None or nodes is not None or timeLimit is not None else 3
+        self.nodes = nodes
+        self.timeLimit = timeLimit
+        self.hashMB = hashMB
+        self.book = book  # path of a ChessBook file
+        self.tablebases = tablebases  # directory of ChessTablebase tables
+        self.legalGenerator = legalGenerator
+
+    """
+    an EngineConfig from "name=new,depth=3,hash=32" (see the module docstring), ValueError for anything else
+    """
+    @classmethod
+    def parse(cls, text):
+        fields = {}
+        for part in text.split(','):
+            key, separator, value = part.partition('=')
+            if not separator:
+                raise ValueError("engine fields are key=value: " + part)
+            fields[key.strip()] = value.strip()
+        unknown = set(fields) - {'name', 'depth', 'nodes', 'time', 'hash', 'book', 'tablebases', 'generator'}
+        if unknown:
+            raise ValueError("unknown engine field " + ", ".join(sorted(unknown)))
+        if fields.get('generator', 'legal') not in ('legal', 'filter'):
+            raise ValueError("generator is legal or filter")
+        return cls(fields.get('name', text), int(fields['depth']) if 'depth' in fields else None,
+                   int(fields['nodes']) if 'nodes' in fields else None,
+                   float(fields['time']) if 'time' in fields else None, int(fields.get('hash', 16)),
+                   fields.get('book'), fields.get('tablebases'), fields.get('generator', 'legal') == 'legal')
+
+    def __repr__(self):
+        limits = [key + "=" + str(value) for key, value in
+                  (('depth', self.depth), ('nodes', self.nodes), ('time', self.timeLimit)) if value is not None]
+        if not self.legalGenerator:
+            limits.append("generator=filter")
+        return self.name + "(" + ", ".join(limits) + ")"
+
+
+class GameRecord():
+    def __init__(self, number, white, black, result, termination, plies, seconds, pgn):
+        self.number = number
+        self.white = white  # engine index, 0 or 1
+        self.black = black
+        self.result = result  # '1-0', '0-1' or '1/2-1/2'
+        self.termination = termination  # checkmate, stalemate, repetition, fifty moves, material, move limit
+        self.plies = plies
+        self.seconds = seconds
+        self.pgn = pgn
+
+    """
+    points of engine 0 in this game: 1, 0.5 or 0
+    """
+    @property
+    def firstEngineScore(self):
+        if self.result == '1/2-1/2':
+            return 0.5
+        whiteWon = self.result == '1-0'
+        return 1.0 if whiteWon == (self.white == 0) else 0.0
+
+
+workerEngines = None  # per worker process: [(Searcher, EngineConfig)] of both engines, made by initWorker
+
+
+def initWorker(configs):
+    global workerEngines
+    workerEngines = []
+    for config in configs:
+        book = tablebase = None
+        if config.book:
+            import ChessBook
+            book = ChessBook.OpeningBook(config.book)
+        if config.tablebases:
+            import ChessTablebase
+            tablebase = ChessTablebase.Tablebase(config.tablebases)
+        workerEngines.append((ChessSearch.Searcher(config.hashMB, book=book, tablebase=tablebase), config))
+
+
+"""
+pool task: plays one game and returns its GameRecord. task = (game number, white engine index, start fen,
+opening moves in uci notation, max plies, round tag)
+"""
+def playGame(task):
+    number, white, startFen, openingMoves, maxPlies, roundTag = task
+    start = time.perf_counter()
+    gs = ChessEngine.GameState(startFen)
+    for notation in openingMoves:
+        gs.makeMove(findMove(gs, notation))
+    seen = {}  # zobrist key: times the position was on the board
+    quietPlies = 0  # plies since the last capture or pawn move
+    result = termination = None
+    while result is None:
+        seen[gs.zobristKey] = seen.get(gs.zobristKey, 0) + 1
+        validMoves = gs.getValidMoves()
+        if gs.checkMate:
+            result, termination = ('0-1' if gs.whiteToMove else '1-0'), "checkmate"
+        elif gs.staleMate:
+            result, termination = '1/2-1/2', "stalemate"
+        elif seen[gs.zobristKey] >= 3:
+            result, termination = '1/2-1/2', "repetition"
+        elif quietPlies >= FIFTY_MOVE_PLIES:
+            result, termination = '1/2-1/2', "fifty moves"
+        elif gs.occupied == gs.pieceBitboards['wK'] | gs.pieceBitboards['bK']:
+            result, termination = '1/2-1/2', "material"
+        elif len(gs.movelog) >= maxPlies:
+            result, termination = '1/2-1/2', "move limit"
+        else:
+            searcher, config = workerEngines[white if gs.whiteToMove else 1 - white]
+            gs.useLegalGenerator = config.legalGenerator
+            move = searcher.search(gs, config.depth, config.timeLimit, config.nodes).bestMove
+            gs.useLegalGenerator = True
+            quietPlies = 0 if move.pieceCaptured != "--" or move.pieceMoved[1] == 'p' else quietPlies + 1
+            gs.makeMove(move)
+    names = [config.name for searcher, config in workerEngines]
+    tags = {'Event': "ChessTournament", 'Site': "local", 'Date': time.strftime("%Y.%m.%d"), 'Round': roundTag,
+            'White': names[white], 'Black': names[1 - white], 'Termination': termination, 'PlyCount': len(gs.movelog)}
+    pgn = ChessPgn.gameToPgn(gs, tags, result)
+    for searcher, config in workerEngines:
+        searcher.tt.clear()  # every game starts with empty tables, so the games don't depend on each other
+    return GameRecord(number, white, 1 - white, result, termination, len(gs.movelog), time.perf_counter() - start, pgn)
+
+
+def findMove(gs, notation):
+    for move in gs.getValidMoves():
+        if move.getChessNotation() == notation:
+            return move
+    raise ValueError("illegal opening move " + notation + " in " + gs.getFen())
+
+
+"""
+a random opening: plies random legal moves from fen that don't end the game, as notations
+"""
+def randomOpening(rng, fen, plies):
+    while True:
+        gs = ChessEngine.GameState(fen)
+        moves = []
+        for ply in range(plies):
+            validMoves = gs.getValidMoves()
+            if not validMoves:
+                break
+            move = rng.choice(validMoves)
+            gs.makeMove(move)
+            moves.append(move.getChessNotation())
+        if gs.getValidMoves():
+            return moves
+
+
+"""
+the game tasks of a match: pairs of games on the same opening with the colors swapped. a generator, runMatch takes a
+few at a time so the openings of games a stopped match never plays aren't built
+"""
+def gameTasks(games, openingFens, openingPlies, maxPlies, seed):
+    rng = random.Random(seed)
+    for pair in range((games + 1) // 2):
+        fen = openingFens[pair % len(openingFens)] if openingFens else ChessEngine.START_FEN
+        moves = randomOpening(rng, fen, openingPlies) if openingPlies else []
+        for white in (0, 1):
+            number = pair * 2 + white
+            if number < games:
+                yield number, white, fen, moves, maxPlies, str(pair + 1) + "." + str(white + 1)
+
+
+"""
+expected score of a player rated elo points above the opponent
+"""
+def expectedScore(elo):
+    return 1.0 / (1.0 + 10.0 ** (-elo / 400.0))
+
+
+def scoreToElo(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400.0 * math.log10(1.0 / score - 1.0)
+
+
+class MatchStats():
+    def __init__(self, elo0=0.0, elo1=5.0, alpha=0.05, beta=0.05):
+        self.wins = self.draws = self.losses = 0  # from engine 0's point of view
+        self.elo0, self.elo1 = elo0, elo1
+        self.lowerBound = math.log(beta / (1 - alpha))  # LLR below this accepts H0 (engine 0 isn't elo1 better)
+        self.upperBound = math.log((1 - beta) / alpha)  # LLR above this accepts H1
+        self.terminations = {}
+        self.plies = 0
+
+    def add(self, record):
+        score = record.firstEngineScore
+        if score == 1.0:
+            self.wins += 1
+        elif score == 0.5:
+            self.draws += 1
+        else:
+            self.losses += 1
+        self.terminations[record.termination] = self.terminations.get(record.termination, 0) + 1
+        self.plies += record.plies
+
+    @property
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+    @property
+    def score(self):
+        return (self.wins + 0.5 * self.draws) / self.games if self.games else 0.5
+
+    """
+    variance of one game's score around the mean score (wins 1, draws 0.5, losses 0)
+    """
+    @property
+    def variance(self):
+        if not self.games:
+            return 0.0
+        mean = self.score
+        return (self.wins * (1 - mean) ** 2 + self.draws * (0.5 - mean) ** 2 + self.losses * mean ** 2) / self.games
+
+    """
+    (elo difference, half width of its 95% confidence interval) of engine 0 against engine 1
+    """
+    def elo(self):
+        if not self.games:
+            return 0.0, float('inf')
+        margin = 1.96 * math.sqrt(self.variance / self.games)
+        low, high = scoreToElo(self.score - margin), scoreToElo(self.score + margin)
+        return scoreToElo(self.score), (high - low) / 2
+
+    """
+    log likelihood ratio of H1 (engine 0 is elo1 better) against H0 (it's elo0 better), with the normal
+    approximation of the trinomial game results (the generalized SPRT)
+    """
+    def llr(self):
+        variance = self.variance
+        if not self.games or variance == 0:
+            return 0.0
+        s0, s1 = expectedScore(self.elo0), expectedScore(self.elo1)
+        return (s1 - s0) * (2 * self.score * self.games - (s0 + s1) * self.games) / (2 * variance)
+
+    """
+    'H1' or 'H0' once the LLR crosses a bound, None while the test goes on
+    """
+    def sprtDecision(self):
+        llr = self.llr()
+        if self.games < SPRT_MIN_GAMES:
+            return None
+        if llr >= self.upperBound:
+            return 'H1'
+        if llr <= self.lowerBound:
+            return 'H0'
+        return None
+
+    def summary(self):
+        elo, margin = self.elo()
+        return (str(self.games) + " games  +" + str(self.wins) + " =" + str(self.draws) + " -" + str(self.losses) +
+                "  score " + format(self.score * 100, ".1f") + "%  elo " + format(elo, "+.1f") + " +- " +
+                format(margin, ".1f") + "  llr " + format(self.llr(), ".2f") + " [" + format(self.lowerBound, ".2f") +
+                ", " + format(self.upperBound, ".2f") + "]")
+
+
+"""
+plays up to games games between configs[0] and configs[1] on a pool of workers. every finished game is appended to
+pgnPath (when given) at once, a progress line is printed every REPORT_EVERY games and the match stops early when
+the SPRT of elo0 against elo1 decides. only TASKS_PER_WORKER games per worker are handed to the pool at a time and
+the next one goes in as a result comes back (Pool.imap would drain every task up front), so the SPRT is checked
+after every game and an early stop leaves at most that many games unfinished. returns the MatchStats
+"""
+def runMatch(configs, games=DEFAULT_GAMES, workers=None, pgnPath=None, openingFens=None,
+             openingPlies=DEFAULT_OPENING_PLIES, maxPlies=DEFAULT_MAX_PLIES, elo0=0.0, elo1=5.0, alpha=0.05,
+             beta=0.05, seed=0, useSprt=True):
+    stats = MatchStats(elo0, elo1, alpha, beta)
+    workers = workers or multiprocessing.cpu_count()
+    print(repr(configs[0]) + " vs " + repr(configs[1]) + ": up to " + str(games) + " games on " + str(workers) +
+          " workers" + (", sprt elo0 " + format(elo0, "g") + " elo1 " + format(elo1, "g") if useSprt else ""))
+    pgnFile = open(pgnPath, 'w') if pgnPath else None
+    start = time.perf_counter()
+    decision = None
+    pool = multiprocessing.Pool(workers, initializer=initWorker, initargs=(configs,))
+    try:
+        tasks = gameTasks(games, openingFens, openingPlies, maxPlies, seed)
+        results = queue.Queue()  # records (or the exception of a failed game) as the workers finish them
+
+        def submit():  # hands the next game to the pool, False when there are none left
+            task = next(tasks, None)
+            if task is None:
+                return False
+            pool.apply_async(playGame, (task,), callback=results.put, error_callback=results.put)
+            return True
+
+        inFlight = 0
+        while inFlight < workers * TASKS_PER_WORKER and submit():
+            inFlight += 1
+        while inFlight:
+            record = results.get()
+            inFlight -= 1
+            if isinstance(record, BaseException):
+                raise record
+            stats.add(record)
+            if pgnFile:
+                pgnFile.write(record.pgn + "\n")
+                pgnFile.flush()
+            decision = stats.sprtDecision() if useSprt else None
+            if stats.games % REPORT_EVERY == 0 or decision or stats.games == games:
+                elapsed = time.perf_counter() - start
+                print(stats.summary() + "  " + format(stats.games * 3600 / elapsed, ",.0f") + " games/h", flush=True)
+            if decision:
+                break
+            if submit():
+                inFlight += 1
+    finally:
+        pool.terminate()  # an early stop leaves games running, their results aren't needed
+        pool.join()
+        if pgnFile:
+            pgnFile.close()
+    elapsed = time.perf_counter() - start
+    print("terminations: " + ", ".join(name + " " + str(count) for name, count in sorted(stats.terminations.items())))
+    print(str(stats.games) + " games, " + str(stats.plies) + " plies in " + format(elapsed, ".1f") + "s: " +
+          format(stats.games * 3600 / elapsed if elapsed > 0 else 0, ",.0f") + " games/h on " + str(workers) + " workers")
+    elo, margin = stats.elo()
+    if decision == 'H1':
+        print("sprt: H1 accepted, " + configs[0].name + " is stronger (at least " + format(elo1, "g") + " elo)")
+    elif decision == 'H0':
+        print("sprt: H0 accepted, " + configs[0].name + " is not " + format(elo1, "g") + " elo stronger")
+    elif useSprt:
+        print("sprt: no decision after " + str(stats.games) + " games")
+    print(configs[0].name + " vs " + configs[1].name + ": " + format(elo, "+.1f") + " +- " + format(margin, ".1f") + " elo")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="engine vs engine matches on a process pool, with Elo and SPRT")
+    parser.add_argument("--engine", action="append", required=True,
+                        help="engine configuration, twice (see the module docstring), e.g. name=new,depth=3")
+    parser.add_argument("--games", type=int, default=DEFAULT_GAMES, help="most games to play")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--pgn", help="file the finished games are written to")
+    parser.add_argument("--openings", help="one fen per line, used in turn as the start of the game pairs")
+    parser.add_argument("--opening-plies", type=int, default=DEFAULT_OPENING_PLIES,
+                        help="random moves played before the engines take over")
+    parser.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES, help="games this long are drawn")
+    parser.add_argument("--elo0", type=float, default=0.0, help="sprt: elo difference of H0")
+    parser.add_argument("--elo1", type=float, default=5.0, help="sprt: elo difference of H1")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--no-sprt", action="store_true", help="play every game instead of stopping on a decision")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random openings")
+    args = parser.parse_args(argv)
+    if len(args.engine) != 2:
+        parser.error("give exactly two --engine configurations")
+    try:
+        configs = [EngineConfig.parse(text) for text in args.engine]
+    except ValueError as error:
+        parser.error(str(error))
+    openingFens = None
+    if args.openings:
+        with open(args.openings) as f:
+            openingFens = [line.strip() for line in f if line.strip()]
+    runMatch(configs, args.games, args.workers, args.pgn, openingFens, args.opening_plies, args.max_plies,
+             args.elo0, args.elo1, args.alpha, args.beta, args.seed, not args.no_sprt)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,140 @@
+"""
+fixed size transposition table keyed by GameState.zobristHash. it remembers what a search found out about a position
+(depth, score, bound type and best move) so transposing positions aren't searched twice.
+
+the table is preallocated from a memory budget and never grows: every entry is two 64 bit integers in two arrays,
+the full hash (to tell positions that share a slot apart) and the packed data:
+    bits  0-31  score + 2**31 (so negative scores fit)
+    bits 32-39  depth
+    bits 40-41  bound type
+    bits 42-57  best move (see encodeMove, 0 = no move)
+    bit  58     set on every stored entry, so an empty slot (0) is never mistaken for one
+"""
+from array import array
+
+import ChessEngine
+
+ENTRY_BYTES = 16  # one key + one data word
+
+# bound types: the stored score is the exact value, or only a lower bound (fail high) / upper bound (fail low)
+BOUND_EXACT = 0
+BOUND_LOWER = 1
+BOUND_UPPER = 2
+
+# replacement policies for a slot that holds a different position
+REPLACE_DEPTH = 'depth'  # keep the entry that was searched deeper (ties go to the new entry)
+REPLACE_ALWAYS = 'always'  # the newest entry always wins
+
+SCORE_OFFSET = 1 << 31
+USED_BIT = 1 << 58
+
+
+"""
+packs a move into 16 bits: start square in the low 6 bits, end square in the next 6 (square = row * 8 + col),
+which is the low part of Move.moveID. start and end are enough to find the move again in a list of legal moves, see findMove.
+"""
+def encodeMove(move):
+    return move.moveID & ChessEngine.MOVE_SQUARES
+
+
+"""
+the move in moves that matches a code from encodeMove, or None
+"""
+def findMove(moves, code):
+    if code:
+        for move in moves:
+            if move.moveID & ChessEngine.MOVE_SQUARES == code:
+                return move
+    return None
+
+
+class TranspositionTable():
+    def __init__(self, sizeMB=16, replacement=REPLACE_DEPTH):
+        if replacement not in (REPLACE_DEPTH, REPLACE_ALWAYS):
+            raise ValueError("replacement must be " + repr(REPLACE_DEPTH) + " or " + repr(REPLACE_ALWAYS))
+        # the number of entries is the biggest power of two that fits the budget, so a slot is just hash & mask
+        entries = 1
+        while entries * 2 * ENTRY_BYTES <= sizeMB * 1024 * 1024:
+            entries *= 2
+        self.size = entries
+        self.mask = entries - 1
+        self.replacement = replacement
+        self.keys = array('Q', bytes(entries * 8))
+        self.data = array('Q', bytes(entries * 8))
+        self.resetStats()
+
+    def resetStats(self):
+        self.hits = 0  # probes that found their position
+        self.misses = 0  # probes that didn't
+        self.stores = 0  # entries written
+        self.overwrites = 0  # entries written over a different position
+        self.rejected = 0  # stores refused by the depth preferred policy
+
+    """
+    empties the table (and the statistics) without giving the memory back
+    """
+    def clear(self):
+        self.keys = array('Q', bytes(self.size * 8))
+        self.data = array('Q', bytes(self.size * 8))
+        self.resetStats()
+
+    @property
+    def memoryBytes(self):
+        return self.size * ENTRY_BYTES
+
+    """
+    looks a position up. returns (depth, score, bound, moveCode) or None when the position isn't in the table
+    """
+    def probe(self, key):
+        index = key & self.mask
+        if self.keys[index] == key:
+            data = self.data[index]
+            if data:
+                self.hits += 1
+                return ((data >> 32) & 0xFF, (data & 0xFFFFFFFF) - SCORE_OFFSET, (data >> 40) & 0x3, (data >> 42) & 0xFFFF)
+        self.misses += 1
+        return None
+
+    """
+    saves what a search found about a position. depth is clamped to 0-255, moveCode comes from encodeMove (0 = none)
+    """
+    def store(self, key, depth, score, bound, moveCode=0):
+        index = key & self.mask
+        oldData = self.data[index]
+        if oldData and self.keys[index] != key:  # the slot belongs to another position
+            if self.replacement == REPLACE_DEPTH and depth < (oldData >> 32) & 0xFF:
+                self.rejected += 1
+                return False
+            self.overwrites += 1
+        elif oldData and not moveCode:
+            moveCode = (oldData >> 42) & 0xFFFF  # same position: keep the best move we already knew
+        depth = min(max(depth, 0), 255)
+        self.keys[index] = key
+        self.data[index] = USED_BIT | moveCode << 42 | bound << 40 | depth << 32 | (score + SCORE_OFFSET)
+        self.stores += 1
+        return True
+
+    """
+    how full the table is in permille, estimated from the first 1000 slots (the same measure UCI's hashfull uses)
+    """
+    def hashfull(self):
+        sample = min(1000, self.size)
+        return sum(1 for i in range(sample) if self.data[i]) * 1000 // sample
+
+    """
+    snapshot of the table's counters as a dictionary
+    """
+    def getStats(self):
+        probes = self.hits + self.misses
+        return {
+            'entries': self.size,
+            'memoryBytes': self.memoryBytes,
+            'replacement': self.replacement,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / probes if probes else 0.0,
+            'stores': self.stores,
+            'overwrites': self.overwrites,
+            'rejected': self.rejected,
+            'hashfull': self.hashfull(),
+        }
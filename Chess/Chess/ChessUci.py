@@ -0,0 +1,303 @@
+"""
+UCI (universal chess interface) front end: reads commands on stdin and answers on stdout, so tournament managers,
+chess GUIs and other engines can drive ChessEngine + ChessSearch without pygame.
+
+supported: uci, isready, ucinewgame, setoption name Hash value <MB>, position startpos/fen <fen> [moves ...],
+go [depth N] [movetime ms] [nodes N] [wtime/btime/winc/binc/movestogo] [infinite], stop, quit, and d (prints the fen).
+moves are in long algebraic notation ("e2e4", promotions "e7e8q"). the engine doesn't castle and only promotes to a
+queen, so positions with those moves are refused with an "info string" line. setoption name BookFile value <path>
+plays from a ChessBook opening book while the position is in it (an empty value turns it off), setoption name
+TablebasePath value <directory> plays KQK / KRK / KPK endings perfectly from ChessTablebase tables.
+
+usage:
+    python ChessUci.py
+    python ChessUci.py --check          (a scripted session, checks the answers)
+"""
+import os
+import sys
+import threading
+
+import ChessEngine
+import ChessSearch
+
+ENGINE_NAME = "ChessEngine"
+ENGINE_AUTHOR = "Ohad"
+DEFAULT_HASH_MB = 16
+MAX_HASH_MB = 1024
+
+
+"""
+the long algebraic (uci) notation of a move, with the promotion piece
+"""
+def uciMove(move):
+    return move.getChessNotation() + ('q' if move.isPawnPromotion else '')
+
+
+"""
+the legal move of gs that a uci move string stands for. raises ValueError when there isn't one
+"""
+def parseUciMove(gs, text):
+    if len(text) == 5 and text[4] != 'q':
+        raise ValueError("only promotions to a queen are supported: " + text)
+    for move in gs.getValidMoves():
+        if move.getChessNotation() == text[:4] and (len(text) == 4 or move.isPawnPromotion):
+            return move
+    raise ValueError("illegal move " + text + " in " + gs.getFen())
+
+
+"""
+seconds to think from the go command's clock fields: an even share of the time left plus most of the increment,
+never more than half of what's left
+"""
+def timeForMove(timeLeft, increment, movesToGo):
+    budget = timeLeft / (movesToGo or 30) + increment * 0.8
+    return max(min(budget, timeLeft * 0.5), 1) / 1000.0
+
+
+class UciEngine():
+    def __init__(self, output=None):
+        self.output = output or sys.stdout
+        self.outputLock = threading.Lock()  # the search thread and the command loop both write
+        self.gs = ChessEngine.GameState()
+        self.positionValid = True  # False after a position command that was refused, until the next good one
+        self.book = None  # ChessBook.OpeningBook of the BookFile option
+        self.tablebase = None  # ChessTablebase.Tablebase of the TablebasePath option
+        self.searcher = ChessSearch.Searcher(DEFAULT_HASH_MB)
+        self.searchThread = None
+        self.stopEvent = threading.Event()  # an infinite search holds its bestmove back until stop sets this
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    """
+    handles one command line, returns False on quit
+    """
+    def handle(self, line):
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default " + str(DEFAULT_HASH_MB) + " min 1 max " + str(MAX_HASH_MB))
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")  # answered at once, even while searching
+        elif command == "ucinewgame":
+            self.stopSearch()
+            self.searcher.tt.clear()
+            self.gs = ChessEngine.GameState()
+            self.positionValid = True
+        elif command == "setoption":
+            self.stopSearch()
+            self.setOption(args)
+        elif command == "position":
+            self.stopSearch()
+            self.setPosition(args)
+        elif command == "go":
+            self.stopSearch()
+            self.go(args)
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "d":
+            self.send("info string fen " + self.gs.getFen())
+        elif command == "quit":
+            self.stopSearch()
+            return False
+        else:
+            self.send("info string unknown command " + command)
+        return True
+
+    def setOption(self, args):
+        if "name" in args and "value" in args:
+            name = " ".join(args[args.index("name") + 1:args.index("value")])
+            value = " ".join(args[args.index("value") + 1:])
+            if name.lower() == "hash":
+                try:
+                    self.searcher = ChessSearch.Searcher(min(max(int(value), 1), MAX_HASH_MB), book=self.book,
+                                                         tablebase=self.tablebase)
+                except ValueError:
+                    self.send("info string bad Hash value " + value)
+                return
+            if name.lower() == "bookfile":
+                self.setBook(value)
+                return
+            if name.lower() == "tablebasepath":
+                self.setTablebase(value)
+                return
+        self.send("info string unknown option " + " ".join(args))
+
+    def setBook(self, path):
+        if self.book is not None:
+            self.book.close()
+        self.book = None
+        if path and path != "<empty>":
+            import ChessBook
+            try:
+                self.book = ChessBook.OpeningBook(path)
+            except (OSError, ValueError) as error:
+                self.send("info string no book: " + str(error))
+        self.searcher.book = self.book
+
+    def setTablebase(self, directory):
+        if self.tablebase is not None:
+            self.tablebase.close()
+        self.tablebase = None
+        if directory and directory != "<empty>":
+            if os.path.isdir(directory):
+                import ChessTablebase
+                self.tablebase = ChessTablebase.Tablebase(directory)
+            else:
+                self.send("info string no tablebase directory " + directory)
+        self.searcher.tablebase = self.tablebase
+
+    """
+    position startpos [moves ...] / position fen <six fen fields> [moves ...]. a position that can't be set up
+    (a bad fen or a move the engine refuses) leaves no position at all: go answers bestmove 0000 until the next good
+    position command, instead of searching the previous one with the wrong side to move
+    """
+    def setPosition(self, args):
+        moves = args.index("moves") if "moves" in args else len(args)
+        try:
+            if args and args[0] == "startpos":
+                gs = ChessEngine.GameState()
+            elif args and args[0] == "fen":
+                gs = ChessEngine.GameState(" ".join(args[1:moves]))
+            else:
+                raise ValueError("position needs startpos or fen")
+            for text in args[moves + 1:]:
+                gs.makeMove(parseUciMove(gs, text))
+        except Exception as error:  # any bad input, one malformed line mustn't end the engine
+            self.positionValid = False
+            self.send("info string position refused, go answers bestmove 0000 until the next position: " + str(error))
+            return
+        self.gs = gs
+        self.positionValid = True
+
+    def go(self, args):
+        if not self.positionValid:
+            self.send("info string no valid position")
+            self.send("bestmove 0000")
+            return
+        limits = {}
+        for i in range(0, len(args) - 1):
+            if args[i] in ("depth", "movetime", "nodes", "wtime", "btime", "winc", "binc", "movestogo"):
+                try:
+                    limits[args[i]] = int(args[i + 1])
+                except ValueError:
+                    pass
+        maxDepth = limits.get("depth")
+        if maxDepth is not None:
+            maxDepth = max(maxDepth, 1)  # depth 0 (or less) searches one ply, it isn't an endless search
+        nodeLimit = limits.get("nodes")
+        timeLimit = None
+        if "movetime" in limits:
+            timeLimit = limits["movetime"] / 1000.0
+        elif ("wtime" if self.gs.whiteToMove else "btime") in limits:
+            side = "w" if self.gs.whiteToMove else "b"
+            timeLimit = timeForMove(limits[side + "time"], limits.get(side + "inc", 0), limits.get("movestogo"))
+        infinite = "infinite" in args or (maxDepth is None and timeLimit is None and nodeLimit is None)
+        if infinite:
+            maxDepth = ChessSearch.MAX_PLY  # until stop (or a mate that can't get better)
+        self.stopEvent.clear()
+        self.searchThread = threading.Thread(target=self.searchMain, args=(maxDepth, timeLimit, nodeLimit, infinite),
+                                             daemon=True)
+        self.searchThread.start()
+
+    def searchMain(self, maxDepth, timeLimit, nodeLimit, infinite):
+        result = self.searcher.search(self.gs, maxDepth, timeLimit, nodeLimit, self.sendInfo)
+        if result.fromBook:
+            self.send("info string book move")
+        if infinite:
+            self.stopEvent.wait()  # uci only wants the bestmove of an infinite search after stop
+        self.send("bestmove " + (uciMove(result.bestMove) if result.bestMove else "0000"))
+
+    def sendInfo(self, result):
+        mate = result.mateIn()
+        if mate is not None:  # uci counts mates in moves, mateIn in plies
+            score = "mate " + str((mate + 1) // 2 if mate > 0 else -((-mate + 1) // 2))
+        else:
+            score = "cp " + str(result.score)
+        self.send("info depth " + str(result.depth) + " score " + score + " nodes " + str(result.nodes) +
+                  " nps " + str(result.nps) + " time " + str(int(result.elapsed * 1000)) +
+                  " hashfull " + str(self.searcher.tt.hashfull()) +
+                  (" pv " + uciMove(result.bestMove) if result.bestMove else ""))
+
+    """
+    stops a running search and waits for its bestmove. stop() is repeated because a search that is only starting
+    clears the flag when it begins
+    """
+    def stopSearch(self):
+        self.stopEvent.set()
+        while self.searchThread is not None and self.searchThread.is_alive():
+            self.searcher.stop()
+            self.searchThread.join(0.05)
+        self.searchThread = None
+
+
+"""
+plays a scripted session against a UciEngine that writes to a buffer and checks the answers: the handshake, searches
+to a fixed depth (go depth 0 searches one ply and answers at once), a refused position answering bestmove 0000 and
+go infinite holding its bestmove until stop. returns the number of commands sent, raises AssertionError at the first
+wrong answer
+"""
+def checkSession():
+    import io
+    output = io.StringIO()
+    engine = UciEngine(output)
+    sent = 0
+
+    def answer(line, wait=True):  # sends line and returns the lines it (and the search it started) wrote
+        nonlocal sent
+        start = output.tell()
+        engine.handle(line)
+        sent += 1
+        if wait and engine.searchThread is not None:
+            engine.searchThread.join(30)
+            assert not engine.searchThread.is_alive(), line + " didn't finish"
+        return output.getvalue()[start:].splitlines()
+
+    assert answer("uci")[-1] == "uciok"
+    assert answer("isready") == ["readyok"]
+    answer("position startpos moves e2e4 e7e5")
+    lines = answer("go depth 2")
+    assert lines[-1].startswith("bestmove ") and lines[-1] != "bestmove 0000", lines
+    lines = answer("go depth 0")
+    assert [line.split()[2] for line in lines if line.startswith("info depth")] == ["1"], lines
+    assert lines[-1].startswith("bestmove ") and lines[-1] != "bestmove 0000", lines
+    answer("position fen 6k1/5ppp/8/8/8/8/5PPP/3R2K1 w - - 0 1")
+    assert answer("go depth 3")[-1] == "bestmove d1d8"
+    answer("position startpos moves e2e4 e1g1")
+    assert answer("go depth 1")[-2:] == ["info string no valid position", "bestmove 0000"]
+    answer("position startpos")
+    lines = answer("go infinite", wait=False)
+    assert not any(line.startswith("bestmove") for line in lines), lines
+    engine.searchThread.join(0.2)
+    assert engine.searchThread.is_alive(), "go infinite stopped on its own"
+    lines = answer("stop")
+    assert lines[-1].startswith("bestmove "), lines
+    assert answer("quit") == []
+    return sent
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if "--check" in argv:
+        print(str(checkSession()) + " commands answered as expected")
+        return 0
+    engine = UciEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stopSearch()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())